@@ -0,0 +1,43 @@
+"""Конкурентная активация одного чека: проверка отсутствия перевыдачи.
+
+Запуск: python -m benchmarks.bench_claim_check [claimers] [max_activations]
+"""
+import asyncio
+import sys
+import time
+from collections import Counter
+
+from benchmarks.common import prepared_database
+
+
+async def run(claimers=1000, max_activations=100, amount=10):
+    db = await prepared_database(claimers)
+    await db.create_check("BENCH", amount, "bananas", max_activations, 1)
+
+    started = time.perf_counter()
+    results = await asyncio.gather(
+        *(db.claim_check("BENCH", user_id) for user_id in range(1, claimers + 1))
+    )
+    elapsed = time.perf_counter() - started
+
+    statuses = Counter(status for status, _ in results)
+    check = await db.get_check("BENCH")
+    stats = await db.get_stats()
+    await db.close()
+
+    print(f"claimers={claimers} max_activations={max_activations}")
+    print(f"elapsed={elapsed:.3f}s rate={claimers / elapsed:.0f} claims/s")
+    print(f"statuses={dict(statuses)}")
+    print(f"activations={check['activations']} is_active={check['is_active']} "
+          f"credited={stats['total_bananas']}")
+
+    expected = min(claimers, max_activations)
+    assert statuses['ok'] == expected, "число успешных активаций не совпадает с лимитом"
+    assert check['activations'] == expected, "счетчик активаций превысил лимит"
+    assert stats['total_bananas'] == expected * amount, "начислено больше, чем разрешено"
+    assert stats['total_activations'] == expected
+
+
+if __name__ == "__main__":
+    args = [int(arg) for arg in sys.argv[1:]]
+    asyncio.run(run(*args))
@@ -0,0 +1,156 @@
+"""Микробенчмарки методов Database с выводом в JSON.
+
+Каждый метод вызывается iterations раз со случайными ключами, время
+каждого вызова меряется отдельно. JSON удобно сравнивать между
+коммитами: python -m benchmarks.bench_database --users 1000000 --out after.json
+
+База берется из --db (файл из benchmarks.datagen копируется, оригинал не
+меняется) или генерируется во временный каталог на --users пользователей.
+"""
+import argparse
+import asyncio
+import json
+import os
+import platform
+import random
+import shutil
+import sqlite3
+import subprocess
+import sys
+import time
+
+from benchmarks.common import temp_db_path
+from benchmarks.datagen import check_code, generate, plan, transaction_id, withdrawal_id
+from database import Database
+
+
+def _count(db_path, table):
+    conn = sqlite3.connect(db_path)
+    try:
+        return conn.execute(f"SELECT MAX(rowid) FROM {table}").fetchone()[0] or 0
+    finally:
+        conn.close()
+
+
+def benchmarks(counts):
+    """Список (имя, число вызовов, корутина от (db, rnd, i))"""
+    users = counts['users']
+    checks = counts['checks']
+    transactions = max(counts['transactions'], 1)
+    withdrawals = max(counts['withdrawals'], 1)
+    new_user = users + 1
+    return [
+        ('get_user', 2000, lambda db, rnd, i: db.get_user(rnd.randint(1, users))),
+        ('user_exists', 2000, lambda db, rnd, i: db.user_exists(rnd.randint(1, users))),
+        ('qk_exists', 2000, lambda db, rnd, i: db.qk_exists(f"qK-{rnd.randint(1, users):09d}")),
+        ('get_users_page', 500, lambda db, rnd, i: db.get_users_page(after=[rnd.randint(1, users)])),
+        ('get_users_page_search', 500, lambda db, rnd, i: db.get_users_page(f"user{rnd.randint(1, 999)}")),
+        ('get_check', 2000, lambda db, rnd, i: db.get_check(check_code(rnd.randrange(checks)))),
+        ('check_user_activated', 2000, lambda db, rnd, i: db.check_user_activated(
+            check_code(rnd.randrange(checks)), rnd.randint(1, users))),
+        ('get_check_claimers', 200, lambda db, rnd, i: db.get_check_claimers(check_code(rnd.randrange(checks)))),
+        ('get_transaction', 2000, lambda db, rnd, i: db.get_transaction(transaction_id(rnd.randrange(transactions)))),
+        ('get_withdrawal', 2000, lambda db, rnd, i: db.get_withdrawal(withdrawal_id(rnd.randrange(withdrawals)))),
+        ('get_stats', 2000, lambda db, rnd, i: db.get_stats()),
+        ('add_currency', 1000, lambda db, rnd, i: db.add_currency(rnd.randint(1, users), 'bananas', 1)),
+        ('update_user_currency', 1000, lambda db, rnd, i: db.update_user_currency(
+            rnd.randint(1, users), 'cakes', 5)),
+        ('activate_check', 1000, lambda db, rnd, i: db.activate_check(check_code(rnd.randrange(checks)), new_user + i)),
+        ('claim_check', 1000, lambda db, rnd, i: db.claim_check(check_code(rnd.randrange(checks)), new_user + i)),
+        ('upsert_user', 1000, lambda db, rnd, i: db.upsert_user(new_user + i, f"bench{i}", f"qK-B{i:08d}")),
+        ('compute_stats', 3, lambda db, rnd, i: db.compute_stats()),
+        ('get_all_users', 3, lambda db, rnd, i: db.get_all_users()),
+    ]
+
+
+def _summary(samples):
+    ordered = sorted(samples)
+    total = sum(ordered)
+
+    def percentile(p):
+        return ordered[min(len(ordered) - 1, round(p / 100 * (len(ordered) - 1)))]
+
+    return {
+        'iterations': len(ordered),
+        'mean_us': round(total / len(ordered) * 1e6, 2),
+        'p50_us': round(percentile(50) * 1e6, 2),
+        'p95_us': round(percentile(95) * 1e6, 2),
+        'p99_us': round(percentile(99) * 1e6, 2),
+        'ops_per_sec': round(len(ordered) / total) if total else None,
+    }
+
+
+def _commit():
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True, check=True
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+async def run(db_path, only=None, seed=1):
+    counts = {
+        'users': _count(db_path, "users"),
+        'checks': _count(db_path, "checks"),
+        'transactions': _count(db_path, "transactions"),
+        'withdrawals': _count(db_path, "withdrawals"),
+    }
+    # Без кэша пользователей: меряем запросы к базе, а не словарь в памяти
+    db = Database(db_path, user_cache_size=0, group_commit=False)
+    await db.connect()
+    rnd = random.Random(seed)
+
+    results = {}
+    for name, iterations, call in benchmarks(counts):
+        if only and name not in only:
+            continue
+        samples = []
+        for i in range(iterations):
+            started = time.perf_counter()
+            await call(db, rnd, i)
+            samples.append(time.perf_counter() - started)
+        results[name] = _summary(samples)
+    await db.close()
+
+    return {
+        'meta': {
+            'commit': _commit(),
+            'python': platform.python_version(),
+            'sqlite': sqlite3.sqlite_version,
+            **counts,
+        },
+        'results': results,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--db", help="база из benchmarks.datagen")
+    parser.add_argument("--users", type=int, default=10_000, help="размер временной базы, если --db не задан")
+    parser.add_argument("--only", nargs="*", help="запустить только эти методы")
+    parser.add_argument("--out", help="файл для JSON (по умолчанию stdout)")
+    args = parser.parse_args()
+
+    db_path = temp_db_path()
+    if args.db:
+        shutil.copyfile(args.db, db_path)
+    else:
+        asyncio.run(generate(db_path, args.users))
+        print(f"сгенерирована база: {plan(args.users)}", file=sys.stderr)
+
+    try:
+        report = asyncio.run(run(db_path, args.only))
+    finally:
+        shutil.rmtree(os.path.dirname(db_path))
+
+    text = json.dumps(report, ensure_ascii=False, indent=2)
+    if args.out:
+        with open(args.out, "w", encoding="utf-8") as f:
+            f.write(text + "\n")
+    else:
+        print(text)
+
+
+if __name__ == "__main__":
+    main()
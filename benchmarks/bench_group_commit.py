@@ -0,0 +1,48 @@
+"""Групповой коммит изменений баланса под конкурентной нагрузкой.
+
+Много корутин одновременно вызывают add_currency; сравниваются отдельный
+коммит на каждое изменение и GroupCommitWriter. Выводит изменения и
+коммиты в секунду.
+
+Запуск: python -m benchmarks.bench_group_commit [users] [clients] [mutations_per_client]
+"""
+import asyncio
+import sys
+import time
+
+from benchmarks.common import prepared_database
+
+
+async def client(db, user_ids, count):
+    for i in range(count):
+        await db.add_currency(user_ids[i % len(user_ids)], 'bananas', 1)
+
+
+async def measure(group_commit, users, clients, per_client):
+    db = await prepared_database(users, group_commit=group_commit)
+    user_ids = list(range(1, users + 1))
+    shards = [user_ids[i::clients] or user_ids for i in range(clients)]
+
+    started = time.perf_counter()
+    await asyncio.gather(*(client(db, shard, per_client) for shard in shards))
+    elapsed = time.perf_counter() - started
+
+    total = clients * per_client
+    commits = db.writer.commits if db.writer is not None else total
+    stats = await db.get_stats()
+    await db.close()
+    assert stats['total_bananas'] == total, stats
+    return elapsed, total, commits
+
+
+async def run(users=10000, clients=200, per_client=50):
+    print(f"users={users} clients={clients} mutations={clients * per_client}")
+    for name, group_commit in (("по коммиту", False), ("групповой", True)):
+        elapsed, total, commits = await measure(group_commit, users, clients, per_client)
+        print(f"{name:>10}: {total / elapsed:8.0f} mutations/s, {commits / elapsed:7.0f} commits/s, "
+              f"{total / commits:6.1f} изменений на коммит")
+
+
+if __name__ == "__main__":
+    args = [int(arg) for arg in sys.argv[1:]]
+    asyncio.run(run(*args))
@@ -0,0 +1,56 @@
+"""Пропускная способность регистрации при большом числе пользователей.
+
+Сравнивает старый путь (generate_qk_code с проверкой в базе + add_user)
+и выдачу кода из QkCodePool.
+
+Запуск: python -m benchmarks.bench_registration [existing_users] [registrations]
+"""
+import asyncio
+import sys
+import time
+
+from benchmarks.common import prepared_database
+from utils import QkCodePool, generate_qk_code
+
+
+async def register_with_lookup(db, user_ids):
+    for user_id in user_ids:
+        qk_code = await generate_qk_code(db)
+        await db.add_user(user_id, "bench", qk_code)
+
+
+async def register_with_pool(db, pool, user_ids):
+    for user_id in user_ids:
+        await db.add_user(user_id, "bench", pool.take())
+
+
+async def run(existing=1_000_000, registrations=5000):
+    db = await prepared_database(existing)
+    first_id = existing + 1
+
+    started = time.perf_counter()
+    await register_with_lookup(db, range(first_id, first_id + registrations))
+    lookup_elapsed = time.perf_counter() - started
+
+    pool = QkCodePool(db)
+    started = time.perf_counter()
+    await pool.start()
+    load_elapsed = time.perf_counter() - started
+
+    first_id += registrations
+    started = time.perf_counter()
+    await register_with_pool(db, pool, range(first_id, first_id + registrations))
+    pool_elapsed = time.perf_counter() - started
+
+    await pool.stop()
+    await db.close()
+
+    print(f"existing_users={existing} registrations={registrations}")
+    print(f"lookup: {lookup_elapsed:.3f}s, {registrations / lookup_elapsed:.0f} reg/s")
+    print(f"pool:   {pool_elapsed:.3f}s, {registrations / pool_elapsed:.0f} reg/s "
+          f"(загрузка индекса {load_elapsed:.3f}s)")
+
+
+if __name__ == "__main__":
+    args = [int(arg) for arg in sys.argv[1:]]
+    asyncio.run(run(*args))
@@ -0,0 +1,37 @@
+"""Сравнение get_stats (одна строка stats) с полным пересчетом агрегатами.
+
+Запуск: python -m benchmarks.bench_stats [users] [repeats]
+"""
+import asyncio
+import sys
+import time
+
+from benchmarks.common import prepared_database
+
+
+async def timed(repeats, func):
+    started = time.perf_counter()
+    for _ in range(repeats):
+        result = await func()
+    return (time.perf_counter() - started) / repeats, result
+
+
+async def run(users=1_000_000, repeats=20):
+    db = await prepared_database(users)
+    await db.add_currency(1, "bananas", 10)
+    await db.create_check("BENCH", 5, "stars", 10, 1)
+    await db.claim_check("BENCH", 2)
+
+    counters, stored = await timed(repeats, db.get_stats)
+    aggregates, computed = await timed(max(1, repeats // 5), db.compute_stats)
+    await db.close()
+
+    print(f"users={users}")
+    print(f"stats table: {counters * 1000:.3f} ms")
+    print(f"aggregates:  {aggregates * 1000:.3f} ms ({aggregates / counters:.0f}x)")
+    assert stored == computed, f"счетчики разошлись: {stored} != {computed}"
+
+
+if __name__ == "__main__":
+    args = [int(arg) for arg in sys.argv[1:]]
+    asyncio.run(run(*args))
@@ -0,0 +1,86 @@
+"""Масштабирование пропускной способности по числу процессов-обработчиков.
+
+Фронт получает апдейты через getUpdates фейкового Bot API и раскладывает
+их по процессам; время меряется до отправки ответа на каждый апдейт.
+
+Запуск: python -m benchmarks.bench_workers [--workers 1 2 4] [--updates 20000]
+"""
+import argparse
+import asyncio
+import os
+import shutil
+import time
+
+from benchmarks.common import fill_users, temp_db_path
+from benchmarks.fake_telegram import FakeTelegram, profile_updates
+
+
+async def run_once(workers, count, users, port):
+    import cfg
+    from aiogram import Bot
+    from aiogram.client.session.aiohttp import AiohttpSession
+    from aiogram.client.telegram import TelegramAPIServer
+    from sharding import run_sharded
+
+    fake = FakeTelegram(port=port)
+    await fake.start()
+
+    cfg.workers = workers
+    cfg.mode = "polling"
+    cfg.log_level = "WARNING"
+    cfg.api_server = fake.base_url
+    cfg.db_path = temp_db_path()
+    cfg.botapi = "42:BENCH"
+    # Лимиты OutboundLimiter далеко выше возможностей фейкового сервера:
+    # меряем масштабирование процессов, а не сам лимитер
+    cfg.send_rate = 10 ** 6
+    cfg.chat_send_rate = 10 ** 6
+    cfg.chat_send_burst = 10 ** 6
+
+    bot = Bot(cfg.botapi, session=AiohttpSession(api=TelegramAPIServer.from_base(cfg.api_server)))
+    stop = asyncio.Event()
+    front = asyncio.create_task(run_sharded(bot, ["message", "callback_query"], stop))
+
+    # create_tables выполняет фронт; ждем первого getUpdates — все процессы готовы
+    while not fake.calls.get('getupdates'):
+        await asyncio.sleep(0.05)
+    fill_users(cfg.db_path, users)
+
+    # Прогрев процессов и их соединений с базой; кэш пользователей в них отключен
+    fake.feed(profile_updates(users, users, start_id=1))
+    await fake.wait_sent(users)
+
+    fake.feed(profile_updates(count, users, start_id=users + 1))
+    started = time.perf_counter()
+    await fake.wait_sent(users + count)
+    elapsed = time.perf_counter() - started
+
+    stop.set()
+    await front
+    await bot.session.close()
+    await fake.stop()
+    shutil.rmtree(os.path.dirname(cfg.db_path))
+    return elapsed
+
+
+async def run(worker_counts, count, users, port):
+    baseline = None
+    for workers in worker_counts:
+        elapsed = await run_once(workers, count, users, port)
+        rate = count / elapsed
+        baseline = baseline or rate
+        print(f"workers={workers}: {rate:.0f} upd/s ({rate / baseline:.2f}x)")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--workers", type=int, nargs="+", default=[1, 2, 4])
+    parser.add_argument("--updates", type=int, default=20000)
+    parser.add_argument("--users", type=int, default=2000)
+    parser.add_argument("--port", type=int, default=8081)
+    args = parser.parse_args()
+    asyncio.run(run(args.workers, args.updates, args.users, args.port))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,38 @@
+import os
+import sqlite3
+import tempfile
+from datetime import datetime
+
+from database import Database
+
+
+def temp_db_path(name="bench.db"):
+    """Путь к временной базе для бенчмарка"""
+    directory = tempfile.mkdtemp(prefix="bot-bench-")
+    return os.path.join(directory, name)
+
+
+def fill_users(db_path, count, start_id=1, batch_size=50000):
+    """Быстро заполняет таблицу users синхронным sqlite3"""
+    now = datetime.now().isoformat()
+    conn = sqlite3.connect(db_path)
+    try:
+        for offset in range(0, count, batch_size):
+            ids = range(start_id + offset, start_id + min(offset + batch_size, count))
+            conn.executemany(
+                '''INSERT INTO users (user_id, username, qk_code, registration_date)
+                   VALUES (?, ?, ?, ?)''',
+                ((i, f"user{i}", f"qK-{i:09d}", now) for i in ids)
+            )
+            conn.commit()
+    finally:
+        conn.close()
+
+
+async def prepared_database(count=0, **kwargs):
+    """Создает пустую базу со схемой и count пользователями"""
+    db = Database(temp_db_path(), **kwargs)
+    await db.create_tables()
+    if count:
+        fill_users(db.db_path, count)
+    return db
@@ -0,0 +1,153 @@
+"""Генератор баз в формате bot.db для бенчмарков на 10k, 1M и 10M пользователей.
+
+Кроме пользователей создает пропорциональное число чеков, активаций,
+транзакций и заявок на вывод. Ключи детерминированы (CHK00000001,
+TX0000000001, WD-00000001), поэтому бенчмарки могут обращаться к ним
+без чтения базы. Счетчики stats поддерживаются триггерами схемы.
+
+Запуск: python -m benchmarks.datagen --scale 1m --out /tmp/bot-1m.db
+"""
+import argparse
+import asyncio
+import os
+import random
+import sqlite3
+import time
+from datetime import datetime, timedelta
+
+from benchmarks.common import fill_users
+from database import CHECK_CURRENCIES, Database
+
+SCALES = {'10k': 10_000, '1m': 1_000_000, '10m': 10_000_000}
+
+# Доли от числа пользователей
+CHECKS_PER_USER = 0.001
+ACTIVATIONS_PER_USER = 0.5
+TRANSACTIONS_PER_USER = 0.2
+WITHDRAWALS_PER_USER = 0.05
+
+BATCH_SIZE = 50000
+
+
+def check_code(index):
+    return f"CHK{index:08d}"
+
+
+def transaction_id(index):
+    return f"TX{index:010d}"
+
+
+def withdrawal_id(index):
+    return f"WD-{index:08d}"
+
+
+def plan(users):
+    """Сколько строк каждой таблицы создается для users пользователей"""
+    checks = max(1, int(users * CHECKS_PER_USER))
+    return {
+        'users': users,
+        'checks': checks,
+        'activations': min(int(users * ACTIVATIONS_PER_USER), checks * users),
+        'transactions': int(users * TRANSACTIONS_PER_USER),
+        'withdrawals': int(users * WITHDRAWALS_PER_USER),
+    }
+
+
+def _batches(count, make_row):
+    for offset in range(0, count, BATCH_SIZE):
+        yield [make_row(i) for i in range(offset, min(offset + BATCH_SIZE, count))]
+
+
+def fill_related(db_path, counts, seed=1):
+    """Заполняет чеки, активации, транзакции и выводы синхронным sqlite3"""
+    rnd = random.Random(seed)
+    users = counts['users']
+    checks = counts['checks']
+    started_at = datetime.now() - timedelta(days=30)
+
+    def date(i, total):
+        return (started_at + timedelta(seconds=30 * 24 * 3600 * i / max(total, 1))).isoformat()
+
+    # Активация j принадлежит чеку j % checks и пользователю j // checks + 1: пары уникальны
+    activations_per_check = [0] * checks
+    for j in range(counts['activations']):
+        activations_per_check[j % checks] += 1
+
+    conn = sqlite3.connect(db_path)
+    try:
+        conn.executemany(
+            '''INSERT INTO checks (code, amount, currency, activations, max_activations,
+                                   creator_id, created_date, is_active)
+               VALUES (?, ?, ?, ?, ?, ?, ?, ?)''',
+            [
+                (check_code(i), rnd.randint(1, 100), rnd.choice(CHECK_CURRENCIES),
+                 activations_per_check[i], activations_per_check[i] + rnd.randint(0, 100),
+                 2200183708, date(i, checks), 1)
+                for i in range(checks)
+            ]
+        )
+        conn.commit()
+
+        for rows in _batches(counts['activations'], lambda j: (
+                check_code(j % checks), j // checks + 1, date(j, counts['activations']))):
+            conn.executemany(
+                "INSERT INTO check_activations (check_code, user_id, activation_date) VALUES (?, ?, ?)",
+                rows
+            )
+            conn.commit()
+
+        for rows in _batches(counts['transactions'], lambda i: (
+                rnd.randint(1, users), rnd.choice((100, 150, 500, 1000)), transaction_id(i),
+                rnd.choice(('completed', 'completed', 'pending', 'expired')),
+                rnd.choice(('deposit', 'deposit', 'support')), date(i, counts['transactions']))):
+            conn.executemany(
+                '''INSERT INTO transactions (user_id, amount, transaction_id, status, payment_type, created_date)
+                   VALUES (?, ?, ?, ?, ?, ?)''',
+                rows
+            )
+            conn.commit()
+
+        for rows in _batches(counts['withdrawals'], lambda i: (
+                rnd.randint(1, users), rnd.randint(100, 1000), withdrawal_id(i),
+                rnd.choice(('pending', 'approved', 'approved', 'rejected')), date(i, counts['withdrawals']))):
+            conn.executemany(
+                '''INSERT INTO withdrawals (user_id, amount, withdrawal_id, status, created_date)
+                   VALUES (?, ?, ?, ?, ?)''',
+                rows
+            )
+            conn.commit()
+    finally:
+        conn.close()
+
+
+async def generate(db_path, users, seed=1):
+    """Создает базу со схемой Database и данными для users пользователей"""
+    db = Database(db_path)
+    await db.create_tables()
+    await db.close()
+
+    counts = plan(users)
+    fill_users(db_path, users)
+    fill_related(db_path, counts, seed)
+    return counts
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--scale", choices=SCALES, default="10k")
+    parser.add_argument("--users", type=int, help="точное число пользователей вместо --scale")
+    parser.add_argument("--out", required=True, help="путь к новой базе")
+    parser.add_argument("--seed", type=int, default=1)
+    args = parser.parse_args()
+
+    if os.path.exists(args.out):
+        parser.error(f"{args.out} уже существует")
+
+    started = time.perf_counter()
+    counts = asyncio.run(generate(args.out, args.users or SCALES[args.scale], args.seed))
+    print(", ".join(f"{name}={count}" for name, count in counts.items()))
+    print(f"готово за {time.perf_counter() - started:.1f}s: {args.out}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,256 @@
+"""Локальная замена Bot API и нагрузочный прогон polling против webhook.
+
+Сервер отвечает на методы бота фиктивными объектами, отдает синтетические
+апдейты через getUpdates и умеет слать их POST-запросами на вебхук.
+
+Запуск: python -m benchmarks.fake_telegram [--mode both] [--updates 20000]
+"""
+import argparse
+import asyncio
+import itertools
+import json
+import os
+import shutil
+import time
+from collections import deque
+
+from aiohttp import ClientSession, TCPConnector, web
+
+from benchmarks.common import temp_db_path
+
+BOT_USER = {'id': 42, 'is_bot': True, 'first_name': 'Bench', 'username': 'bench_bot'}
+
+
+def message_update(update_id, user_id, text):
+    """Синтетический апдейт с текстовым сообщением"""
+    return {
+        'update_id': update_id,
+        'message': {
+            'message_id': update_id,
+            'date': int(time.time()),
+            'chat': {'id': user_id, 'type': 'private'},
+            'from': {'id': user_id, 'is_bot': False, 'first_name': 'User', 'username': f'user{user_id}'},
+            'text': text
+        }
+    }
+
+
+def callback_update(update_id, user_id, data):
+    """Синтетический апдейт с нажатием инлайн кнопки"""
+    return {
+        'update_id': update_id,
+        'callback_query': {
+            'id': str(update_id),
+            'chat_instance': str(user_id),
+            'data': data,
+            'from': {'id': user_id, 'is_bot': False, 'first_name': 'User', 'username': f'user{user_id}'},
+            'message': {
+                'message_id': update_id,
+                'date': int(time.time()),
+                'chat': {'id': user_id, 'type': 'private'},
+                'text': 'bench'
+            }
+        }
+    }
+
+
+def profile_updates(count, users, start_id=1):
+    """Поток нажатий «Профиль» от users разных пользователей"""
+    user_ids = itertools.cycle(range(1, users + 1))
+    return [message_update(start_id + i, next(user_ids), "👤 Профиль") for i in range(count)]
+
+
+class FakeTelegram:
+    """Минимальный Bot API: считает вызовы и отдает апдейты для getUpdates"""
+
+    def __init__(self, host="127.0.0.1", port=8081, batch_size=100):
+        self.host = host
+        self.port = port
+        self.batch_size = batch_size
+        self.calls = {}
+        self.sent = 0
+        self.updates = deque()
+        self._sent_event = asyncio.Event()
+        self._sent_target = None
+        self._runner = None
+
+    @property
+    def base_url(self):
+        return f"http://{self.host}:{self.port}"
+
+    async def start(self):
+        app = web.Application()
+        app.router.add_route("POST", "/bot{token}/{method}", self._handle)
+        self._runner = web.AppRunner(app, access_log=None)
+        await self._runner.setup()
+        await web.TCPSite(self._runner, self.host, self.port).start()
+
+    async def stop(self):
+        if self._runner is not None:
+            await self._runner.cleanup()
+
+    def feed(self, updates):
+        self.updates.extend(updates)
+
+    async def wait_sent(self, count):
+        """Ждет, пока бот отправит count сообщений"""
+        self._sent_target = count
+        if self.sent < count:
+            self._sent_event.clear()
+            await self._sent_event.wait()
+
+    async def _handle(self, request):
+        method = request.match_info['method'].lower()
+        self.calls[method] = self.calls.get(method, 0) + 1
+        if request.content_type == 'application/json':
+            params = await request.json()
+        else:
+            params = dict(await request.post())
+
+        if method == 'getupdates':
+            result = await self._get_updates(params)
+        elif method == 'getme':
+            result = BOT_USER
+        elif method in ('sendmessage', 'editmessagetext', 'senddocument', 'copymessage'):
+            result = self._message(params)
+            self.sent += 1
+            if self._sent_target is not None and self.sent >= self._sent_target:
+                self._sent_event.set()
+        elif method == 'createinvoicelink':
+            result = "https://t.me/$bench"
+        else:
+            result = True
+        return web.json_response({'ok': True, 'result': result})
+
+    async def _get_updates(self, params):
+        # Как и настоящий API: offset подтверждает все апдейты с меньшим id
+        offset = int(params.get('offset') or 0)
+        while self.updates and self.updates[0]['update_id'] < offset:
+            self.updates.popleft()
+        batch = list(itertools.islice(self.updates, self.batch_size))
+        if not batch:
+            await asyncio.sleep(0.05)
+        return batch
+
+    @staticmethod
+    def _message(params):
+        chat_id = int(params.get('chat_id') or 0)
+        return {
+            'message_id': 1,
+            'date': int(time.time()),
+            'chat': {'id': chat_id, 'type': 'private'},
+            'text': str(params.get('text', ''))
+        }
+
+
+async def post_updates(url, updates, concurrency=100, secret=None):
+    """Шлет апдейты на вебхук с ограничением числа одновременных запросов"""
+    headers = {'X-Telegram-Bot-Api-Secret-Token': secret} if secret else {}
+    queue = iter(updates)
+
+    async def worker(session):
+        for update in queue:
+            async with session.post(url, data=json.dumps(update), headers={
+                **headers, 'Content-Type': 'application/json'
+            }) as response:
+                await response.read()
+
+    async with ClientSession(connector=TCPConnector(limit=concurrency)) as session:
+        await asyncio.gather(*(worker(session) for _ in range(concurrency)))
+
+
+async def prepare_bot(fake):
+    """Поднимает бота из handlers поверх фейкового API на временной базе"""
+    import cfg
+    cfg.db_path = temp_db_path()
+    cfg.api_server = fake.base_url
+
+    from aiogram import Bot, Dispatcher
+    from aiogram.client.session.aiohttp import AiohttpSession
+    from aiogram.client.telegram import TelegramAPIServer
+    import handlers
+
+    await handlers.db.connect()
+    await handlers.db.create_tables()
+    await handlers.check_cache.start()
+    await handlers.qk_pool.start()
+
+    bot = Bot("42:BENCH", session=AiohttpSession(api=TelegramAPIServer.from_base(cfg.api_server)))
+    dp = Dispatcher()
+    dp.include_router(handlers.router)
+    return handlers, bot, dp
+
+
+async def bench_polling(fake, bot, dp, updates):
+    fake.feed(updates)
+    started = time.perf_counter()
+    polling = asyncio.create_task(dp.start_polling(bot, handle_signals=False, polling_timeout=1))
+    await fake.wait_sent(fake.sent + len(updates))
+    elapsed = time.perf_counter() - started
+    await dp.stop_polling()
+    await polling
+    return elapsed
+
+
+async def bench_webhook(fake, bot, dp, updates, concurrency):
+    import cfg
+    from webhook import build_app
+
+    runner = web.AppRunner(build_app(dp, bot), keepalive_timeout=cfg.webhook_keepalive, access_log=None)
+    await runner.setup()
+    await web.TCPSite(runner, "127.0.0.1", cfg.webhook_port).start()
+    try:
+        started = time.perf_counter()
+        await post_updates(
+            f"http://127.0.0.1:{cfg.webhook_port}{cfg.webhook_path}",
+            updates, concurrency, cfg.webhook_secret
+        )
+        elapsed = time.perf_counter() - started
+    finally:
+        await runner.cleanup()
+    return elapsed
+
+
+async def run(mode, count, users, concurrency, port):
+    import logging
+    logging.disable(logging.INFO)
+
+    fake = FakeTelegram(port=port)
+    await fake.start()
+    handlers, bot, dp = await prepare_bot(fake)
+
+    # Прогрев: регистрация пользователей, чтобы мерить обычный путь
+    await bench_webhook(fake, bot, dp, profile_updates(users, users, start_id=10 ** 8), concurrency)
+
+    results = {}
+    if mode in ("polling", "both"):
+        results['polling'] = await bench_polling(fake, bot, dp, profile_updates(count, users))
+    if mode in ("webhook", "both"):
+        results['webhook'] = await bench_webhook(
+            fake, bot, dp, profile_updates(count, users, start_id=count + 1), concurrency
+        )
+
+    for name, elapsed in results.items():
+        print(f"{name}: {count} апдейтов за {elapsed:.2f}s, {count / elapsed:.0f} upd/s")
+
+    await handlers.qk_pool.stop()
+    await handlers.check_cache.stop()
+    await handlers.db.close()
+    await bot.session.close()
+    await fake.stop()
+    shutil.rmtree(os.path.dirname(handlers.db.db_path))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--mode", choices=("polling", "webhook", "both"), default="both")
+    parser.add_argument("--updates", type=int, default=20000)
+    parser.add_argument("--users", type=int, default=1000)
+    parser.add_argument("--concurrency", type=int, default=100)
+    parser.add_argument("--port", type=int, default=8081)
+    args = parser.parse_args()
+    asyncio.run(run(args.mode, args.updates, args.users, args.concurrency, args.port))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,229 @@
+"""Нагрузочный прогон роутера handlers без Telegram.
+
+Синтетические апдейты (регистрация, /start с чеком, активация чека,
+пополнение с оплатой) проходят через Dispatcher.feed_update, а запросы
+к Bot API отвечает фейковая сессия в памяти. Выводит пропускную
+способность сценариев и p50/p95/p99 по каждому хендлеру.
+
+Запуск: python -m benchmarks.load_test [--users 2000] [--concurrency 100] [--json]
+"""
+import argparse
+import asyncio
+import json
+import os
+import shutil
+import time
+from datetime import datetime
+from typing import Any, Awaitable, Callable, Dict
+
+from aiogram import BaseMiddleware
+from aiogram.client.session.base import BaseSession
+from aiogram.methods import CreateInvoiceLink, GetMe
+from aiogram.types import CallbackQuery, Chat, Message, SuccessfulPayment, TelegramObject, Update, User
+
+from benchmarks.common import temp_db_path
+
+BOT_USER = User(id=42, is_bot=True, first_name="Bench", username="bench_bot")
+CHECK_CODE = "LOADTEST"
+INVOICE_PREFIX = "https://t.me/$bench-"
+
+
+class LocalSession(BaseSession):
+    """Сессия Bot API, отвечающая в памяти; запоминает счета, отправленные в чаты"""
+
+    def __init__(self):
+        super().__init__()
+        self.calls = 0
+        self.invoices = {}
+        self.chat_invoices = {}
+
+    async def close(self):
+        pass
+
+    async def stream_content(self, url, headers=None, timeout=30, chunk_size=65536, raise_for_status=True):
+        yield b""
+
+    async def make_request(self, bot, method, timeout=None):
+        self.calls += 1
+        if isinstance(method, GetMe):
+            return BOT_USER
+        if isinstance(method, CreateInvoiceLink):
+            self.invoices[method.payload] = method.prices[0].amount
+            return INVOICE_PREFIX + method.payload
+        if method.__returning__ is bool:
+            return True
+        chat_id = getattr(method, 'chat_id', None) or 0
+        text = getattr(method, 'text', None) or ""
+        if INVOICE_PREFIX in text:
+            payload = text.split(INVOICE_PREFIX, 1)[1].split(")", 1)[0]
+            self.chat_invoices[chat_id] = (payload, self.invoices.pop(payload))
+        return Message(message_id=1, date=datetime.now(), chat=Chat(id=chat_id, type="private"), text="ok")
+
+
+class LatencyRecorder(BaseMiddleware):
+    """Внутренний middleware: сохраняет длительность каждого вызова хендлера"""
+
+    def __init__(self):
+        self.samples = {}
+
+    async def __call__(
+        self,
+        handler: Callable[[TelegramObject, Dict[str, Any]], Awaitable[Any]],
+        event: TelegramObject,
+        data: Dict[str, Any]
+    ) -> Any:
+        started = time.perf_counter()
+        try:
+            return await handler(event, data)
+        finally:
+            name = data["handler"].callback.__name__
+            self.samples.setdefault(name, []).append(time.perf_counter() - started)
+
+
+class Updates:
+    """Фабрика синтетических апдейтов с уникальными update_id"""
+
+    def __init__(self):
+        self.next_id = 0
+
+    def _id(self):
+        self.next_id += 1
+        return self.next_id
+
+    @staticmethod
+    def _user(user_id):
+        return User(id=user_id, is_bot=False, first_name="User", username=f"user{user_id}")
+
+    def message(self, user_id, text=None, **kwargs):
+        update_id = self._id()
+        return Update(update_id=update_id, message=Message(
+            message_id=update_id, date=datetime.now(), chat=Chat(id=user_id, type="private"),
+            from_user=self._user(user_id), text=text, **kwargs
+        ))
+
+    def callback(self, user_id, data):
+        update_id = self._id()
+        return Update(update_id=update_id, callback_query=CallbackQuery(
+            id=str(update_id), chat_instance=str(user_id), data=data, from_user=self._user(user_id),
+            message=Message(message_id=update_id, date=datetime.now(), chat=Chat(id=user_id, type="private"),
+                            text="check")
+        ))
+
+    def payment(self, user_id, payload, amount):
+        return self.message(user_id, successful_payment=SuccessfulPayment(
+            currency="XTR", total_amount=amount, invoice_payload=payload,
+            telegram_payment_charge_id=f"charge-{payload}", provider_payment_charge_id=""
+        ))
+
+
+async def registration(dp, bot, updates, user_id):
+    await dp.feed_update(bot, updates.message(user_id, "/start"))
+
+
+async def check_activation(dp, bot, updates, user_id):
+    await dp.feed_update(bot, updates.message(user_id, f"/start {CHECK_CODE}"))
+    await dp.feed_update(bot, updates.callback(user_id, f"activate_{CHECK_CODE}"))
+
+
+async def deposit(dp, bot, updates, user_id):
+    await dp.feed_update(bot, updates.message(user_id, "💰 Пополнить"))
+    await dp.feed_update(bot, updates.message(user_id, "200"))
+    invoice = bot.session.chat_invoices.pop(user_id, None)
+    if invoice is not None:
+        await dp.feed_update(bot, updates.payment(user_id, *invoice))
+
+
+SCENARIOS = {
+    'registration': registration,
+    'check_activation': check_activation,
+    'deposit': deposit,
+}
+
+
+async def run_scenario(scenario, dp, bot, updates, user_ids, concurrency):
+    semaphore = asyncio.Semaphore(concurrency)
+
+    async def one(user_id):
+        async with semaphore:
+            await scenario(dp, bot, updates, user_id)
+
+    first_update = updates.next_id
+    started = time.perf_counter()
+    await asyncio.gather(*(one(user_id) for user_id in user_ids))
+    return time.perf_counter() - started, updates.next_id - first_update
+
+
+def percentile(samples, p):
+    ordered = sorted(samples)
+    return ordered[min(len(ordered) - 1, round(p / 100 * (len(ordered) - 1)))]
+
+
+async def run(users, concurrency, as_json):
+    import logging
+    logging.disable(logging.INFO)
+
+    import cfg
+    cfg.db_path = temp_db_path()
+
+    from aiogram import Bot, Dispatcher
+    import handlers
+
+    await handlers.db.connect()
+    await handlers.db.create_tables()
+    await handlers.check_cache.start()
+    await handlers.qk_pool.start()
+    await handlers.db.create_check(CHECK_CODE, 1, 'bananas', users, cfg.admin_id)
+
+    recorder = LatencyRecorder()
+    handlers.router.message.middleware(recorder)
+    handlers.router.callback_query.middleware(recorder)
+
+    bot = Bot("42:BENCH", session=LocalSession())
+    dp = Dispatcher()
+    dp.include_router(handlers.router)
+    updates = Updates()
+
+    results = {'users': users, 'concurrency': concurrency, 'scenarios': {}, 'handlers': {}}
+    # Первый сценарий регистрирует пользователей, остальные идут по уже известным
+    for name, scenario in SCENARIOS.items():
+        elapsed, count = await run_scenario(scenario, dp, bot, updates, range(1, users + 1), concurrency)
+        results['scenarios'][name] = {
+            'updates': count,
+            'seconds': round(elapsed, 3),
+            'updates_per_second': round(count / elapsed)
+        }
+
+    for name, samples in sorted(recorder.samples.items()):
+        results['handlers'][name] = {
+            'count': len(samples),
+            **{f"p{p}_ms": round(percentile(samples, p) * 1000, 3) for p in (50, 95, 99)}
+        }
+
+    await handlers.check_cache.stop()
+    await handlers.qk_pool.stop()
+    await handlers.db.close()
+    shutil.rmtree(os.path.dirname(handlers.db.db_path))
+
+    if as_json:
+        print(json.dumps(results, ensure_ascii=False, indent=2))
+        return
+
+    print(f"users={users} concurrency={concurrency} bot_api_calls={bot.session.calls}")
+    for name, row in results['scenarios'].items():
+        print(f"{name:>18}: {row['updates']} апдейтов за {row['seconds']:.2f}s, {row['updates_per_second']} upd/s")
+    print(f"\n{'handler':>30} {'count':>7} {'p50 ms':>8} {'p95 ms':>8} {'p99 ms':>8}")
+    for name, row in results['handlers'].items():
+        print(f"{name:>30} {row['count']:>7} {row['p50_ms']:>8.2f} {row['p95_ms']:>8.2f} {row['p99_ms']:>8.2f}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--users", type=int, default=2000)
+    parser.add_argument("--concurrency", type=int, default=100)
+    parser.add_argument("--json", action="store_true", help="вывести результат в JSON")
+    args = parser.parse_args()
+    asyncio.run(run(args.users, args.concurrency, args.json))
+
+
+if __name__ == "__main__":
+    main()
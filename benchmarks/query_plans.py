@@ -0,0 +1,191 @@
+"""Проверка планов запросов Database через EXPLAIN QUERY PLAN.
+
+Вызывает каждый публичный метод Database на заполненной базе, перехватывает
+весь SQL через trace callback соединений и строит план каждого запроса.
+Завершается с кодом 1, если запрос читает таблицу полным сканированием
+(кроме методов, которые обходят таблицу целиком по назначению) или если
+у публичного метода Database нет вызова в этом файле.
+Та же проверка на небольшой базе входит в тесты: tests/test_query_plans.py.
+
+Запуск: python -m benchmarks.query_plans [--users 5000] [--db bot.db] [-v]
+"""
+import argparse
+import asyncio
+import inspect
+import os
+import shutil
+import sqlite3
+import sys
+
+from benchmarks.common import temp_db_path
+from benchmarks.datagen import check_code, generate, transaction_id, withdrawal_id
+from database import Database
+
+# Методы, которые вызываются на каждый апдейт: полное сканирование здесь — ошибка
+HOT_PATH = {
+    'get_user': lambda db: db.get_user(2),
+    'get_bot_user': lambda db: db.get_bot_user(12),
+    'get_check': lambda db: db.get_check(check_code(0)),
+    'check_user_activated': lambda db: db.check_user_activated(check_code(0), 2),
+    'get_transaction': lambda db: db.get_transaction(transaction_id(1)),
+    'get_withdrawal': lambda db: db.get_withdrawal(withdrawal_id(1)),
+}
+
+
+async def _drain(batches):
+    async for _ in batches:
+        pass
+
+
+# Остальные методы; ключ — имя метода Database, суффикс после ":" — вариант вызова
+OTHER = {
+    'user_exists': lambda db: db.user_exists(3),
+    'qk_exists': lambda db: db.qk_exists("qK-000000003"),
+    'get_users_page': lambda db: db.get_users_page(after=[100]),
+    'get_users_page:search': lambda db: db.get_users_page("user12"),
+    'get_users_page:qk': lambda db: db.get_users_page("qK-00000001"),
+    'get_check_claimers': lambda db: db.get_check_claimers(check_code(0)),
+    'claim_check': lambda db: db.claim_check(check_code(0), 10 ** 9),
+    'activate_check': lambda db: db.activate_check(check_code(0), 10 ** 9 + 2),
+    'apply_check_claims': lambda db: db.apply_check_claims(
+        [(check_code(0), 10 ** 9 + 3, 'bananas', 1, "2000-01-01")]
+    ),
+    'create_check': lambda db: db.create_check("PLANCHECK", 1, 'bananas', 1, 1),
+    'create_checks': lambda db: db.create_checks(["PLANBULK1", "PLANBULK2"], 1, 'stars', 1, 1),
+    'deactivate_check': lambda db: db.deactivate_check(check_code(0)),
+    'settle_payment': lambda db: db.settle_payment(transaction_id(2), 100, 1),
+    'add_transaction': lambda db: db.add_transaction(5, 100, "TX-PLAN", 'deposit'),
+    'update_transaction_status': lambda db: db.update_transaction_status(transaction_id(3), 'completed'),
+    'expire_pending_transactions': lambda db: db.expire_pending_transactions("2000-01-01"),
+    'create_withdrawal': lambda db: db.create_withdrawal(6, 100, "WD-PLAN"),
+    'update_withdrawal_status': lambda db: db.update_withdrawal_status(withdrawal_id(3), 'approved'),
+    'get_pending_withdrawals': lambda db: db.get_pending_withdrawals(),
+    'get_pending_withdrawals:after': lambda db: db.get_pending_withdrawals(after=["2000-01-01", 0]),
+    'count_pending_withdrawals': lambda db: db.count_pending_withdrawals(),
+    'process_withdrawals': lambda db: db.process_withdrawals([withdrawal_id(4), withdrawal_id(5)], False),
+    'create_broadcast': lambda db: db.create_broadcast("plan", 1),
+    'get_broadcast': lambda db: db.get_broadcast(1),
+    'get_running_broadcasts': lambda db: db.get_running_broadcasts(),
+    'get_broadcast_recipients': lambda db: db.get_broadcast_recipients(100),
+    'save_broadcast_progress': lambda db: db.save_broadcast_progress(1, 200, 1, 0, [150]),
+    'finish_broadcast': lambda db: db.finish_broadcast(1, 'cancelled'),
+    'add_user': lambda db: db.add_user(10 ** 9 + 4, "plan", "qK-PLAN00004"),
+    'upsert_user': lambda db: db.upsert_user(10 ** 9 + 1, "plan", "qK-PLAN00001"),
+    'upsert_user:existing': lambda db: db.upsert_user(7, "user7", "qK-PLAN00007"),
+    'add_currency': lambda db: db.add_currency(4, 'bananas', 1),
+    'update_user_currency': lambda db: db.update_user_currency(8, 'cakes', 5),
+    'subtract_stars': lambda db: db.subtract_stars(9, 1),
+    'add_stars_user': lambda db: db.add_stars_user(9, 1),
+    'add_stars_bot': lambda db: db.add_stars_bot(1),
+    'get_stats': lambda db: db.get_stats(),
+    'get_all_qk_codes': lambda db: db.get_all_qk_codes(),
+    'get_all_users': lambda db: db.get_all_users(),
+    'iter_users': lambda db: _drain(db.iter_users(1000)),
+    'compute_stats': lambda db: db.compute_stats(),
+    'rebuild_stats': lambda db: db.rebuild_stats(),
+}
+
+# Методы, которые читают таблицы целиком по назначению: выгрузки кодов и пересчет stats
+FULL_SCAN_ALLOWED = {'get_all_qk_codes', 'get_all_users', 'compute_stats', 'rebuild_stats'}
+
+# Управление соединениями и миграции: своего SQL для плана у них нет
+NOT_EXPLAINED = {'connect', 'close', 'create_tables'}
+
+EXPLAINED = ("SELECT", "INSERT", "UPDATE", "DELETE", "WITH")
+
+
+def full_scans(plan):
+    """Строки плана с полным сканированием таблицы или индекса"""
+    return [detail for detail in plan if detail.startswith("SCAN ") and detail != "SCAN CONSTANT ROW"]
+
+
+def database_methods():
+    """Имена публичных корутин и асинхронных генераторов Database"""
+    return {
+        name for name, member in inspect.getmembers(Database)
+        if not name.startswith('_')
+        and (inspect.iscoroutinefunction(member) or inspect.isasyncgenfunction(member))
+    }
+
+
+def unchecked_methods():
+    covered = {name.partition(':')[0] for name in {**HOT_PATH, **OTHER}} | NOT_EXPLAINED
+    return sorted(database_methods() - covered)
+
+
+def explain(conn, sql):
+    return [row[3] for row in conn.execute(f"EXPLAIN QUERY PLAN {sql}")]
+
+
+async def capture(db_path, calls):
+    """Вызывает методы и возвращает {метод: [SQL, ...]}"""
+    db = Database(db_path, user_cache_size=0, group_commit=False)
+    await db.connect()
+    statements = []
+    for conn in db._connections:
+        await conn.set_trace_callback(statements.append)
+
+    captured = {}
+    for name, call in calls.items():
+        statements.clear()
+        await call(db)
+        # Операторы внутри триггеров приходят с префиксом "--"
+        captured[name] = list(dict.fromkeys(
+            sql for sql in statements if sql.lstrip().upper().startswith(EXPLAINED)
+        ))
+    await db.close()
+    return captured
+
+
+def check(db_path, verbose=False):
+    captured = asyncio.run(capture(db_path, {**HOT_PATH, **OTHER}))
+    conn = sqlite3.connect(db_path)
+    failures = [f"{name}: публичный метод Database не проверяется" for name in unchecked_methods()]
+    try:
+        for name, statements in captured.items():
+            if not statements:
+                failures.append(f"{name}: не выполнил ни одного запроса")
+            scan_allowed = name.partition(':')[0] in FULL_SCAN_ALLOWED
+            for sql in statements:
+                plan = explain(conn, sql)
+                scans = full_scans(plan)
+                if scans and not scan_allowed:
+                    failures.append(f"{name}: {' '.join(sql.split())}\n    {'; '.join(scans)}")
+                if verbose:
+                    mark = "!" if scans else " "
+                    print(f"{mark} {name}: {' '.join(sql.split())[:100]}")
+                    for detail in plan:
+                        print(f"      {detail}")
+    finally:
+        conn.close()
+    return failures
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--users", type=int, default=5000, help="размер сгенерированной базы")
+    parser.add_argument("--db", help="проверить копию этой базы вместо сгенерированной")
+    parser.add_argument("-v", "--verbose", action="store_true", help="печатать планы всех запросов")
+    args = parser.parse_args()
+
+    db_path = temp_db_path()
+    try:
+        if args.db:
+            shutil.copyfile(args.db, db_path)
+        else:
+            asyncio.run(generate(db_path, args.users))
+        failures = check(db_path, args.verbose)
+    finally:
+        shutil.rmtree(os.path.dirname(db_path))
+
+    if failures:
+        print("Проверка планов запросов не пройдена:")
+        for failure in failures:
+            print(f"  {failure}")
+        sys.exit(1)
+    print(f"OK: проверены все {len(database_methods()) - len(NOT_EXPLAINED)} методов Database, "
+          f"полное сканирование только в {len(FULL_SCAN_ALLOWED)} методах обхода таблиц")
+
+
+if __name__ == "__main__":
+    main()
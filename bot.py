@@ -2,32 +2,98 @@ import asyncio
 import logging
 from aiogram import Bot, Dispatcher
 from aiogram.client.default import DefaultBotProperties
+from aiogram.client.session.aiohttp import AiohttpSession
+from aiogram.client.telegram import TelegramAPIServer
 from aiogram.enums import ParseMode
 
 import cfg
-from database import Database
-from handlers import router
+from handlers import router, db, check_cache, qk_pool, notifier, payment_sweeper, broadcaster
+from metrics import BotApiTimingMiddleware, MetricsServer, instrument_limiter
+from outbound import OutboundLimiter, wait_background
+from sharding import run_sharded
+from storage import SQLiteStorage
+from webhook import run_webhook
 
 logging.basicConfig(
-    level=logging.INFO,
+    level=cfg.log_level,
     format='%(asctime)s - %(name)s - %(levelname)s - %(message)s'
 )
 
+storage = SQLiteStorage(cfg.db_path)
+metrics_server = MetricsServer(cfg.metrics_port)
 
-async def main():
-    db = Database()
-    await db.create_tables()
+
+def create_bot():
+    session = None
+    if cfg.api_server:
+        session = AiohttpSession(api=TelegramAPIServer.from_base(cfg.api_server))
 
     bot = Bot(
         token=cfg.botapi,
+        session=session,
         default=DefaultBotProperties(parse_mode=ParseMode.HTML)
     )
-    dp = Dispatcher()
+    # Общий лимит делится между процессами-обработчиками
+    limiter = OutboundLimiter(cfg.send_rate / max(cfg.workers, 1), cfg.chat_send_rate, cfg.chat_send_burst)
+    bot.session.middleware(limiter)
+    # Первый зарегистрированный middleware внешний: таймер внутри лимитов меряет только сам HTTP-запрос
+    if cfg.metrics_port:
+        instrument_limiter(limiter)
+        bot.session.middleware(BotApiTimingMiddleware())
+    return bot
+
+
+async def on_startup(bot):
+    # aiogram кэширует getMe: username для ссылок на чеки запрашивается один раз
+    await bot.me()
+    await db.connect()
+    await db.create_tables()
+    await check_cache.start()
+    await qk_pool.start()
+    await storage.start()
+    await notifier.start(bot)
+    await payment_sweeper.start()
+    await broadcaster.start(bot)
+    await metrics_server.start()
+
+
+async def on_shutdown():
+    await metrics_server.stop()
+    await payment_sweeper.stop()
+    await broadcaster.stop()
+    await wait_background()
+    await notifier.stop()
+    await storage.close()
+    await qk_pool.stop()
+    await check_cache.stop()
+    await db.close()
+
+
+async def main():
+    bot = create_bot()
+    dp = Dispatcher(storage=storage)
 
     dp.include_router(router)
 
-    await bot.delete_webhook(drop_pending_updates=True)
-    await dp.start_polling(bot)
+    if cfg.workers > 1:
+        try:
+            await run_sharded(bot, dp.resolve_used_update_types())
+        finally:
+            await bot.session.close()
+        return
+
+    await on_startup(bot)
+
+    try:
+        if cfg.mode == "webhook":
+            await run_webhook(dp, bot)
+        else:
+            await bot.delete_webhook(drop_pending_updates=True)
+            await dp.start_polling(bot, close_bot_session=False)
+    finally:
+        # Сессия закрывается последней: при остановке уходят сводка уведомлений и фоновые отправки
+        await on_shutdown()
+        await bot.session.close()
 
 
 if __name__ == "__main__":
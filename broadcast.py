@@ -0,0 +1,122 @@
+import asyncio
+import logging
+
+from aiogram.exceptions import TelegramForbiddenError
+
+from outbound import PRIORITY_ADMIN, PRIORITY_BROADCAST, send_in_background, send_priority
+
+logger = logging.getLogger(__name__)
+
+
+def broadcast_progress(broadcast, title):
+    return (
+        f"{title}\n\n"
+        f"✅ Доставлено: {broadcast['sent']}\n"
+        f"🚫 Заблокировали бота: {broadcast['blocked']}\n"
+        f"❌ Ошибок: {broadcast['failed']}"
+    )
+
+
+class Broadcaster:
+    """Рассылка сообщения всем пользователям с продолжением после перезапуска.
+
+    Получатели читаются пачками по user_id (keyset), сообщения уходят не
+    больше concurrency одновременно с приоритетом рассылки, поэтому общий
+    лимит OutboundLimiter в первую очередь достается ответам пользователям.
+    После каждой пачки курсор и счетчики сохраняются в таблицу broadcasts,
+    и после перезапуска повторно могут уйти не больше batch_size сообщений.
+    Заблокировавшие бота помечаются и в следующие рассылки не попадают.
+    """
+
+    def __init__(self, db, batch_size=100, concurrency=10, resume=True):
+        self.db = db
+        self.batch_size = batch_size
+        self.concurrency = concurrency
+        self.resume = resume
+        self.bot = None
+        self._tasks = {}
+
+    async def start(self, bot):
+        self.bot = bot
+        if self.resume:
+            for broadcast in await self.db.get_running_broadcasts():
+                logger.info("Продолжаем рассылку #%d после user_id %d", broadcast['id'], broadcast['last_user_id'])
+                self._launch(broadcast)
+
+    async def stop(self):
+        tasks = list(self._tasks.values())
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+        self._tasks.clear()
+
+    async def begin(self, text, creator_id):
+        """Создает рассылку и запускает ее в фоне; возвращает id рассылки"""
+        broadcast_id = await self.db.create_broadcast(text, creator_id)
+        self._launch(await self.db.get_broadcast(broadcast_id))
+        return broadcast_id
+
+    async def cancel(self, broadcast_id):
+        """Останавливает рассылку после текущей пачки, чтобы счетчики остались точными.
+
+        Статус хранится в базе, поэтому остановка работает из любого процесса.
+        """
+        return await self.db.finish_broadcast(broadcast_id, 'cancelled')
+
+    def _launch(self, broadcast):
+        if broadcast['id'] in self._tasks:
+            return
+        task = asyncio.create_task(self._run(broadcast))
+        self._tasks[broadcast['id']] = task
+        task.add_done_callback(lambda _: self._tasks.pop(broadcast['id'], None))
+
+    async def _run(self, broadcast):
+        try:
+            with send_priority(PRIORITY_BROADCAST):
+                finished = await self._send_all(broadcast)
+        except asyncio.CancelledError:
+            raise
+        except Exception:
+            logger.exception("Рассылка #%d прервана, продолжится после перезапуска", broadcast['id'])
+            return
+
+        if finished and await self.db.finish_broadcast(broadcast['id'], 'finished'):
+            result = await self.db.get_broadcast(broadcast['id'])
+            logger.info("Рассылка #%d завершена: %d доставлено", result['id'], result['sent'])
+            send_in_background(self.bot.send_message(
+                result['creator_id'],
+                broadcast_progress(result, f"📢 **Рассылка #{result['id']} завершена**"),
+                parse_mode="Markdown"
+            ), PRIORITY_ADMIN)
+
+    async def _send_all(self, broadcast):
+        """Отправляет пачку за пачкой; False, если рассылку остановили"""
+        semaphore = asyncio.Semaphore(self.concurrency)
+        last_user_id = broadcast['last_user_id']
+        while True:
+            user_ids = await self.db.get_broadcast_recipients(last_user_id, self.batch_size)
+            if not user_ids:
+                return True
+
+            results = await asyncio.gather(*(
+                self._send(semaphore, user_id, broadcast['text']) for user_id in user_ids
+            ))
+            last_user_id = user_ids[-1]
+            status = await self.db.save_broadcast_progress(
+                broadcast['id'], last_user_id, results.count('sent'), results.count('failed'),
+                [user_id for user_id, result in zip(user_ids, results) if result == 'blocked']
+            )
+            if status != 'running':
+                logger.info("Рассылка #%d остановлена", broadcast['id'])
+                return False
+
+    async def _send(self, semaphore, user_id, text):
+        async with semaphore:
+            try:
+                await self.bot.send_message(user_id, text, parse_mode="HTML")
+            except TelegramForbiddenError:
+                return 'blocked'
+            except Exception as e:
+                logger.warning("Рассылка не доставлена пользователю %s: %s", user_id, e)
+                return 'failed'
+            return 'sent'
@@ -0,0 +1,68 @@
+import time
+from collections import OrderedDict
+
+
+class LRUCache:
+    """Ограниченный по размеру LRU-кэш с TTL и счетчиками попаданий.
+
+    Записи, прочитанные до инвалидации, не попадают в кэш: put принимает
+    номер поколения, полученный до чтения из базы, и отбрасывает значение,
+    если с тех пор была хотя бы одна инвалидация.
+    maxsize=0 отключает кэш: get всегда возвращает None, счетчики не растут.
+    """
+
+    def __init__(self, maxsize=10000, ttl=60.0):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.generation = 0
+        self._data = OrderedDict()
+
+    def get(self, key):
+        if self.maxsize <= 0:
+            return None
+        item = self._data.get(key)
+        if item is None:
+            self.misses += 1
+            return None
+        value, expires_at = item
+        if expires_at < time.monotonic():
+            del self._data[key]
+            self.misses += 1
+            return None
+        self._data.move_to_end(key)
+        self.hits += 1
+        return value
+
+    def put(self, key, value, generation=None):
+        if self.maxsize <= 0:
+            return
+        if generation is not None and generation != self.generation:
+            return
+        self._data[key] = (value, time.monotonic() + self.ttl)
+        self._data.move_to_end(key)
+        while len(self._data) > self.maxsize:
+            self._data.popitem(last=False)
+            self.evictions += 1
+
+    def invalidate(self, key):
+        self.generation += 1
+        self._data.pop(key, None)
+
+    def clear(self):
+        self.generation += 1
+        self._data.clear()
+
+    def __len__(self):
+        return len(self._data)
+
+    @property
+    def stats(self):
+        return {
+            'size': len(self._data),
+            'hits': self.hits,
+            'misses': self.misses,
+            'evictions': self.evictions
+        }
@@ -1,2 +1,51 @@
 botapi = "5000514328:AAEKElXnReti5Sor9yom676lErG5T4KlZCA/test"
-admin_id = 2200183708
\ No newline at end of file
+admin_id = 2200183708
+
+db_path = "bot.db"
+log_level = "INFO"
+
+# Адрес Bot API; None — api.telegram.org (для локального стенда: "http://127.0.0.1:8081")
+api_server = None
+
+# Режим получения апдейтов: "polling" или "webhook"
+mode = "polling"
+
+webhook_url = "https://example.com"
+webhook_path = "/webhook"
+# Секрет в заголовке X-Telegram-Bot-Api-Secret-Token; пустой — генерируется при запуске
+webhook_secret = ""
+webhook_host = "0.0.0.0"
+webhook_port = 8080
+# Сколько соединений Telegram может держать к вебхуку одновременно
+webhook_max_connections = 40
+# Сколько апдейтов обрабатывается одновременно, остальные ждут в очереди
+webhook_concurrency = 100
+webhook_keepalive = 75
+
+# Число процессов-обработчиков; больше 1 — апдейты распределяются по user_id
+workers = 0
+# Сколько апдейтов одновременно обрабатывает один процесс
+worker_concurrency = 100
+
+# Как часто (в секундах) отправлять админу сводку уведомлений
+notify_interval = 10
+
+# Лимиты исходящих запросов к Bot API: всего в секунду и на один чат
+send_rate = 30
+chat_send_rate = 1
+chat_send_burst = 3
+
+# Рассылка: сколько получателей читается за раз и сколько сообщений отправляется одновременно.
+# После перезапуска повторно могут уйти не больше broadcast_batch_size сообщений
+broadcast_batch_size = 100
+broadcast_concurrency = 10
+
+# Сколько чеков админ может создать за раз через «Чеки пачкой»
+bulk_check_limit = 10000
+
+# Через сколько секунд неоплаченный счет помечается просроченным
+payment_ttl = 24 * 60 * 60
+
+# Порт HTTP /metrics в формате Prometheus; None — метрики не собираются.
+# В режиме нескольких процессов обработчик N слушает metrics_port + N
+metrics_port = None
\ No newline at end of file
@@ -0,0 +1,157 @@
+import asyncio
+import logging
+from collections import OrderedDict
+from datetime import datetime
+
+logger = logging.getLogger(__name__)
+
+
+class CheckCache:
+    """Кэш горячих чеков в памяти с отложенной записью активаций.
+
+    Проверки лимита, активности и повторной активации выполняются в памяти,
+    а сами активации пачками сбрасываются в checks/check_activations.
+    Рассчитан на один процесс: при enabled=False все вызовы идут в базу.
+    """
+
+    def __init__(self, db, flush_interval=0.2, batch_size=500, max_checks=1000, enabled=True):
+        self.db = db
+        self.flush_interval = flush_interval
+        self.batch_size = batch_size
+        self.max_checks = max_checks
+        self.enabled = enabled
+        self._checks = OrderedDict()
+        self._loading = {}
+        self._pending = []
+        self._pending_codes = {}
+        self._flushes = set()
+        self._stopping = asyncio.Event()
+        self._task = None
+
+    async def start(self):
+        if self.enabled and self._task is None:
+            self._stopping.clear()
+            self._task = asyncio.create_task(self._flush_loop())
+
+    async def stop(self):
+        # Цикл не отменяется: отмена посреди записи откатила бы уже вынутую пачку
+        if self._task is not None:
+            self._stopping.set()
+            await self._task
+            self._task = None
+        await asyncio.gather(*self._flushes)
+        await self.flush()
+
+    async def peek(self, code, user_id):
+        """Проверяет, может ли пользователь активировать чек, ничего не меняя"""
+        if not self.enabled:
+            check = await self.db.get_check(code)
+            if check and await self.db.check_user_activated(code, user_id):
+                return 'already_activated', check
+            return self._status(check, False), check
+
+        entry = await self._entry(code)
+        if entry is None:
+            return 'not_found', None
+        return self._status(entry['check'], user_id in entry['claimers']), dict(entry['check'])
+
+    async def claim(self, code, user_id):
+        """Активирует чек в памяти; запись в базу произойдет при ближайшем сбросе"""
+        if not self.enabled:
+            return await self.db.claim_check(code, user_id)
+
+        entry = await self._entry(code)
+        if entry is None:
+            return 'not_found', None
+
+        check = entry['check']
+        status = self._status(check, user_id in entry['claimers'])
+        if status != 'ok':
+            return status, None
+
+        entry['claimers'].add(user_id)
+        check['activations'] += 1
+        if check['activations'] >= check['max_activations']:
+            check['is_active'] = 0
+
+        self._pending.append(
+            (code, user_id, check['currency'], check['amount'], datetime.now().isoformat())
+        )
+        self._pending_codes[code] = self._pending_codes.get(code, 0) + 1
+        if len(self._pending) >= self.batch_size:
+            task = asyncio.create_task(self.flush())
+            self._flushes.add(task)
+            task.add_done_callback(self._flushes.discard)
+        return 'ok', dict(check)
+
+    async def flush(self):
+        """Сбрасывает накопленные активации в базу"""
+        while self._pending:
+            batch = self._pending[:self.batch_size]
+            del self._pending[:len(batch)]
+            try:
+                await self.db.apply_check_claims(batch)
+            except BaseException as e:
+                self._pending[:0] = batch
+                if not isinstance(e, Exception):
+                    raise
+                logger.exception("Не удалось записать %d активаций чеков", len(batch))
+                return
+            for code, *_ in batch:
+                left = self._pending_codes[code] - 1
+                if left:
+                    self._pending_codes[code] = left
+                else:
+                    del self._pending_codes[code]
+
+    @staticmethod
+    def _status(check, already_claimed):
+        if check is None:
+            return 'not_found'
+        if already_claimed:
+            return 'already_activated'
+        if check['activations'] >= check['max_activations']:
+            return 'exhausted'
+        if not check['is_active']:
+            return 'inactive'
+        return 'ok'
+
+    async def _entry(self, code):
+        entry = self._checks.get(code)
+        if entry is not None:
+            self._checks.move_to_end(code)
+            return entry
+
+        # Один запрос к базе на код, даже если чек открыли тысячи пользователей разом
+        loading = self._loading.get(code)
+        if loading is None:
+            loading = asyncio.ensure_future(self._load(code))
+            self._loading[code] = loading
+            loading.add_done_callback(lambda _: self._loading.pop(code, None))
+        return await asyncio.shield(loading)
+
+    async def _load(self, code):
+        check = await self.db.get_check(code)
+        if check is None:
+            return None
+        entry = self._checks.get(code)
+        if entry is None:
+            entry = {'check': check, 'claimers': await self.db.get_check_claimers(code)}
+            self._checks[code] = entry
+            self._evict()
+        return entry
+
+    def _evict(self):
+        for code in list(self._checks):
+            if len(self._checks) <= self.max_checks:
+                break
+            if code not in self._pending_codes:
+                del self._checks[code]
+
+    async def _flush_loop(self):
+        while not self._stopping.is_set():
+            try:
+                await asyncio.wait_for(self._stopping.wait(), self.flush_interval)
+            except asyncio.TimeoutError:
+                pass
+            await self.flush()
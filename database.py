@@ -1,73 +1,163 @@
+import asyncio
+from contextlib import asynccontextmanager
+from dataclasses import dataclass
+
 import aiosqlite
 from datetime import datetime
 
+from cache import LRUCache
+from group_commit import GroupCommitWriter
+from migrations import migrate
+
+
+# Настройки соединения применяются один раз при открытии пула
+PRAGMAS = (
+    "PRAGMA journal_mode = WAL",
+    "PRAGMA synchronous = NORMAL",
+    "PRAGMA temp_store = MEMORY",
+    "PRAGMA cache_size = -16000",
+    "PRAGMA mmap_size = 134217728",
+    "PRAGMA foreign_keys = ON",
+)
+
+CHECK_CURRENCIES = ('bananas', 'stars', 'cakes')
+
+# Верхняя граница для поиска по префиксу через диапазон по индексу
+PREFIX_UPPER_BOUND = '\U0010ffff'
+
+STATS_FIELDS = (
+    'total_users', 'total_bananas', 'total_stars', 'total_cakes', 'total_startL',
+    'total_startB', 'total_checks', 'total_activations', 'total_withdrawals'
+)
+
+
+@dataclass
+class BotUser:
+    """Пользователь бота, подгружаемый middleware на каждый апдейт"""
+    user_id: int
+    username: str
+    qk_code: str
+    bananas: int
+    stars: int
+    cakes: int
+    startL: int
+    startB: int
+    registration_date: str
+    blocked: int = 0
+    is_new: bool = False
+
+
+USER_COLUMNS = "user_id, username, qk_code, bananas, stars, cakes, startL, startB, registration_date, blocked"
+BROADCAST_COLUMNS = "id, text, status, last_user_id, sent, blocked, failed, creator_id, created_date"
+TRANSACTION_COLUMNS = "id, user_id, amount, transaction_id, status, payment_type, created_date"
+
+
+def _transaction_row(row):
+    return {
+        'id': row[0],
+        'user_id': row[1],
+        'amount': row[2],
+        'transaction_id': row[3],
+        'status': row[4],
+        'payment_type': row[5],
+        'created_date': row[6]
+    }
+
+
+def _broadcast_row(row):
+    return {
+        'id': row[0],
+        'text': row[1],
+        'status': row[2],
+        'last_user_id': row[3],
+        'sent': row[4],
+        'blocked': row[5],
+        'failed': row[6],
+        'creator_id': row[7],
+        'created_date': row[8]
+    }
+
+
+def _user_search_mode(query):
+    if not query:
+        return None, None
+    query = query.strip().lstrip('@')
+    if query.lower().startswith('qk-'):
+        return 'qk_code', 'qK-' + query[3:].upper()
+    return 'username', query
+
 
 class Database:
-    def __init__(self, db_path="bot.db"):
+    def __init__(self, db_path="bot.db", pool_size=4, busy_timeout=5.0, cached_statements=256,
+                 user_cache_size=10000, user_cache_ttl=60.0, group_commit=True):
         self.db_path = db_path
-
-    async def create_tables(self):
-        async with aiosqlite.connect(self.db_path) as db:
-            await db.execute('''
-                CREATE TABLE IF NOT EXISTS users (
-                    user_id INTEGER PRIMARY KEY,
-                    username TEXT,
-                    qk_code TEXT UNIQUE,
-                    bananas INTEGER DEFAULT 0,
-                    stars INTEGER DEFAULT 0,
-                    cakes INTEGER DEFAULT 0,
-                    startL INTEGER DEFAULT 0,
-                    startB INTEGER DEFAULT 0,
-                    registration_date TEXT
-                )
-            ''')
-            await db.execute('''
-                CREATE TABLE IF NOT EXISTS checks (
-                    id INTEGER PRIMARY KEY AUTOINCREMENT,
-                    code TEXT UNIQUE,
-                    amount INTEGER,
-                    currency TEXT,
-                    activations INTEGER DEFAULT 0,
-                    max_activations INTEGER,
-                    creator_id INTEGER,
-                    created_date TEXT,
-                    is_active INTEGER DEFAULT 1
-                )
-            ''')
-            await db.execute('''
-                CREATE TABLE IF NOT EXISTS check_activations (
-                    id INTEGER PRIMARY KEY AUTOINCREMENT,
-                    check_code TEXT,
-                    user_id INTEGER,
-                    activation_date TEXT,
-                    UNIQUE(check_code, user_id)
-                )
-            ''')
-            await db.execute('''
-                CREATE TABLE IF NOT EXISTS transactions (
-                    id INTEGER PRIMARY KEY AUTOINCREMENT,
-                    user_id INTEGER,
-                    amount INTEGER,
-                    transaction_id TEXT UNIQUE,
-                    status TEXT,
-                    payment_type TEXT,
-                    created_date TEXT
-                )
-            ''')
-            await db.execute('''
-                CREATE TABLE IF NOT EXISTS withdrawals (
-                    id INTEGER PRIMARY KEY AUTOINCREMENT,
-                    user_id INTEGER,
-                    amount INTEGER,
-                    withdrawal_id TEXT UNIQUE,
-                    status TEXT DEFAULT 'pending',
-                    created_date TEXT
+        self.pool_size = pool_size
+        self.busy_timeout = busy_timeout
+        self.cached_statements = cached_statements
+        self._pool = None
+        self._connections = []
+        self._lock = asyncio.Lock()
+        self.user_cache = LRUCache(user_cache_size, user_cache_ttl)
+        self.writer = GroupCommitWriter(self) if group_commit else None
+
+    async def connect(self):
+        """Открывает пул долгоживущих соединений"""
+        async with self._lock:
+            if self._pool is not None:
+                return
+            pool = asyncio.Queue()
+            for _ in range(self.pool_size):
+                conn = await aiosqlite.connect(
+                    self.db_path,
+                    timeout=self.busy_timeout,
+                    cached_statements=self.cached_statements
                 )
-            ''')
+                for pragma in PRAGMAS:
+                    await conn.execute(pragma)
+                self._connections.append(conn)
+                pool.put_nowait(conn)
+            self._pool = pool
+
+    async def close(self):
+        """Закрывает все соединения пула"""
+        if self.writer is not None and self._pool is not None:
+            await self.writer.flush()
+        async with self._lock:
+            for conn in self._connections:
+                await conn.close()
+            self._connections = []
+            self._pool = None
+
+    @asynccontextmanager
+    async def _connection(self):
+        if self._pool is None:
+            await self.connect()
+        pool = self._pool
+        conn = await pool.get()
+        try:
+            yield conn
+        except BaseException:
+            if conn.in_transaction:
+                await conn.rollback()
+            raise
+        finally:
+            pool.put_nowait(conn)
+
+    async def _write(self, sql, params):
+        """Выполняет одиночное изменение, по возможности в общей транзакции"""
+        if self.writer is not None:
+            return await self.writer.execute(sql, params)
+        async with self._connection() as db:
+            cursor = await db.execute(sql, params)
             await db.commit()
+            return cursor.rowcount
+
+    async def create_tables(self):
+        """Доводит схему до последней версии; на актуальной базе DDL не выполняется"""
+        return await migrate(self)
 
     async def user_exists(self, user_id):
-        async with aiosqlite.connect(self.db_path) as db:
+        async with self._connection() as db:
             cursor = await db.execute(
                 "SELECT user_id FROM users WHERE user_id = ?", (user_id,)
             )
@@ -75,22 +165,28 @@ class Database:
             return result is not None
 
     async def add_user(self, user_id, username, qk_code):
-        async with aiosqlite.connect(self.db_path) as db:
+        async with self._connection() as db:
             await db.execute(
                 '''INSERT INTO users (user_id, username, qk_code, registration_date) 
                    VALUES (?, ?, ?, ?)''',
                 (user_id, username, qk_code, datetime.now().isoformat())
             )
             await db.commit()
+        self.user_cache.invalidate(user_id)
 
     async def get_user(self, user_id):
-        async with aiosqlite.connect(self.db_path) as db:
+        cached = self.user_cache.get(user_id)
+        if cached is not None:
+            return dict(cached)
+
+        generation = self.user_cache.generation
+        async with self._connection() as db:
             cursor = await db.execute(
-                "SELECT * FROM users WHERE user_id = ?", (user_id,)
+                f"SELECT {USER_COLUMNS} FROM users WHERE user_id = ?", (user_id,)
             )
             row = await cursor.fetchone()
             if row:
-                return {
+                user = {
                     'user_id': row[0],
                     'username': row[1],
                     'qk_code': row[2],
@@ -99,30 +195,102 @@ class Database:
                     'cakes': row[5],
                     'startL': row[6],
                     'startB': row[7],
-                    'registration_date': row[8]
+                    'registration_date': row[8],
+                    'blocked': row[9]
                 }
+                self.user_cache.put(user_id, user, generation)
+                return dict(user)
             return None
 
+    async def get_bot_user(self, user_id):
+        """Возвращает BotUser из кэша или одним SELECT; None, если пользователя нет"""
+        user = await self.get_user(user_id)
+        if user is None:
+            return None
+        return BotUser(**user)
+
     async def get_all_users(self):
         """Получает всех пользователей для админа"""
-        async with aiosqlite.connect(self.db_path) as db:
+        async with self._connection() as db:
             cursor = await db.execute(
                 "SELECT user_id, username FROM users ORDER BY user_id"
             )
             rows = await cursor.fetchall()
             return [{'user_id': row[0], 'username': row[1]} for row in rows]
 
+    async def get_users_page(self, query=None, after=None, limit=10):
+        """Страница пользователей по ключу (keyset), без OFFSET.
+
+        query: префикс username или qK-кода; after: курсор из прошлой страницы.
+        Возвращает (пользователи, курсор следующей страницы или None).
+        """
+        mode, prefix = _user_search_mode(query)
+        if mode == 'qk_code':
+            # Курсор сразу задает нижнюю границу поиска по индексу
+            sql = f'''SELECT user_id, username, qk_code FROM users
+                      WHERE qk_code {'>' if after else '>='} ? AND qk_code < ?
+                      ORDER BY qk_code LIMIT ?'''
+            params = (after[0] if after else prefix, prefix + PREFIX_UPPER_BOUND, limit + 1)
+        elif mode == 'username':
+            sql = '''SELECT user_id, username, qk_code FROM users
+                     WHERE username >= ? COLLATE NOCASE AND username < ? COLLATE NOCASE
+                       AND (username COLLATE NOCASE, user_id) > (?, ?)
+                     ORDER BY username COLLATE NOCASE, user_id LIMIT ?'''
+            params = (after[0] if after else prefix, prefix + PREFIX_UPPER_BOUND,
+                      after[0] if after else '', after[1] if after else -1, limit + 1)
+        else:
+            sql = '''SELECT user_id, username, qk_code FROM users
+                     WHERE user_id > ? ORDER BY user_id LIMIT ?'''
+            params = (after[0] if after else -1, limit + 1)
+
+        async with self._connection() as db:
+            cursor = await db.execute(sql, params)
+            rows = await cursor.fetchall()
+
+        users = [{'user_id': row[0], 'username': row[1], 'qk_code': row[2]} for row in rows[:limit]]
+        if len(rows) <= limit:
+            return users, None
+        last = users[-1]
+        if mode == 'qk_code':
+            return users, [last['qk_code']]
+        if mode == 'username':
+            return users, [last['username'], last['user_id']]
+        return users, [last['user_id']]
+
+    async def iter_users(self, batch_size=1000):
+        """Отдает пользователей пачками, не загружая таблицу целиком.
+
+        Каждая пачка читается отдельным коротким запросом по ключу: пока
+        потребитель обрабатывает пачку, соединение возвращено в пул, а
+        снимок WAL не удерживается и не мешает checkpoint.
+        """
+        last_user_id = -1
+        while True:
+            async with self._connection() as db:
+                cursor = await db.execute(
+                    "SELECT user_id, username FROM users WHERE user_id > ? ORDER BY user_id LIMIT ?",
+                    (last_user_id, batch_size)
+                )
+                rows = await cursor.fetchall()
+            if not rows:
+                break
+            last_user_id = rows[-1][0]
+            yield [{'user_id': row[0], 'username': row[1]} for row in rows]
+            if len(rows) < batch_size:
+                break
+
     async def update_user_currency(self, user_id, currency, amount):
         """Устанавливает новое значение валюты пользователю"""
-        async with aiosqlite.connect(self.db_path) as db:
+        async with self._connection() as db:
             await db.execute(
                 f"UPDATE users SET {currency} = ? WHERE user_id = ?",
                 (amount, user_id)
             )
             await db.commit()
+        self.user_cache.invalidate(user_id)
 
     async def qk_exists(self, qk_code):
-        async with aiosqlite.connect(self.db_path) as db:
+        async with self._connection() as db:
             cursor = await db.execute(
                 "SELECT qk_code FROM users WHERE qk_code = ?", (qk_code,)
             )
@@ -130,7 +298,7 @@ class Database:
             return result is not None
 
     async def create_check(self, code, amount, currency, max_activations, creator_id):
-        async with aiosqlite.connect(self.db_path) as db:
+        async with self._connection() as db:
             await db.execute(
                 '''INSERT INTO checks (code, amount, currency, max_activations, creator_id, created_date) 
                    VALUES (?, ?, ?, ?, ?, ?)''',
@@ -138,8 +306,23 @@ class Database:
             )
             await db.commit()
 
+    async def create_checks(self, codes, amount, currency, max_activations, creator_id):
+        """Создает пачку одинаковых чеков одной транзакцией.
+
+        Если хотя бы один код занят, не создается ни один чек
+        и выбрасывается sqlite3.IntegrityError.
+        """
+        created_date = datetime.now().isoformat()
+        async with self._connection() as db:
+            await db.executemany(
+                '''INSERT INTO checks (code, amount, currency, max_activations, creator_id, created_date)
+                   VALUES (?, ?, ?, ?, ?, ?)''',
+                [(code, amount, currency, max_activations, creator_id, created_date) for code in codes]
+            )
+            await db.commit()
+
     async def get_check(self, code):
-        async with aiosqlite.connect(self.db_path) as db:
+        async with self._connection() as db:
             cursor = await db.execute(
                 "SELECT * FROM checks WHERE code = ?", (code,)
             )
@@ -159,7 +342,7 @@ class Database:
             return None
 
     async def check_user_activated(self, check_code, user_id):
-        async with aiosqlite.connect(self.db_path) as db:
+        async with self._connection() as db:
             cursor = await db.execute(
                 "SELECT id FROM check_activations WHERE check_code = ? AND user_id = ?",
                 (check_code, user_id)
@@ -168,7 +351,7 @@ class Database:
             return result is not None
 
     async def activate_check(self, check_code, user_id):
-        async with aiosqlite.connect(self.db_path) as db:
+        async with self._connection() as db:
             await db.execute(
                 '''INSERT INTO check_activations (check_code, user_id, activation_date) 
                    VALUES (?, ?, ?)''',
@@ -183,39 +366,39 @@ class Database:
             await db.commit()
 
     async def add_currency(self, user_id, currency, amount):
-        async with aiosqlite.connect(self.db_path) as db:
-            await db.execute(
-                f"UPDATE users SET {currency} = {currency} + ? WHERE user_id = ?",
-                (amount, user_id)
-            )
-            await db.commit()
+        await self._write(
+            f"UPDATE users SET {currency} = {currency} + ? WHERE user_id = ?",
+            (amount, user_id)
+        )
+        self.user_cache.invalidate(user_id)
 
     async def subtract_stars(self, user_id, amount):
-        async with aiosqlite.connect(self.db_path) as db:
-            await db.execute(
-                "UPDATE users SET startL = startL - ? WHERE user_id = ?",
-                (amount, user_id)
-            )
-            await db.commit()
+        """Списывает startL, только если баланса хватает; True, если списание прошло"""
+        rowcount = await self._write(
+            "UPDATE users SET startL = startL - ? WHERE user_id = ? AND startL >= ?",
+            (amount, user_id, amount)
+        )
+        self.user_cache.invalidate(user_id)
+        return rowcount == 1
 
     async def add_stars_user(self, user_id, amount):
-        async with aiosqlite.connect(self.db_path) as db:
-            await db.execute(
-                "UPDATE users SET startL = startL + ? WHERE user_id = ?",
-                (amount, user_id)
-            )
-            await db.commit()
+        await self._write(
+            "UPDATE users SET startL = startL + ? WHERE user_id = ?",
+            (amount, user_id)
+        )
+        self.user_cache.invalidate(user_id)
 
     async def add_stars_bot(self, amount):
-        async with aiosqlite.connect(self.db_path) as db:
+        async with self._connection() as db:
             await db.execute(
                 "UPDATE users SET startB = startB + ? WHERE user_id = ?",
                 (amount, 2200183708)
             )
             await db.commit()
+        self.user_cache.invalidate(2200183708)
 
     async def add_transaction(self, user_id, amount, transaction_id, payment_type):
-        async with aiosqlite.connect(self.db_path) as db:
+        async with self._connection() as db:
             await db.execute(
                 '''INSERT INTO transactions (user_id, amount, transaction_id, status, payment_type, created_date) 
                    VALUES (?, ?, ?, ?, ?, ?)''',
@@ -224,15 +407,13 @@ class Database:
             await db.commit()
 
     async def update_transaction_status(self, transaction_id, status):
-        async with aiosqlite.connect(self.db_path) as db:
-            await db.execute(
-                "UPDATE transactions SET status = ? WHERE transaction_id = ?",
-                (status, transaction_id)
-            )
-            await db.commit()
+        await self._write(
+            "UPDATE transactions SET status = ? WHERE transaction_id = ?",
+            (status, transaction_id)
+        )
 
     async def get_transaction(self, transaction_id):
-        async with aiosqlite.connect(self.db_path) as db:
+        async with self._connection() as db:
             cursor = await db.execute(
                 "SELECT * FROM transactions WHERE transaction_id = ?", (transaction_id,)
             )
@@ -249,8 +430,76 @@ class Database:
                 }
             return None
 
+    async def settle_payment(self, transaction_id, amount, admin_id):
+        """Атомарно проводит оплату: завершает транзакцию и зачисляет звезды.
+
+        Пополнение зачисляется пользователю из строки транзакции, поддержка —
+        на startB админа admin_id. Повторная доставка того же платежа ничего
+        не меняет и возвращает 'already_completed'; если оплачено не столько,
+        сколько в счете, транзакция не проводится и возвращается
+        'amount_mismatch'. Транзакцию, просроченную уборщиком, все равно
+        проводим: деньги уже списаны.
+        """
+        async with self._connection() as db:
+            await db.execute("BEGIN IMMEDIATE")
+            cursor = await db.execute(
+                f'''UPDATE transactions SET status = 'completed'
+                    WHERE transaction_id = ? AND status IN ('pending', 'expired') AND amount = ?
+                    RETURNING {TRANSACTION_COLUMNS}''',
+                (transaction_id, amount)
+            )
+            row = await cursor.fetchone()
+            if row is None:
+                cursor = await db.execute(
+                    f"SELECT {TRANSACTION_COLUMNS} FROM transactions WHERE transaction_id = ?", (transaction_id,)
+                )
+                existing = await cursor.fetchone()
+                await db.rollback()
+                if existing is None:
+                    return 'not_found', None
+                if existing[4] == 'completed':
+                    return 'already_completed', None
+                return 'amount_mismatch', _transaction_row(existing)
+
+            transaction = _transaction_row(row)
+            if transaction['payment_type'] == "deposit":
+                credited_id, column = transaction['user_id'], "startL"
+            else:
+                credited_id, column = admin_id, "startB"
+            await db.execute(
+                f"UPDATE users SET {column} = {column} + ? WHERE user_id = ?",
+                (transaction['amount'], credited_id)
+            )
+            await db.commit()
+        self.user_cache.invalidate(credited_id)
+        return 'ok', transaction
+
+    async def expire_pending_transactions(self, created_before, batch_size=500):
+        """Помечает неоплаченные транзакции старше created_before как expired.
+
+        Работает пачками по batch_size, чтобы не держать блокировку записи
+        долго; возвращает число просроченных транзакций.
+        """
+        expired = 0
+        while True:
+            async with self._connection() as db:
+                cursor = await db.execute(
+                    '''UPDATE transactions SET status = 'expired'
+                       WHERE id IN (
+                           SELECT id FROM transactions
+                           WHERE status = 'pending' AND created_date < ?
+                           LIMIT ?
+                       )''',
+                    (created_before, batch_size)
+                )
+                await db.commit()
+            expired += cursor.rowcount
+            if cursor.rowcount < batch_size:
+                return expired
+            await asyncio.sleep(0)
+
     async def create_withdrawal(self, user_id, amount, withdrawal_id):
-        async with aiosqlite.connect(self.db_path) as db:
+        async with self._connection() as db:
             await db.execute(
                 '''INSERT INTO withdrawals (user_id, amount, withdrawal_id, created_date) 
                    VALUES (?, ?, ?, ?)''',
@@ -259,7 +508,7 @@ class Database:
             await db.commit()
 
     async def get_withdrawal(self, withdrawal_id):
-        async with aiosqlite.connect(self.db_path) as db:
+        async with self._connection() as db:
             cursor = await db.execute(
                 "SELECT * FROM withdrawals WHERE withdrawal_id = ?", (withdrawal_id,)
             )
@@ -276,15 +525,153 @@ class Database:
             return None
 
     async def update_withdrawal_status(self, withdrawal_id, status):
-        async with aiosqlite.connect(self.db_path) as db:
+        async with self._connection() as db:
             await db.execute(
                 "UPDATE withdrawals SET status = ? WHERE withdrawal_id = ?",
                 (status, withdrawal_id)
             )
             await db.commit()
 
+    async def get_pending_withdrawals(self, after=None, limit=10):
+        """Страница заявок на вывод в статусе pending, от старых к новым.
+
+        Идет по индексу (status, created_date) с ключом [created_date, id]
+        из прошлой страницы; возвращает (заявки, курсор следующей страницы).
+        """
+        after = after or ['', 0]
+        async with self._connection() as db:
+            cursor = await db.execute(
+                '''SELECT id, user_id, amount, withdrawal_id, created_date FROM withdrawals
+                   WHERE status = 'pending' AND (created_date, id) > (?, ?)
+                   ORDER BY created_date, id
+                   LIMIT ?''',
+                (after[0], after[1], limit + 1)
+            )
+            rows = await cursor.fetchall()
+
+        withdrawals = [
+            {
+                'id': row[0],
+                'user_id': row[1],
+                'amount': row[2],
+                'withdrawal_id': row[3],
+                'created_date': row[4]
+            }
+            for row in rows[:limit]
+        ]
+        next_cursor = None
+        if len(rows) > limit:
+            last = withdrawals[-1]
+            next_cursor = [last['created_date'], last['id']]
+        return withdrawals, next_cursor
+
+    async def count_pending_withdrawals(self):
+        async with self._connection() as db:
+            cursor = await db.execute("SELECT COUNT(*) FROM withdrawals WHERE status = 'pending'")
+            return (await cursor.fetchone())[0]
+
+    async def process_withdrawals(self, withdrawal_ids, approve):
+        """Одобряет или отклоняет заявки одной транзакцией.
+
+        Меняются только заявки, еще ожидающие обработки, поэтому повторное
+        нажатие ничего не делает. При отклонении сумма возвращается на startL
+        в той же транзакции. Возвращает список обработанных заявок.
+        """
+        if not withdrawal_ids:
+            return []
+        placeholders = ", ".join("?" * len(withdrawal_ids))
+        async with self._connection() as db:
+            await db.execute("BEGIN IMMEDIATE")
+            cursor = await db.execute(
+                f'''UPDATE withdrawals SET status = ?
+                    WHERE withdrawal_id IN ({placeholders}) AND status = 'pending'
+                    RETURNING user_id, amount, withdrawal_id''',
+                ('approved' if approve else 'rejected', *withdrawal_ids)
+            )
+            rows = await cursor.fetchall()
+            if not approve:
+                await db.executemany(
+                    "UPDATE users SET startL = startL + ? WHERE user_id = ?",
+                    [(amount, user_id) for user_id, amount, _ in rows]
+                )
+            await db.commit()
+
+        for user_id, _, _ in rows:
+            self.user_cache.invalidate(user_id)
+        return [{'user_id': row[0], 'amount': row[1], 'withdrawal_id': row[2]} for row in rows]
+
+    async def create_broadcast(self, text, creator_id):
+        """Создает рассылку в статусе running и возвращает ее id"""
+        async with self._connection() as db:
+            cursor = await db.execute(
+                "INSERT INTO broadcasts (text, creator_id, created_date) VALUES (?, ?, ?)",
+                (text, creator_id, datetime.now().isoformat())
+            )
+            await db.commit()
+            return cursor.lastrowid
+
+    async def get_broadcast(self, broadcast_id):
+        async with self._connection() as db:
+            cursor = await db.execute(
+                f"SELECT {BROADCAST_COLUMNS} FROM broadcasts WHERE id = ?", (broadcast_id,)
+            )
+            row = await cursor.fetchone()
+        return _broadcast_row(row) if row else None
+
+    async def get_running_broadcasts(self):
+        async with self._connection() as db:
+            cursor = await db.execute(
+                f"SELECT {BROADCAST_COLUMNS} FROM broadcasts WHERE status = 'running' ORDER BY id"
+            )
+            rows = await cursor.fetchall()
+        return [_broadcast_row(row) for row in rows]
+
+    async def get_broadcast_recipients(self, after_user_id, limit=100):
+        """Следующая пачка получателей рассылки по первичному ключу, без заблокировавших бота"""
+        async with self._connection() as db:
+            cursor = await db.execute(
+                "SELECT user_id FROM users WHERE user_id > ? AND blocked = 0 ORDER BY user_id LIMIT ?",
+                (after_user_id, limit)
+            )
+            return [row[0] for row in await cursor.fetchall()]
+
+    async def save_broadcast_progress(self, broadcast_id, last_user_id, sent, failed, blocked_user_ids=()):
+        """Сохраняет курсор и счетчики пачки вместе с пометкой blocked одной транзакцией.
+
+        Возвращает текущий статус рассылки: другой процесс мог ее остановить.
+        """
+        async with self._connection() as db:
+            await db.execute("BEGIN IMMEDIATE")
+            await db.executemany(
+                "UPDATE users SET blocked = 1 WHERE user_id = ?",
+                [(user_id,) for user_id in blocked_user_ids]
+            )
+            cursor = await db.execute(
+                '''UPDATE broadcasts SET last_user_id = ?, sent = sent + ?, blocked = blocked + ?,
+                                         failed = failed + ?
+                   WHERE id = ?
+                   RETURNING status''',
+                (last_user_id, sent, len(blocked_user_ids), failed, broadcast_id)
+            )
+            row = await cursor.fetchone()
+            await db.commit()
+
+        for user_id in blocked_user_ids:
+            self.user_cache.invalidate(user_id)
+        return row[0] if row else None
+
+    async def finish_broadcast(self, broadcast_id, status):
+        """Переводит идущую рассылку в status (finished или cancelled)"""
+        async with self._connection() as db:
+            cursor = await db.execute(
+                "UPDATE broadcasts SET status = ?, finished_date = ? WHERE id = ? AND status = 'running'",
+                (status, datetime.now().isoformat(), broadcast_id)
+            )
+            await db.commit()
+            return cursor.rowcount == 1
+
     async def deactivate_check(self, check_code):
-        async with aiosqlite.connect(self.db_path) as db:
+        async with self._connection() as db:
             await db.execute(
                 "UPDATE checks SET is_active = 0 WHERE code = ?",
                 (check_code,)
@@ -292,32 +679,221 @@ class Database:
             await db.commit()
 
     async def get_stats(self):
-        async with aiosqlite.connect(self.db_path) as db:
-            cursor = await db.execute("SELECT COUNT(*) FROM users")
-            total_users = (await cursor.fetchone())[0]
+        async with self._connection() as db:
+            cursor = await db.execute(
+                f"SELECT {', '.join(STATS_FIELDS)} FROM stats WHERE id = 1"
+            )
+            row = await cursor.fetchone()
+            return dict(zip(STATS_FIELDS, row))
+
+    async def compute_stats(self, db=None):
+        """Считает статистику агрегатами по всем таблицам (полный проход)"""
+        if db is None:
+            async with self._connection() as db:
+                return await self.compute_stats(db)
+
+        cursor = await db.execute("SELECT COUNT(*) FROM users")
+        total_users = (await cursor.fetchone())[0]
+
+        cursor = await db.execute(
+            "SELECT SUM(bananas), SUM(stars), SUM(cakes), SUM(startL), SUM(startB) FROM users"
+        )
+        totals = await cursor.fetchone()
+
+        cursor = await db.execute("SELECT COUNT(*) FROM checks")
+        total_checks = (await cursor.fetchone())[0]
+
+        cursor = await db.execute("SELECT SUM(activations) FROM checks")
+        total_activations = (await cursor.fetchone())[0] or 0
+
+        cursor = await db.execute("SELECT COUNT(*) FROM withdrawals")
+        total_withdrawals = (await cursor.fetchone())[0]
+
+        return {
+            'total_users': total_users,
+            'total_bananas': totals[0] or 0,
+            'total_stars': totals[1] or 0,
+            'total_cakes': totals[2] or 0,
+            'total_startL': totals[3] or 0,
+            'total_startB': totals[4] or 0,
+            'total_checks': total_checks,
+            'total_activations': total_activations,
+            'total_withdrawals': total_withdrawals
+        }
+
+    async def rebuild_stats(self):
+        """Пересчитывает таблицу stats с нуля и возвращает (было, стало)"""
+        async with self._connection() as db:
+            await db.execute("BEGIN IMMEDIATE")
+            cursor = await db.execute(
+                f"SELECT {', '.join(STATS_FIELDS)} FROM stats WHERE id = 1"
+            )
+            before = dict(zip(STATS_FIELDS, await cursor.fetchone()))
+            after = await self.compute_stats(db)
+            await db.execute(
+                f"UPDATE stats SET {', '.join(f'{field} = ?' for field in STATS_FIELDS)} WHERE id = 1",
+                [after[field] for field in STATS_FIELDS]
+            )
+            await db.commit()
+            return before, after
+
+    async def claim_check(self, code, user_id):
+        """Атомарно активирует чек: проверка, запись активации, начисление и деактивация"""
+        async with self._connection() as db:
+            await db.execute("BEGIN IMMEDIATE")
+
+            cursor = await db.execute(
+                '''INSERT INTO check_activations (check_code, user_id, activation_date)
+                   SELECT code, ?, ? FROM checks
+                   WHERE code = ? AND is_active = 1 AND activations < max_activations
+                   ON CONFLICT (check_code, user_id) DO NOTHING''',
+                (user_id, datetime.now().isoformat(), code)
+            )
+            if cursor.rowcount == 0:
+                status = await self._claim_failure_reason(db, code, user_id)
+                await db.rollback()
+                return status, None
+
+            cursor = await db.execute(
+                '''UPDATE checks
+                   SET activations = activations + 1,
+                       is_active = CASE WHEN activations + 1 >= max_activations THEN 0 ELSE 1 END
+                   WHERE code = ?
+                   RETURNING id, code, amount, currency, activations, max_activations,
+                             creator_id, created_date, is_active''',
+                (code,)
+            )
+            row = await cursor.fetchone()
+            check = {
+                'id': row[0],
+                'code': row[1],
+                'amount': row[2],
+                'currency': row[3],
+                'activations': row[4],
+                'max_activations': row[5],
+                'creator_id': row[6],
+                'created_date': row[7],
+                'is_active': row[8]
+            }
+
+            if check['currency'] not in CHECK_CURRENCIES:
+                await db.rollback()
+                raise ValueError(f"Неизвестная валюта чека: {check['currency']}")
+
+            await db.execute(
+                f"UPDATE users SET {check['currency']} = {check['currency']} + ? WHERE user_id = ?",
+                (check['amount'], user_id)
+            )
+            await db.commit()
+        self.user_cache.invalidate(user_id)
+        return 'ok', check
+
+    async def _claim_failure_reason(self, db, code, user_id):
+        cursor = await db.execute(
+            '''SELECT is_active, activations, max_activations,
+                      EXISTS(SELECT 1 FROM check_activations WHERE check_code = ? AND user_id = ?)
+               FROM checks WHERE code = ?''',
+            (code, user_id, code)
+        )
+        row = await cursor.fetchone()
+        if row is None:
+            return 'not_found'
+        if row[3]:
+            return 'already_activated'
+        if row[1] >= row[2]:
+            return 'exhausted'
+        return 'inactive'
+
+    async def get_check_claimers(self, check_code):
+        """Возвращает множество пользователей, активировавших чек"""
+        async with self._connection() as db:
+            cursor = await db.execute(
+                "SELECT user_id FROM check_activations WHERE check_code = ?",
+                (check_code,)
+            )
+            rows = await cursor.fetchall()
+            return {row[0] for row in rows}
+
+    async def apply_check_claims(self, claims):
+        """Записывает пачку активаций чеков одной транзакцией.
+
+        claims: список (check_code, user_id, currency, amount, activation_date)
+        """
+        counts = {}
+        credits = {}
+        for check_code, user_id, currency, amount, _ in claims:
+            if currency not in CHECK_CURRENCIES:
+                raise ValueError(f"Неизвестная валюта чека: {currency}")
+            counts[check_code] = counts.get(check_code, 0) + 1
+            credits.setdefault(currency, []).append((amount, user_id))
+
+        async with self._connection() as db:
+            await db.execute("BEGIN IMMEDIATE")
+            await db.executemany(
+                '''INSERT INTO check_activations (check_code, user_id, activation_date)
+                   VALUES (?, ?, ?)
+                   ON CONFLICT (check_code, user_id) DO NOTHING''',
+                [(check_code, user_id, date) for check_code, user_id, _, _, date in claims]
+            )
+            await db.executemany(
+                '''UPDATE checks
+                   SET activations = activations + ?,
+                       is_active = CASE WHEN activations + ? >= max_activations THEN 0 ELSE is_active END
+                   WHERE code = ?''',
+                [(count, count, check_code) for check_code, count in counts.items()]
+            )
+            for currency, rows in credits.items():
+                await db.executemany(
+                    f"UPDATE users SET {currency} = {currency} + ? WHERE user_id = ?",
+                    rows
+                )
+            await db.commit()
+        for _, user_id, _, _, _ in claims:
+            self.user_cache.invalidate(user_id)
 
+    async def get_all_qk_codes(self):
+        """Возвращает множество всех занятых qK-кодов"""
+        async with self._connection() as db:
+            cursor = await db.execute("SELECT qk_code FROM users WHERE qk_code IS NOT NULL")
+            rows = await cursor.fetchall()
+            return {row[0] for row in rows}
+
+    async def upsert_user(self, user_id, username, qk_code):
+        """Регистрирует пользователя или обновляет username одним запросом.
+
+        Пользователь снова пишет боту, поэтому пометка blocked снимается.
+        Если ни username, ни blocked не изменились, строка не переписывается,
+        а пользователь дочитывается обычным SELECT.
+
+        Возвращает BotUser; is_new=True, если пользователь только что создан.
+        Если qk_code уже занят, выбрасывает sqlite3.IntegrityError.
+        """
+        generation = self.user_cache.generation
+        async with self._connection() as db:
             cursor = await db.execute(
-                "SELECT SUM(bananas), SUM(stars), SUM(cakes), SUM(startL), SUM(startB) FROM users"
-            )
-            totals = await cursor.fetchone()
-
-            cursor = await db.execute("SELECT COUNT(*) FROM checks")
-            total_checks = (await cursor.fetchone())[0]
-
-            cursor = await db.execute("SELECT SUM(activations) FROM checks")
-            total_activations = (await cursor.fetchone())[0] or 0
-
-            cursor = await db.execute("SELECT COUNT(*) FROM withdrawals")
-            total_withdrawals = (await cursor.fetchone())[0]
-
-            return {
-                'total_users': total_users,
-                'total_bananas': totals[0] or 0,
-                'total_stars': totals[1] or 0,
-                'total_cakes': totals[2] or 0,
-                'total_startL': totals[3] or 0,
-                'total_startB': totals[4] or 0,
-                'total_checks': total_checks,
-                'total_activations': total_activations,
-                'total_withdrawals': total_withdrawals
-            }
\ No newline at end of file
+                f'''INSERT INTO users (user_id, username, qk_code, registration_date)
+                    VALUES (?, ?, ?, ?)
+                    ON CONFLICT (user_id) DO UPDATE SET username = excluded.username, blocked = 0
+                    WHERE username IS NOT excluded.username OR blocked
+                    RETURNING {USER_COLUMNS}''',
+                (user_id, username, qk_code, datetime.now().isoformat())
+            )
+            row = await cursor.fetchone()
+            await db.commit()
+            if row is None:
+                cursor = await db.execute(f"SELECT {USER_COLUMNS} FROM users WHERE user_id = ?", (user_id,))
+                row = await cursor.fetchone()
+        user = BotUser(*row, is_new=row[2] == qk_code)
+        self.user_cache.put(user_id, {
+            'user_id': user.user_id,
+            'username': user.username,
+            'qk_code': user.qk_code,
+            'bananas': user.bananas,
+            'stars': user.stars,
+            'cakes': user.cakes,
+            'startL': user.startL,
+            'startB': user.startB,
+            'registration_date': user.registration_date,
+            'blocked': user.blocked
+        }, generation)
+        return user
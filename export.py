@@ -0,0 +1,106 @@
+import csv
+import gzip
+import io
+import tempfile
+from contextlib import aclosing
+
+from aiogram.types import BufferedInputFile, InputFile
+
+# Лимит Telegram на отправку документа ботом
+TELEGRAM_FILE_LIMIT = 50 * 1024 * 1024
+# Запас на буфер gzip и последнюю пачку строк
+PART_MARGIN = 1024 * 1024
+SPOOL_MAX_SIZE = 4 * 1024 * 1024
+
+EXPORT_FORMATS = ('txt', 'csv')
+
+
+class SpooledInputFile(InputFile):
+    """Документ для отправки из временного файла без чтения целиком в память"""
+
+    def __init__(self, file, filename, chunk_size=64 * 1024):
+        super().__init__(filename=filename, chunk_size=chunk_size)
+        self.file = file
+
+    async def read(self, bot):
+        self.file.seek(0)
+        while chunk := self.file.read(self.chunk_size):
+            yield chunk
+
+
+class _ExportPart:
+    def __init__(self, fmt, compress):
+        self.raw = tempfile.SpooledTemporaryFile(max_size=SPOOL_MAX_SIZE)
+        self._gzip = gzip.GzipFile(fileobj=self.raw, mode='wb') if compress else None
+        self.text = io.TextIOWrapper(self._gzip or self.raw, encoding='utf-8', newline='')
+        if fmt == 'csv':
+            self.writer = csv.writer(self.text)
+            self.writer.writerow(('user_id', 'username'))
+        else:
+            self.writer = None
+            self.text.write("📋 СПИСОК ВСЕХ ПОЛЬЗОВАТЕЛЕЙ:\n\n")
+
+    def write_users(self, users):
+        if self.writer is not None:
+            self.writer.writerows((user['user_id'], user['username']) for user in users)
+            return
+        for user in users:
+            username = user['username'] if user['username'] != 'Без username' else 'Нет username'
+            self.text.write(f"ID: {user['user_id']} | @{username}\n")
+
+    def size(self):
+        self.text.flush()
+        return self.raw.tell()
+
+    def finish(self):
+        """Закрывает обертки и возвращает файл с готовыми данными"""
+        self.text.flush()
+        self.text.detach()
+        if self._gzip is not None:
+            self._gzip.close()
+        self.raw.seek(0)
+        return self.raw
+
+
+async def export_users(db, fmt='txt', compress=False, part_size=TELEGRAM_FILE_LIMIT, batch_size=1000):
+    """Потоково выгружает пользователей частями не больше part_size.
+
+    Отдает SpooledInputFile на каждую часть; память не зависит от числа
+    пользователей. После отправки части нужно закрыть document.file.
+    """
+    if fmt not in EXPORT_FORMATS:
+        raise ValueError(f"Неизвестный формат выгрузки: {fmt}")
+
+    extension = f"{fmt}.gz" if compress else fmt
+    part_number = 1
+    part = _ExportPart(fmt, compress)
+    has_rows = False
+
+    async with aclosing(db.iter_users(batch_size)) as batches:
+        async for users in batches:
+            part.write_users(users)
+            has_rows = True
+            if part.size() >= part_size - PART_MARGIN:
+                yield _part_document(part, part_number, extension)
+                part_number += 1
+                part = _ExportPart(fmt, compress)
+                has_rows = False
+
+    if has_rows or part_number == 1:
+        yield _part_document(part, part_number, extension)
+    else:
+        part.finish().close()
+
+
+def _part_document(part, number, extension):
+    name = "users_list" if number == 1 else f"users_list_{number}"
+    return SpooledInputFile(part.finish(), filename=f"{name}.{extension}")
+
+
+def check_links_document(checks, filename="checks.csv"):
+    """CSV с кодами и ссылками созданных чеков; checks — пары (код, ссылка)"""
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    writer.writerow(('code', 'link'))
+    writer.writerows(checks)
+    return BufferedInputFile(buffer.getvalue().encode('utf-8'), filename=filename)
\ No newline at end of file
@@ -0,0 +1,78 @@
+import asyncio
+import logging
+
+logger = logging.getLogger(__name__)
+
+
+class GroupCommitWriter:
+    """Объединяет одиночные изменения из разных хендлеров в общие транзакции.
+
+    Операции копятся до max_batch штук или max_delay секунд и выполняются
+    одной транзакцией. SQLite откатывает только упавший оператор, поэтому
+    ошибка одной операции не трогает остальные. Вызывающий получает
+    rowcount своей операции или ее исключение после коммита всей пачки.
+    """
+
+    def __init__(self, db, max_delay=0.005, max_batch=200):
+        self.db = db
+        self.max_delay = max_delay
+        self.max_batch = max_batch
+        self.commits = 0
+        self.operations = 0
+        self._pending = []
+        self._task = None
+
+    async def execute(self, sql, params=()):
+        future = asyncio.get_running_loop().create_future()
+        self._pending.append((sql, params, future))
+        if self._task is None or self._task.done():
+            self._task = asyncio.create_task(self._run())
+        return await future
+
+    async def flush(self):
+        """Дожидается записи всех поставленных операций"""
+        if self._task is not None:
+            await asyncio.shield(self._task)
+        while self._pending:
+            await self._commit_batch()
+
+    async def _run(self):
+        while self._pending:
+            if len(self._pending) < self.max_batch:
+                await asyncio.sleep(self.max_delay)
+            await self._commit_batch()
+
+    async def _commit_batch(self):
+        batch = self._pending[:self.max_batch]
+        del self._pending[:len(batch)]
+        results = []
+        try:
+            async with self.db._connection() as conn:
+                await conn.execute("BEGIN IMMEDIATE")
+                for sql, params, _ in batch:
+                    try:
+                        cursor = await conn.execute(sql, params)
+                    except Exception as e:
+                        # Ошибки вроде SQLITE_FULL откатывают всю транзакцию
+                        if not conn.in_transaction:
+                            raise
+                        results.append(e)
+                    else:
+                        results.append(cursor.rowcount)
+                await conn.commit()
+        except Exception as e:
+            logger.exception("Не удалось записать пачку из %d изменений", len(batch))
+            for _, _, future in batch:
+                if not future.done():
+                    future.set_exception(e)
+            return
+
+        self.commits += 1
+        self.operations += len(batch)
+        for (_, _, future), result in zip(batch, results):
+            if future.done():
+                continue
+            if isinstance(result, Exception):
+                future.set_exception(result)
+            else:
+                future.set_result(result)
@@ -1,19 +1,65 @@
 from aiogram import Router, F, Bot
-from aiogram.types import Message, CallbackQuery, PreCheckoutQuery, LabeledPrice, BufferedInputFile
+from aiogram.types import Message, CallbackQuery, PreCheckoutQuery, LabeledPrice
 from aiogram.filters import CommandStart
 from aiogram.fsm.context import FSMContext
 from aiogram.fsm.state import State, StatesGroup
+import logging
 import uuid
-import io
+from contextlib import aclosing
+
+import aiosqlite
 
 import cfg
-from database import Database
+from broadcast import Broadcaster, broadcast_progress
+from database import Database, BotUser
+from check_cache import CheckCache
+from export import check_links_document, export_users
 from keyboards import main_keyboard, currency_keyboard, activate_check_keyboard, support_keyboard, \
-    edit_currency_keyboard
-from utils import generate_qk_code
+    edit_currency_keyboard, user_browser_keyboard, withdrawal_queue_keyboard, broadcast_confirm_keyboard, \
+    broadcast_stop_keyboard
+from metrics import CallbackMetric, instrument_database, instrument_router
+from middlewares import ThrottlingMiddleware, UserMiddleware
+from notifications import AdminNotifier
+from outbound import PRIORITY_ADMIN, fan_out, send_in_background
+from payments import PendingPaymentSweeper
+from utils import QkCodePool, check_link, generate_check_codes
+
+logger = logging.getLogger(__name__)
+
+# Сколько раз перегенерировать пачку чеков, если код совпал с существующим
+MAX_MINT_RETRIES = 3
 
 router = Router()
-db = Database()
+db = Database(cfg.db_path)
+check_cache = CheckCache(db)
+qk_pool = QkCodePool(db)
+notifier = AdminNotifier(cfg.admin_id, cfg.notify_interval)
+payment_sweeper = PendingPaymentSweeper(db, cfg.payment_ttl)
+broadcaster = Broadcaster(db, cfg.broadcast_batch_size, cfg.broadcast_concurrency)
+
+throttling = ThrottlingMiddleware(exempt={cfg.admin_id})
+
+# Лимит проверяется до загрузки пользователя, чтобы спам не доходил до базы
+router.message.outer_middleware(throttling)
+router.callback_query.outer_middleware(throttling)
+router.message.outer_middleware(UserMiddleware(db, qk_pool))
+router.callback_query.outer_middleware(UserMiddleware(db, qk_pool))
+
+if cfg.metrics_port:
+    instrument_database(db)
+    instrument_router(router)
+    CallbackMetric(
+        'bot_throttled_total', "Запросы, отклоненные антифлудом", 'counter', ('action',),
+        lambda: {(name,): count for name, count in throttling.throttled.items()}
+    )
+    CallbackMetric(
+        'bot_user_cache_events_total', "Попадания, промахи и вытеснения кэша пользователей", 'counter', ('event',),
+        lambda: {(name,): value for name, value in db.user_cache.stats.items() if name != 'size'}
+    )
+    CallbackMetric(
+        'bot_user_cache_size', "Число пользователей в кэше", 'gauge', (),
+        lambda: {(): len(db.user_cache)}
+    )
 
 
 class CheckStates(StatesGroup):
@@ -37,18 +83,32 @@ class EditDBStates(StatesGroup):
     waiting_for_amount = State()
 
 
+class WithdrawalQueueStates(StatesGroup):
+    browsing = State()
+
+
+class BulkCheckStates(StatesGroup):
+    waiting_for_count = State()
+    waiting_for_currency = State()
+    waiting_for_amount = State()
+    waiting_for_activations = State()
+
+
+class BroadcastStates(StatesGroup):
+    waiting_for_text = State()
+    confirming = State()
+
+
 @router.message(CommandStart())
-async def start_handler(message: Message):
-    user_id = message.from_user.id
-    username = message.from_user.username or "Без username"
-    is_admin = user_id == cfg.admin_id
+async def start_handler(message: Message, user: BotUser):
+    is_admin = user.user_id == cfg.admin_id
 
     if len(message.text.split()) > 1:
         check_code = message.text.split()[1]
-        await handle_check_activation(message, check_code)
+        await handle_check_activation(message, check_code, user)
         return
 
-    if await db.user_exists(user_id):
+    if not user.is_new:
         await message.answer(
             "🌟 Доброго времени суток!",
             reply_markup=main_keyboard(is_admin)
@@ -59,55 +119,49 @@ async def start_handler(message: Message):
             f"Рад видеть вас в нашем боте! Сейчас я зарегистрирую вас в системе..."
         )
 
-        qk_code = await generate_qk_code(db)
-        await db.add_user(user_id, username, qk_code)
-
         await message.answer(
             f"✅ Регистрация успешно завершена!\n"
-            f"Ваш уникальный код: `{qk_code}`",
+            f"Ваш уникальный код: `{user.qk_code}`",
             parse_mode="Markdown",
             reply_markup=main_keyboard(is_admin)
         )
 
 
-async def handle_check_activation(message: Message, check_code: str):
-    user_id = message.from_user.id
-    username = message.from_user.username or "Без username"
+async def handle_check_activation(message: Message, check_code: str, user: BotUser):
+    user_id = user.user_id
     is_admin = user_id == cfg.admin_id
 
-    if not await db.user_exists(user_id):
-        qk_code = await generate_qk_code(db)
-        await db.add_user(user_id, username, qk_code)
+    if user.is_new:
         await message.answer(
             f"👋 Добро пожаловать! Вы зарегистрированы в системе.\n"
-            f"Ваш уникальный код: `{qk_code}`\n\n",
+            f"Ваш уникальный код: `{user.qk_code}`\n\n",
             parse_mode="Markdown"
         )
 
-    check_data = await db.get_check(check_code)
+    status, check_data = await check_cache.peek(check_code, user_id)
 
-    if not check_data:
+    if status == 'not_found':
         await message.answer(
             "❌ Чек не найден или недействителен.",
             reply_markup=main_keyboard(is_admin)
         )
         return
 
-    if not check_data['is_active']:
+    if status == 'inactive':
         await message.answer(
             "❌ Этот чек уже использован.",
             reply_markup=main_keyboard(is_admin)
         )
         return
 
-    if check_data['activations'] >= check_data['max_activations']:
+    if status == 'exhausted':
         await message.answer(
             "❌ Лимит активаций чека исчерпан.",
             reply_markup=main_keyboard(is_admin)
         )
         return
 
-    if await db.check_user_activated(check_code, user_id):
+    if status == 'already_activated':
         await message.answer(
             "❌ Вы уже активировали этот чек ранее.",
             reply_markup=main_keyboard(is_admin)
@@ -137,26 +191,20 @@ async def handle_check_activation(message: Message, check_code: str):
 
 
 @router.message(F.text == "👤 Профиль")
-async def profile_handler(message: Message):
-    user_id = message.from_user.id
-    user_data = await db.get_user(user_id)
-
-    if user_data:
-        await message.answer(
-            f"👤 **Ваш профиль**\n\n"
-            f"🆔 ID: `{user_data['user_id']}`\n"
-            f"👤 Username: @{user_data['username']}\n"
-            f"🔑 Код: `{user_data['qk_code']}`\n\n"
-            f"💰 **Баланс:**\n"
-            f"🍌 Бананы: {user_data['bananas']}\n"
-            f"⭐ Звезды: {user_data['stars']}\n"
-            f"🎂 Торты: {user_data['cakes']}\n"
-            f"⭐ Личные звезды: {user_data['startL']}\n"
-            f"🌟 Звезды бота: {user_data['startB']}",
-            parse_mode="Markdown"
-        )
-    else:
-        await message.answer("❌ Ошибка: профиль не найден")
+async def profile_handler(message: Message, user: BotUser):
+    await message.answer(
+        f"👤 **Ваш профиль**\n\n"
+        f"🆔 ID: `{user.user_id}`\n"
+        f"👤 Username: @{user.username}\n"
+        f"🔑 Код: `{user.qk_code}`\n\n"
+        f"💰 **Баланс:**\n"
+        f"🍌 Бананы: {user.bananas}\n"
+        f"⭐ Звезды: {user.stars}\n"
+        f"🎂 Торты: {user.cakes}\n"
+        f"⭐ Личные звезды: {user.startL}\n"
+        f"🌟 Звезды бота: {user.startB}",
+        parse_mode="Markdown"
+    )
 
 
 @router.message(F.text == "💰 Пополнить")
@@ -183,15 +231,8 @@ async def deposit_amount_handler(message: Message, state: FSMContext, bot: Bot):
 
 
 @router.message(F.text == "💸 Вывод")
-async def withdraw_handler(message: Message, state: FSMContext):
-    user_id = message.from_user.id
-    user_data = await db.get_user(user_id)
-
-    if not user_data:
-        await message.answer("❌ Ошибка: профиль не найден")
-        return
-
-    balance = user_data['startL']
+async def withdraw_handler(message: Message, state: FSMContext, user: BotUser):
+    balance = user.startL
 
     if balance < 100:
         await message.answer(
@@ -214,14 +255,12 @@ async def withdraw_handler(message: Message, state: FSMContext):
 
 
 @router.message(WithdrawStates.waiting_for_amount)
-async def withdraw_amount_handler(message: Message, state: FSMContext, bot: Bot):
+async def withdraw_amount_handler(message: Message, state: FSMContext, user: BotUser):
     try:
         amount = int(message.text)
-        user_id = message.from_user.id
-        username = message.from_user.username or "Без username"
-
-        user_data = await db.get_user(user_id)
-        balance = user_data['startL']
+        user_id = user.user_id
+        username = user.username
+        balance = user.startL
 
         if amount < 100:
             await message.answer("❌ Минимальная сумма вывода: 100 звезд")
@@ -233,7 +272,12 @@ async def withdraw_amount_handler(message: Message, state: FSMContext, bot: Bot)
 
         withdrawal_id = f"WD-{str(uuid.uuid4())[:8].upper()}"
 
-        await db.subtract_stars(user_id, amount)
+        # Баланс в user мог устареть: списание проверяет его в базе
+        if not await db.subtract_stars(user_id, amount):
+            current = await db.get_user(user_id)
+            await message.answer(f"❌ Недостаточно средств. Ваш баланс: {current['startL']} звезд")
+            return
+
         await db.create_withdrawal(user_id, amount, withdrawal_id)
 
         await message.answer(
@@ -246,19 +290,17 @@ async def withdraw_amount_handler(message: Message, state: FSMContext, bot: Bot)
             parse_mode="Markdown"
         )
 
-        try:
-            await bot.send_message(
-                cfg.admin_id,
-                f"💸 **Новая заявка на вывод!**\n\n"
-                f"👤 Пользователь: @{username} (ID: {user_id})\n"
-                f"💰 Сумма: {amount} звезд\n"
-                f"🆔 ID транзакции: `{withdrawal_id}`\n"
-                f"📅 Дата: {message.date.strftime('%Y-%m-%d %H:%M:%S')}\n\n"
-                f"🔥 Средства списаны с баланса пользователя.",
-                parse_mode="Markdown"
-            )
-        except:
-            pass
+        notifier.notify(
+            'withdrawal',
+            f"💸 **Новая заявка на вывод!**\n\n"
+            f"👤 Пользователь: @{username} (ID: {user_id})\n"
+            f"💰 Сумма: {amount} звезд\n"
+            f"🆔 ID транзакции: `{withdrawal_id}`\n"
+            f"📅 Дата: {message.date.strftime('%Y-%m-%d %H:%M:%S')}\n\n"
+            f"🔥 Средства списаны с баланса пользователя.",
+            f"👤 @{username} (ID: {user_id}): {amount} ⭐ — `{withdrawal_id}`",
+            amount=amount
+        )
 
         await state.clear()
 
@@ -288,73 +330,336 @@ async def edit_db_handler(message: Message, state: FSMContext):
         await message.answer("❌ У вас нет доступа к этой функции")
         return
 
-    # Получаем всех пользователей
-    users = await db.get_all_users()
+    await state.set_state(EditDBStates.waiting_for_user_id)
+    await state.update_data(browse_query=None, browse_cursors=[None])
+
+    if not await show_users_page(message, state):
+        await message.answer("❌ В базе данных нет пользователей")
+        await state.clear()
+
 
+async def show_users_page(message: Message, state: FSMContext, edit=False):
+    """Показывает страницу браузера пользователей; одна индексная выборка на страницу"""
+    data = await state.get_data()
+    query = data.get('browse_query')
+    cursors = data.get('browse_cursors', [None])
+
+    users, next_cursor = await db.get_users_page(query, cursors[-1])
     if not users:
-        await message.answer("❌ В базе данных нет пользователей")
+        return False
+
+    await state.update_data(browse_next=next_cursor)
+
+    text = f"🗃️ **Пользователи** (стр. {len(cursors)})\n"
+    if query:
+        text += f"🔎 Поиск: `{query}`\n"
+    text += "\nВыберите пользователя, пришлите его ID или начало @username / qK-кода для поиска:"
+
+    keyboard = user_browser_keyboard(users, has_prev=len(cursors) > 1, has_next=next_cursor is not None)
+    if edit:
+        await message.edit_text(text, parse_mode="Markdown", reply_markup=keyboard)
+    else:
+        await message.answer(text, parse_mode="Markdown", reply_markup=keyboard)
+    return True
+
+
+@router.callback_query(F.data.in_({"browse_next", "browse_prev"}), EditDBStates.waiting_for_user_id)
+async def browse_page_callback(callback: CallbackQuery, state: FSMContext):
+    data = await state.get_data()
+    cursors = data.get('browse_cursors', [None])
+
+    if callback.data == "browse_next" and data.get('browse_next') is not None:
+        cursors = cursors + [data['browse_next']]
+    elif callback.data == "browse_prev" and len(cursors) > 1:
+        cursors = cursors[:-1]
+
+    await state.update_data(browse_cursors=cursors)
+    await show_users_page(callback.message, state, edit=True)
+    await callback.answer()
+
+
+@router.callback_query(F.data.startswith("browse_user_"), EditDBStates.waiting_for_user_id)
+async def browse_user_callback(callback: CallbackQuery, state: FSMContext):
+    user_id = int(callback.data.replace("browse_user_", ""))
+    await select_user_for_edit(callback.message, state, user_id)
+    await callback.answer()
+
+
+@router.callback_query(F.data.startswith("export_"))
+async def export_format_callback(callback: CallbackQuery):
+    if callback.from_user.id != cfg.admin_id:
+        await callback.answer("❌ У вас нет доступа к этой функции", show_alert=True)
+        return
+
+    fmt, _, compress = callback.data.replace("export_", "").partition("_")
+    await callback.answer("⏳ Готовлю выгрузку...")
+    await send_users_export(callback.message, fmt=fmt, compress=compress == "gz")
+
+
+async def send_users_export(message: Message, fmt="txt", compress=False):
+    """Отправляет выгрузку пользователей одним или несколькими документами"""
+    part_number = 1
+    # Если отправка упадет, aclosing закроет генератор выгрузки сразу, а не при сборке мусора
+    async with aclosing(export_users(db, fmt=fmt, compress=compress)) as documents:
+        async for document in documents:
+            caption = "📋 Список всех пользователей"
+            if part_number > 1:
+                caption += f" (часть {part_number})"
+            try:
+                await message.answer_document(document=document, caption=caption)
+            finally:
+                document.file.close()
+            part_number += 1
+
+
+@router.message(F.text == "📤 Заявки на вывод")
+async def withdrawal_queue_handler(message: Message, state: FSMContext):
+    if message.from_user.id != cfg.admin_id:
+        await message.answer("❌ У вас нет доступа к этой функции")
         return
 
-    # Создаем текстовый файл со списком пользователей
-    users_text = "📋 СПИСОК ВСЕХ ПОЛЬЗОВАТЕЛЕЙ:\n\n"
-    for user in users:
-        username = user['username'] if user['username'] != 'Без username' else 'Нет username'
-        users_text += f"ID: {user['user_id']} | @{username}\n"
+    await state.set_state(WithdrawalQueueStates.browsing)
+    await state.update_data(wq_cursors=[None], wq_selected=[])
 
-    # Создаем файл правильным способом для aiogram 3.21.0
-    file_bytes = users_text.encode('utf-8')
-    file_document = BufferedInputFile(file_bytes, filename="users_list.txt")
+    if not await show_withdrawals_page(message, state):
+        await message.answer("✅ Необработанных заявок на вывод нет")
+        await state.clear()
 
-    # Отправляем файл
-    await message.answer_document(
-        document=file_document,
-        caption="📋 **Список всех пользователей**\n\nПришлите ID пользователя для редактирования:",
-        parse_mode="Markdown"
+
+async def show_withdrawals_page(message: Message, state: FSMContext, edit=False):
+    """Показывает страницу очереди заявок на вывод; одна индексная выборка на страницу"""
+    data = await state.get_data()
+    cursors = data.get('wq_cursors', [None])
+    selected = data.get('wq_selected', [])
+
+    withdrawals, next_cursor = await db.get_pending_withdrawals(cursors[-1])
+    if not withdrawals and len(cursors) > 1:
+        # Страница опустела после обработки: возвращаемся на предыдущую
+        cursors = cursors[:-1]
+        withdrawals, next_cursor = await db.get_pending_withdrawals(cursors[-1])
+    if not withdrawals:
+        return False
+
+    page = [withdrawal['withdrawal_id'] for withdrawal in withdrawals]
+    selected = [withdrawal_id for withdrawal_id in selected if withdrawal_id in page]
+    await state.update_data(wq_cursors=cursors, wq_next=next_cursor, wq_page=page, wq_selected=selected)
+
+    total = await db.count_pending_withdrawals()
+    text = (
+        f"📤 **Заявки на вывод** (стр. {len(cursors)}, всего ожидают: {total})\n\n"
+        f"Отметьте заявки или обработайте всю страницу. "
+        f"При отклонении звезды возвращаются пользователю."
     )
 
-    await state.set_state(EditDBStates.waiting_for_user_id)
+    keyboard = withdrawal_queue_keyboard(
+        withdrawals, set(selected), has_prev=len(cursors) > 1, has_next=next_cursor is not None
+    )
+    if edit:
+        await message.edit_text(text, parse_mode="Markdown", reply_markup=keyboard)
+    else:
+        await message.answer(text, parse_mode="Markdown", reply_markup=keyboard)
+    return True
 
 
-@router.message(EditDBStates.waiting_for_user_id)
-async def edit_user_id_handler(message: Message, state: FSMContext):
-    try:
-        user_id = int(message.text.strip())
+@router.callback_query(F.data.in_({"wq_next", "wq_prev"}), WithdrawalQueueStates.browsing)
+async def withdrawal_page_callback(callback: CallbackQuery, state: FSMContext):
+    data = await state.get_data()
+    cursors = data.get('wq_cursors', [None])
 
-        # Проверяем существует ли пользователь
-        user_data = await db.get_user(user_id)
+    if callback.data == "wq_next" and data.get('wq_next') is not None:
+        cursors = cursors + [data['wq_next']]
+    elif callback.data == "wq_prev" and len(cursors) > 1:
+        cursors = cursors[:-1]
+
+    await state.update_data(wq_cursors=cursors, wq_selected=[])
+    await show_withdrawals_page(callback.message, state, edit=True)
+    await callback.answer()
+
+
+@router.callback_query(F.data.startswith("wq_toggle_"), WithdrawalQueueStates.browsing)
+async def withdrawal_toggle_callback(callback: CallbackQuery, state: FSMContext):
+    withdrawal_id = callback.data.replace("wq_toggle_", "")
+    selected = (await state.get_data()).get('wq_selected', [])
+
+    if withdrawal_id in selected:
+        selected = [item for item in selected if item != withdrawal_id]
+    else:
+        selected = selected + [withdrawal_id]
+
+    await state.update_data(wq_selected=selected)
+    await show_withdrawals_page(callback.message, state, edit=True)
+    await callback.answer()
 
-        if not user_data:
-            await message.answer("❌ Пользователь с таким ID не найден. Попробуйте еще раз:")
-            return
 
-        # Сохраняем ID пользователя
-        await state.update_data(edit_user_id=user_id, user_data=user_data)
+@router.callback_query(
+    F.data.in_({"wq_approve_selected", "wq_reject_selected", "wq_approve_page", "wq_reject_page"}),
+    WithdrawalQueueStates.browsing
+)
+async def withdrawal_process_callback(callback: CallbackQuery, state: FSMContext, bot: Bot):
+    action, _, scope = callback.data.replace("wq_", "").partition("_")
+    approve = action == "approve"
+    data = await state.get_data()
+    withdrawal_ids = data.get('wq_selected', []) if scope == "selected" else data.get('wq_page', [])
+
+    processed = await db.process_withdrawals(withdrawal_ids, approve)
+    await state.update_data(wq_selected=[])
+
+    # Пользователей уведомляем в фоне, не задерживая ответ админу
+    if approve:
+        fan_out([
+            bot.send_message(
+                withdrawal['user_id'],
+                f"✅ **Заявка на вывод одобрена!**\n\n"
+                f"🆔 ID транзакции: `{withdrawal['withdrawal_id']}`\n"
+                f"💰 Сумма: {withdrawal['amount']} звезд",
+                parse_mode="Markdown"
+            )
+            for withdrawal in processed
+        ], priority=PRIORITY_ADMIN)
+    else:
+        fan_out([
+            bot.send_message(
+                withdrawal['user_id'],
+                f"❌ **Заявка на вывод отклонена**\n\n"
+                f"🆔 ID транзакции: `{withdrawal['withdrawal_id']}`\n"
+                f"💰 {withdrawal['amount']} звезд возвращены на ваш баланс.",
+                parse_mode="Markdown"
+            )
+            for withdrawal in processed
+        ], priority=PRIORITY_ADMIN)
+
+    await callback.answer(f"{'✅ Одобрено' if approve else '❌ Отклонено'} заявок: {len(processed)}")
+    if not await show_withdrawals_page(callback.message, state, edit=True):
+        await callback.message.edit_text("✅ Все заявки на вывод обработаны")
+        await state.clear()
 
+
+@router.message(F.text == "📢 Рассылка")
+async def broadcast_handler(message: Message, state: FSMContext):
+    if message.from_user.id != cfg.admin_id:
+        await message.answer("❌ У вас нет доступа к этой функции")
+        return
+
+    running = await db.get_running_broadcasts()
+    if running:
+        broadcast = running[0]
         await message.answer(
-            f"✅ **Найден пользователь:**\n"
-            f"👤 @{user_data['username']} (ID: {user_id})\n\n"
-            f"💰 **Текущие балансы:**\n"
-            f"🍌 Бананы: {user_data['bananas']}\n"
-            f"⭐ Звезды: {user_data['stars']}\n"
-            f"🎂 Торты: {user_data['cakes']}\n"
-            f"⭐ Личные звезды: {user_data['startL']}\n"
-            f"🌟 Звезды бота: {user_data['startB']}\n\n"
-            f"Какую валюту хотите отредактировать?",
+            broadcast_progress(broadcast, f"📢 **Рассылка #{broadcast['id']} идет**"),
             parse_mode="Markdown",
-            reply_markup=edit_currency_keyboard()
+            reply_markup=broadcast_stop_keyboard(broadcast['id'])
         )
+        return
+
+    await state.set_state(BroadcastStates.waiting_for_text)
+    await message.answer(
+        "📢 **Рассылка**\n\n"
+        "Отправьте текст сообщения. Его получат все пользователи, кроме заблокировавших бота.",
+        parse_mode="Markdown"
+    )
 
-        await state.set_state(EditDBStates.waiting_for_currency)
 
-    except ValueError:
-        await message.answer("❌ Введите корректный числовой ID пользователя:")
+@router.message(BroadcastStates.waiting_for_text)
+async def broadcast_text_handler(message: Message, state: FSMContext):
+    if not message.text:
+        await message.answer("❌ Отправьте текстовое сообщение")
+        return
+
+    await state.update_data(broadcast_text=message.html_text)
+    await state.set_state(BroadcastStates.confirming)
+    await message.answer(message.html_text, parse_mode="HTML")
+    await message.answer("👆 Так сообщение увидят пользователи. Отправить?", reply_markup=broadcast_confirm_keyboard())
+
+
+@router.callback_query(F.data.in_({"broadcast_confirm", "broadcast_cancel"}), BroadcastStates.confirming)
+async def broadcast_confirm_callback(callback: CallbackQuery, state: FSMContext):
+    text = (await state.get_data()).get('broadcast_text')
+    await state.clear()
+
+    if callback.data == "broadcast_cancel":
+        await callback.message.edit_text("❌ Рассылка отменена")
+        await callback.answer()
+        return
+
+    if await db.get_running_broadcasts():
+        await callback.answer("❌ Уже идет другая рассылка", show_alert=True)
+        return
+
+    broadcast_id = await broadcaster.begin(text, callback.from_user.id)
+    await callback.message.edit_text(
+        f"📢 Рассылка #{broadcast_id} запущена. Когда она закончится, придет сводка."
+    )
+    await callback.answer()
+
+
+@router.callback_query(F.data.startswith("broadcast_stop_"))
+async def broadcast_stop_callback(callback: CallbackQuery):
+    if callback.from_user.id != cfg.admin_id:
+        await callback.answer("❌ У вас нет доступа к этой функции", show_alert=True)
+        return
+
+    broadcast_id = int(callback.data.replace("broadcast_stop_", ""))
+    if await broadcaster.cancel(broadcast_id):
+        broadcast = await db.get_broadcast(broadcast_id)
+        await callback.message.edit_text(
+            broadcast_progress(broadcast, f"⏹ **Рассылка #{broadcast_id} остановлена**"),
+            parse_mode="Markdown"
+        )
+        await callback.answer()
+    else:
+        await callback.answer("Рассылка уже завершена", show_alert=True)
+
+
+@router.message(EditDBStates.waiting_for_user_id)
+async def edit_user_id_handler(message: Message, state: FSMContext):
+    text = message.text.strip() if message.text else ""
+
+    if text.isdigit():
+        await select_user_for_edit(message, state, int(text))
+        return
+
+    if not text:
+        await message.answer("❌ Введите ID пользователя или строку для поиска:")
+        return
+
+    # Все остальное считаем поиском по username или qK-коду
+    await state.update_data(browse_query=text, browse_cursors=[None])
+    if not await show_users_page(message, state):
+        await message.answer("❌ Ничего не найдено. Попробуйте другой запрос или ID:")
+
+
+async def select_user_for_edit(message: Message, state: FSMContext, user_id: int):
+    # Проверяем существует ли пользователь
+    user_data = await db.get_user(user_id)
+
+    if not user_data:
+        await message.answer("❌ Пользователь с таким ID не найден. Попробуйте еще раз:")
+        return
+
+    # Сохраняем только ID: данные пользователя читаются заново из кэша
+    await state.update_data(edit_user_id=user_id)
+
+    await message.answer(
+        f"✅ **Найден пользователь:**\n"
+        f"👤 @{user_data['username']} (ID: {user_id})\n\n"
+        f"💰 **Текущие балансы:**\n"
+        f"🍌 Бананы: {user_data['bananas']}\n"
+        f"⭐ Звезды: {user_data['stars']}\n"
+        f"🎂 Торты: {user_data['cakes']}\n"
+        f"⭐ Личные звезды: {user_data['startL']}\n"
+        f"🌟 Звезды бота: {user_data['startB']}\n\n"
+        f"Какую валюту хотите отредактировать?",
+        parse_mode="Markdown",
+        reply_markup=edit_currency_keyboard()
+    )
+
+    await state.set_state(EditDBStates.waiting_for_currency)
 
 
 @router.callback_query(F.data.startswith("edit_"), EditDBStates.waiting_for_currency)
 async def edit_currency_selected(callback: CallbackQuery, state: FSMContext):
     currency = callback.data.replace("edit_", "")
     data = await state.get_data()
-    user_data = data['user_data']
+    user_data = await db.get_user(data['edit_user_id'])
 
     current_amount = user_data[currency]
 
@@ -391,7 +696,7 @@ async def edit_amount_handler(message: Message, state: FSMContext):
         data = await state.get_data()
         user_id = data['edit_user_id']
         currency = data['edit_currency']
-        user_data = data['user_data']
+        user_data = await db.get_user(user_id)
         old_amount = user_data[currency]
 
         # Обновляем валюту пользователя
@@ -470,26 +775,34 @@ async def pre_checkout_handler(pre_checkout_query: PreCheckoutQuery):
 
 
 @router.message(F.successful_payment)
-async def successful_payment_handler(message: Message, bot: Bot):
+async def successful_payment_handler(message: Message):
     payment = message.successful_payment
     transaction_id = payment.invoice_payload
     amount = payment.total_amount
     user_id = message.from_user.id
     username = message.from_user.username or "Без username"
 
-    transaction = await db.get_transaction(transaction_id)
+    status, transaction = await db.settle_payment(transaction_id, amount, cfg.admin_id)
 
-    if not transaction:
+    if status == 'not_found':
         await message.answer("❌ Ошибка: транзакция не найдена")
         return
 
-    await db.update_transaction_status(transaction_id, 'completed')
+    if status == 'amount_mismatch':
+        logger.error(
+            "Оплата %s на %d звезд от %s не совпадает со счетом на %d звезд у пользователя %s",
+            transaction_id, amount, user_id, transaction['amount'], transaction['user_id']
+        )
+        await message.answer("❌ Ошибка: сумма оплаты не совпадает со счетом. Обратитесь к администратору")
+        return
+
+    # Telegram может доставить платеж повторно: он уже зачислен
+    if status == 'already_completed':
+        return
 
     payment_type = transaction['payment_type']
 
     if payment_type == "deposit":
-        await db.add_stars_user(user_id, amount)
-
         await message.answer(
             f"✅ **Пополнение успешно!**\n\n"
             f"💰 На ваш личный баланс зачислено {amount} звезд\n"
@@ -497,21 +810,17 @@ async def successful_payment_handler(message: Message, bot: Bot):
             parse_mode="Markdown"
         )
 
-        try:
-            await bot.send_message(
-                cfg.admin_id,
-                f"💰 **Пополнение баланса!**\n\n"
-                f"👤 Пользователь: @{username} (ID: {user_id})\n"
-                f"💰 Сумма: {amount} звезд\n"
-                f"🆔 Транзакция: `{transaction_id}`",
-                parse_mode="Markdown"
-            )
-        except:
-            pass
+        notifier.notify(
+            'deposit',
+            f"💰 **Пополнение баланса!**\n\n"
+            f"👤 Пользователь: @{username} (ID: {user_id})\n"
+            f"💰 Сумма: {amount} звезд\n"
+            f"🆔 Транзакция: `{transaction_id}`",
+            f"👤 @{username} (ID: {user_id}): {amount} ⭐",
+            amount=amount
+        )
 
     else:
-        await db.add_stars_bot(amount)
-
         await message.answer(
             f"🤝 **Спасибо за поддержку!**\n\n"
             f"💝 Вы поддержали разработчиков на {amount} звезд\n"
@@ -519,17 +828,15 @@ async def successful_payment_handler(message: Message, bot: Bot):
             parse_mode="Markdown"
         )
 
-        try:
-            await bot.send_message(
-                cfg.admin_id,
-                f"🤝 **Поддержка бота!**\n\n"
-                f"👤 Пользователь: @{username} (ID: {user_id})\n"
-                f"💝 Сумма поддержки: {amount} звезд\n"
-                f"🆔 Транзакция: `{transaction_id}`",
-                parse_mode="Markdown"
-            )
-        except:
-            pass
+        notifier.notify(
+            'support',
+            f"🤝 **Поддержка бота!**\n\n"
+            f"👤 Пользователь: @{username} (ID: {user_id})\n"
+            f"💝 Сумма поддержки: {amount} звезд\n"
+            f"🆔 Транзакция: `{transaction_id}`",
+            f"👤 @{username} (ID: {user_id}): {amount} ⭐",
+            amount=amount
+        )
 
 
 @router.message(F.text == "🎫 Создать чек")
@@ -635,8 +942,8 @@ async def code_handler(message: Message, state: FSMContext, bot: Bot):
         'cakes': '🎂 Торты'
     }
 
-    bot_info = await bot.get_me()
-    check_link = f"https://t.me/{bot_info.username}?start={check_code}"
+    bot_info = await bot.me()
+    link = check_link(bot_info.username, check_code)
 
     await message.answer(
         f"✅ **Ваш чек готов!**\n\n"
@@ -644,35 +951,142 @@ async def code_handler(message: Message, state: FSMContext, bot: Bot):
         f"💰 Награда: {data['amount']} {currency_names[data['currency']]}\n"
         f"🎯 Активаций: {data['max_activations']}\n\n"
         f"🔗 **Ссылка на чек:**\n"
-        f"`{check_link}`",
+        f"`{link}`",
+        parse_mode="Markdown"
+    )
+
+    await state.clear()
+
+
+@router.message(F.text == "🎟 Чеки пачкой")
+async def bulk_checks_handler(message: Message, state: FSMContext):
+    if message.from_user.id != cfg.admin_id:
+        await message.answer("❌ У вас нет доступа к этой функции")
+        return
+
+    await message.answer(
+        f"🎟 **Чеки пачкой**\n\n"
+        f"Введите, сколько чеков создать (до {cfg.bulk_check_limit}):",
         parse_mode="Markdown"
     )
+    await state.set_state(BulkCheckStates.waiting_for_count)
+
+
+@router.message(BulkCheckStates.waiting_for_count)
+async def bulk_count_handler(message: Message, state: FSMContext):
+    try:
+        count = int(message.text)
+        if count <= 0 or count > cfg.bulk_check_limit:
+            await message.answer(f"❌ Количество чеков должно быть от 1 до {cfg.bulk_check_limit}")
+            return
+
+        await state.update_data(count=count)
+        await message.answer("💰 Выберите валюту для чеков:", reply_markup=currency_keyboard())
+        await state.set_state(BulkCheckStates.waiting_for_currency)
+    except ValueError:
+        await message.answer("❌ Введите корректное число")
+
+
+@router.callback_query(F.data.startswith("currency_"), BulkCheckStates.waiting_for_currency)
+async def bulk_currency_selected(callback: CallbackQuery, state: FSMContext):
+    currency = callback.data.replace("currency_", "")
+    await state.update_data(currency=currency)
+
+    currency_names = {
+        'bananas': '🍌 Бананы',
+        'stars': '⭐ Звезды',
+        'cakes': '🎂 Торты'
+    }
+
+    await callback.message.edit_text(
+        f"✅ Выбрана валюта: {currency_names[currency]}\n\n"
+        f"💰 Введите награду за один чек:"
+    )
+    await state.set_state(BulkCheckStates.waiting_for_amount)
+    await callback.answer()
+
+
+@router.message(BulkCheckStates.waiting_for_amount)
+async def bulk_amount_handler(message: Message, state: FSMContext):
+    try:
+        amount = int(message.text)
+        if amount <= 0:
+            await message.answer("❌ Количество валюты должно быть больше 0")
+            return
+
+        await state.update_data(amount=amount)
+        await message.answer("🎯 Введите количество активаций каждого чека (1 — одноразовые):")
+        await state.set_state(BulkCheckStates.waiting_for_activations)
+    except ValueError:
+        await message.answer("❌ Введите корректное число")
+
+
+@router.message(BulkCheckStates.waiting_for_activations)
+async def bulk_activations_handler(message: Message, state: FSMContext, bot: Bot):
+    try:
+        activations = int(message.text)
+    except ValueError:
+        await message.answer("❌ Введите корректное число")
+        return
+    if activations <= 0:
+        await message.answer("❌ Количество активаций должно быть больше 0")
+        return
 
+    data = await state.get_data()
     await state.clear()
 
+    # Коды генерируются в памяти и вставляются одной транзакцией;
+    # совпадение с существующим кодом откатывает пачку, и она генерируется заново
+    for attempt in range(MAX_MINT_RETRIES):
+        codes = generate_check_codes(data['count'])
+        try:
+            await db.create_checks(codes, data['amount'], data['currency'], activations, message.from_user.id)
+            break
+        except aiosqlite.IntegrityError:
+            if attempt == MAX_MINT_RETRIES - 1:
+                raise
+
+    currency_names = {
+        'bananas': '🍌 Бананы',
+        'stars': '⭐ Звезды',
+        'cakes': '🎂 Торты'
+    }
+
+    bot_info = await bot.me()
+    document = check_links_document(
+        [(code, check_link(bot_info.username, code)) for code in codes],
+        filename=f"checks_{len(codes)}.csv"
+    )
+    await message.answer_document(
+        document=document,
+        caption=(
+            f"✅ **Создано чеков: {len(codes)}**\n\n"
+            f"💰 Награда: {data['amount']} {currency_names[data['currency']]}\n"
+            f"🎯 Активаций у каждого: {activations}"
+        ),
+        parse_mode="Markdown"
+    )
+
 
 @router.callback_query(F.data.startswith("activate_"))
-async def activate_check_callback(callback: CallbackQuery, bot: Bot):
+async def activate_check_callback(callback: CallbackQuery):
     check_code = callback.data.replace("activate_", "")
     user_id = callback.from_user.id
     username = callback.from_user.username or "Без username"
 
-    check_data = await db.get_check(check_code)
-
-    if not check_data or not check_data['is_active']:
-        await callback.answer("❌ Чек недействителен", show_alert=True)
-        return
+    status, check_data = await check_cache.claim(check_code, user_id)
 
-    if await db.check_user_activated(check_code, user_id):
+    if status == 'already_activated':
         await callback.answer("❌ Вы уже активировали этот чек", show_alert=True)
         return
 
-    if check_data['activations'] >= check_data['max_activations']:
+    if status == 'exhausted':
         await callback.answer("❌ Лимит активаций исчерпан", show_alert=True)
         return
 
-    await db.activate_check(check_code, user_id)
-    await db.add_currency(user_id, check_data['currency'], check_data['amount'])
+    if status != 'ok':
+        await callback.answer("❌ Чек недействителен", show_alert=True)
+        return
 
     currency_emoji = {
         'bananas': '🍌',
@@ -686,38 +1100,31 @@ async def activate_check_callback(callback: CallbackQuery, bot: Bot):
         'cakes': 'тортов'
     }
 
-    await callback.message.edit_text(
+    # Награда уже начислена: не держим хендлер, пока ответ ждет лимита чата
+    send_in_background(callback.message.edit_text(
         f"🎉 **Поздравляем!**\n\n"
         f"Вы получили {check_data['amount']} {currency_emoji[check_data['currency']]} {currency_name[check_data['currency']]}!\n"
         f"Награда добавлена в ваш профиль.",
         parse_mode="Markdown"
+    ))
+
+    notifier.notify(
+        'check_activated',
+        f"🎫 **Чек активирован!**\n\n"
+        f"👤 Пользователь: @{username} (ID: {user_id})\n"
+        f"🎫 Код чека: `{check_code}`\n"
+        f"💰 Награда: {check_data['amount']} {currency_emoji[check_data['currency']]}\n"
+        f"🎯 Активаций: {check_data['activations']}/{check_data['max_activations']}",
+        f"👤 @{username} (ID: {user_id}) — {check_data['activations']}/{check_data['max_activations']}",
+        key=check_code
     )
 
-    updated_check = await db.get_check(check_code)
-
-    try:
-        await bot.send_message(
-            cfg.admin_id,
-            f"🎫 **Чек активирован!**\n\n"
-            f"👤 Пользователь: @{username} (ID: {user_id})\n"
-            f"🎫 Код чека: `{check_code}`\n"
-            f"💰 Награда: {check_data['amount']} {currency_emoji[check_data['currency']]}\n"
-            f"🎯 Активаций: {updated_check['activations']}/{updated_check['max_activations']}",
-            parse_mode="Markdown"
+    if not check_data['is_active']:
+        notifier.notify(
+            'check_exhausted',
+            f"🔚 **Чек использован!**\n\n"
+            f"Чек `{check_code}` достиг лимита активаций и деактивирован.",
+            f"🎫 `{check_code}`"
         )
-    except:
-        pass
-
-    if updated_check['activations'] >= updated_check['max_activations']:
-        await db.deactivate_check(check_code)
-        try:
-            await bot.send_message(
-                cfg.admin_id,
-                f"🔚 **Чек использован!**\n\n"
-                f"Чек `{check_code}` достиг лимита активаций и деактивирован.",
-                parse_mode="Markdown"
-            )
-        except:
-            pass
 
     await callback.answer()
\ No newline at end of file
@@ -19,6 +19,11 @@ def main_keyboard(is_admin=False):
             KeyboardButton(text="🎫 Создать чек"),
             KeyboardButton(text="🗃️ Редактировать БД")
         )
+        builder.row(
+            KeyboardButton(text="📤 Заявки на вывод"),
+            KeyboardButton(text="📢 Рассылка")
+        )
+        builder.row(KeyboardButton(text="🎟 Чеки пачкой"))
 
     return builder.as_markup(resize_keyboard=True)
 
@@ -46,6 +51,86 @@ def edit_currency_keyboard():
     return builder.as_markup()
 
 
+def user_browser_keyboard(users, has_prev=False, has_next=False):
+    """Инлайн клавиатура страницы пользователей для редактирования БД"""
+    builder = InlineKeyboardBuilder()
+
+    for user in users:
+        builder.row(InlineKeyboardButton(
+            text=f"@{user['username']} · {user['user_id']}",
+            callback_data=f"browse_user_{user['user_id']}"
+        ))
+
+    navigation = []
+    if has_prev:
+        navigation.append(InlineKeyboardButton(text="◀️ Назад", callback_data="browse_prev"))
+    if has_next:
+        navigation.append(InlineKeyboardButton(text="Вперед ▶️", callback_data="browse_next"))
+    if navigation:
+        builder.row(*navigation)
+
+    builder.row(
+        InlineKeyboardButton(text="📄 TXT", callback_data="export_txt"),
+        InlineKeyboardButton(text="📄 CSV", callback_data="export_csv"),
+        InlineKeyboardButton(text="🗜 CSV.gz", callback_data="export_csv_gz")
+    )
+
+    return builder.as_markup()
+
+
+def withdrawal_queue_keyboard(withdrawals, selected, has_prev=False, has_next=False):
+    """Инлайн клавиатура очереди заявок на вывод с выбором заявок"""
+    builder = InlineKeyboardBuilder()
+
+    for withdrawal in withdrawals:
+        mark = "☑️" if withdrawal['withdrawal_id'] in selected else "⬜"
+        builder.row(InlineKeyboardButton(
+            text=f"{mark} {withdrawal['withdrawal_id']} · {withdrawal['amount']} ⭐ · {withdrawal['user_id']}",
+            callback_data=f"wq_toggle_{withdrawal['withdrawal_id']}"
+        ))
+
+    navigation = []
+    if has_prev:
+        navigation.append(InlineKeyboardButton(text="◀️ Назад", callback_data="wq_prev"))
+    if has_next:
+        navigation.append(InlineKeyboardButton(text="Вперед ▶️", callback_data="wq_next"))
+    if navigation:
+        builder.row(*navigation)
+
+    if selected:
+        builder.row(
+            InlineKeyboardButton(text=f"✅ Одобрить ({len(selected)})", callback_data="wq_approve_selected"),
+            InlineKeyboardButton(text=f"❌ Отклонить ({len(selected)})", callback_data="wq_reject_selected")
+        )
+    builder.row(
+        InlineKeyboardButton(text="✅ Одобрить страницу", callback_data="wq_approve_page"),
+        InlineKeyboardButton(text="❌ Отклонить страницу", callback_data="wq_reject_page")
+    )
+
+    return builder.as_markup()
+
+
+def broadcast_confirm_keyboard():
+    builder = InlineKeyboardBuilder()
+
+    builder.row(
+        InlineKeyboardButton(text="✅ Отправить всем", callback_data="broadcast_confirm"),
+        InlineKeyboardButton(text="❌ Отмена", callback_data="broadcast_cancel")
+    )
+
+    return builder.as_markup()
+
+
+def broadcast_stop_keyboard(broadcast_id):
+    builder = InlineKeyboardBuilder()
+
+    builder.row(
+        InlineKeyboardButton(text="⏹ Остановить рассылку", callback_data=f"broadcast_stop_{broadcast_id}")
+    )
+
+    return builder.as_markup()
+
+
 def activate_check_keyboard(check_code):
     builder = InlineKeyboardBuilder()
 
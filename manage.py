@@ -0,0 +1,48 @@
+"""Служебные команды для обслуживания базы бота.
+
+Пример: python manage.py migrate --db bot.db
+"""
+import argparse
+import asyncio
+
+from database import Database
+
+
+async def migrate(db):
+    before, after = await db.create_tables()
+    if before == after:
+        print(f"Схема актуальна: версия {after}")
+    else:
+        print(f"Схема обновлена: версия {before} -> {after}")
+
+
+async def rebuild_stats(db):
+    await db.create_tables()
+    before, after = await db.rebuild_stats()
+    for field, value in after.items():
+        mark = "" if before[field] == value else f"  (было {before[field]})"
+        print(f"{field}: {value}{mark}")
+
+
+COMMANDS = {
+    'migrate': migrate,
+    'rebuild-stats': rebuild_stats,
+}
+
+
+async def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("command", choices=sorted(COMMANDS))
+    parser.add_argument("--db", default="bot.db", help="путь к файлу базы")
+    args = parser.parse_args()
+
+    db = Database(args.db)
+    await db.connect()
+    try:
+        await COMMANDS[args.command](db)
+    finally:
+        await db.close()
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
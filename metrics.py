@@ -0,0 +1,207 @@
+import asyncio
+import bisect
+import time
+from functools import wraps
+from typing import Any, Awaitable, Callable, Dict
+
+from aiohttp import web
+from aiogram import BaseMiddleware
+from aiogram.client.session.middlewares.base import BaseRequestMiddleware
+from aiogram.types import TelegramObject
+
+# Границы корзин в секундах: от долей миллисекунды до десятков секунд
+LATENCY_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+REGISTRY = []
+
+
+def _labels(names, values, extra=""):
+    pairs = [f'{name}="{_escape(value)}"' for name, value in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+def _escape(value):
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+class Histogram:
+    """Гистограмма с фиксированными корзинами: observe — поиск корзины и два сложения"""
+
+    def __init__(self, name, documentation, labelnames=(), buckets=LATENCY_BUCKETS):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self.buckets = tuple(buckets)
+        self._series = {}
+        REGISTRY.append(self)
+
+    def observe(self, value, *labels):
+        series = self._series.get(labels)
+        if series is None:
+            series = self._series[labels] = [[0] * (len(self.buckets) + 1), 0.0]
+        series[0][bisect.bisect_left(self.buckets, value)] += 1
+        series[1] += value
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} histogram"]
+        bounds = [f'le="{bound:g}"' for bound in self.buckets] + ['le="+Inf"']
+        for labels, (counts, total) in self._series.items():
+            cumulative = 0
+            for bound, count in zip(bounds, counts):
+                cumulative += count
+                lines.append(f"{self.name}_bucket{_labels(self.labelnames, labels, bound)} {cumulative}")
+            lines.append(f"{self.name}_sum{_labels(self.labelnames, labels)} {total}")
+            lines.append(f"{self.name}_count{_labels(self.labelnames, labels)} {cumulative}")
+        return lines
+
+
+class CallbackMetric:
+    """Счетчик или gauge, значения которого читаются из collect() при каждом запросе"""
+
+    def __init__(self, name, documentation, kind, labelnames, collect):
+        self.name = name
+        self.documentation = documentation
+        self.kind = kind
+        self.labelnames = tuple(labelnames)
+        self.collect = collect
+        REGISTRY.append(self)
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} {self.kind}"]
+        for labels, value in self.collect().items():
+            lines.append(f"{self.name}{_labels(self.labelnames, labels)} {value}")
+        return lines
+
+
+HANDLER_LATENCY = Histogram('bot_handler_seconds', "Время работы хендлера", ('handler',))
+DB_METHOD_LATENCY = Histogram('bot_db_method_seconds', "Время выполнения метода Database", ('method',))
+DB_QUERY_LATENCY = Histogram('bot_db_query_seconds', "Время выполнения SQL-запроса", ('sql',))
+BOT_API_LATENCY = Histogram('bot_api_request_seconds', "Время запроса к Bot API", ('method',))
+LIMITER_WAIT = Histogram('bot_send_limiter_wait_seconds', "Ожидание лимитов отправки перед запросом к Bot API", ('method',))
+
+
+def render():
+    """Все метрики в текстовом формате Prometheus"""
+    lines = []
+    for metric in REGISTRY:
+        lines.extend(metric.render())
+    return "\n".join(lines) + "\n"
+
+
+class HandlerLatencyMiddleware(BaseMiddleware):
+    """Внутренний middleware: время работы хендлера по его имени"""
+
+    async def __call__(
+        self,
+        handler: Callable[[TelegramObject, Dict[str, Any]], Awaitable[Any]],
+        event: TelegramObject,
+        data: Dict[str, Any]
+    ) -> Any:
+        started = time.perf_counter()
+        try:
+            return await handler(event, data)
+        finally:
+            handler_object = data.get("handler")
+            name = handler_object.callback.__name__ if handler_object is not None else "unknown"
+            HANDLER_LATENCY.observe(time.perf_counter() - started, name)
+
+
+class BotApiTimingMiddleware(BaseRequestMiddleware):
+    """Время каждого запроса к Bot API; регистрируется после OutboundLimiter, без ожидания лимитов"""
+
+    async def __call__(self, make_request, bot, method):
+        started = time.perf_counter()
+        try:
+            return await make_request(bot, method)
+        finally:
+            BOT_API_LATENCY.observe(time.perf_counter() - started, type(method).__name__)
+
+
+def instrument_router(router):
+    middleware = HandlerLatencyMiddleware()
+    router.message.middleware(middleware)
+    router.callback_query.middleware(middleware)
+    router.pre_checkout_query.middleware(middleware)
+
+
+def instrument_limiter(limiter):
+    """Пишет ожидание лимитов OutboundLimiter в отдельную гистограмму"""
+    limiter.on_wait = LIMITER_WAIT.observe
+
+
+def instrument_database(db):
+    """Оборачивает публичные корутины Database и запросы соединений пула таймерами"""
+    for name in dir(type(db)):
+        if name.startswith('_'):
+            continue
+        method = getattr(db, name)
+        if asyncio.iscoroutinefunction(method):
+            setattr(db, name, _timed(method, DB_METHOD_LATENCY, name))
+
+    connect = db.connect
+
+    @wraps(connect)
+    async def instrumented_connect():
+        await connect()
+        for conn in db._connections:
+            if not getattr(conn, 'timed', False):
+                conn.execute = _timed_sql(conn.execute)
+                conn.executemany = _timed_sql(conn.executemany)
+                conn.timed = True
+
+    db.connect = instrumented_connect
+
+
+def _timed(method, histogram, label):
+    @wraps(method)
+    async def wrapper(*args, **kwargs):
+        started = time.perf_counter()
+        try:
+            return await method(*args, **kwargs)
+        finally:
+            histogram.observe(time.perf_counter() - started, label)
+    return wrapper
+
+
+def _timed_sql(execute):
+    @wraps(execute)
+    async def wrapper(sql, *args, **kwargs):
+        started = time.perf_counter()
+        try:
+            return await execute(sql, *args, **kwargs)
+        finally:
+            # Запросы параметризованы, поэтому текст запроса — ограниченный набор меток
+            DB_QUERY_LATENCY.observe(time.perf_counter() - started, " ".join(sql.split())[:120])
+    return wrapper
+
+
+class MetricsServer:
+    """HTTP-сервер с /metrics; при port=None ничего не запускает"""
+
+    def __init__(self, port, host="127.0.0.1"):
+        self.port = port
+        self.host = host
+        self._runner = None
+
+    async def start(self):
+        if not self.port or self._runner is not None:
+            return
+        app = web.Application()
+        app.router.add_get("/metrics", self._handle)
+        self._runner = web.AppRunner(app, access_log=None)
+        await self._runner.setup()
+        await web.TCPSite(self._runner, self.host, self.port).start()
+
+    async def stop(self):
+        if self._runner is not None:
+            await self._runner.cleanup()
+            self._runner = None
+
+    @staticmethod
+    async def _handle(request):
+        return web.Response(
+            body=render().encode(),
+            headers={"Content-Type": "text/plain; version=0.0.4; charset=utf-8"}
+        )
@@ -0,0 +1,153 @@
+import time
+from typing import Any, Awaitable, Callable, Dict
+
+import aiosqlite
+from aiogram import BaseMiddleware
+from aiogram.types import CallbackQuery, Message, TelegramObject
+
+MAX_QK_RETRIES = 5
+
+# Лимиты по классам действий: (запросов в секунду, сколько можно подряд)
+THROTTLE_LIMITS = {
+    'payment': (1 / 5, 2),
+    'check': (1, 3),
+    'default': (2, 5),
+}
+# Ввод суммы пополнения создает счет в Telegram и транзакцию в базе
+PAYMENT_STATES = {"DepositStates:waiting_for_amount"}
+
+
+class UserMiddleware(BaseMiddleware):
+    """Загружает или регистрирует пользователя один раз на апдейт.
+
+    Повторные апдейты обслуживаются из кэша пользователей Database, промах
+    кэша стоит одного SELECT. Запись нужна только новому пользователю,
+    при смене username и чтобы снять пометку blocked.
+    Передает в хендлеры BotUser под ключом user.
+    """
+
+    def __init__(self, db, qk_pool):
+        self.db = db
+        self.qk_pool = qk_pool
+
+    async def __call__(
+        self,
+        handler: Callable[[TelegramObject, Dict[str, Any]], Awaitable[Any]],
+        event: TelegramObject,
+        data: Dict[str, Any]
+    ) -> Any:
+        from_user = data.get("event_from_user")
+        if from_user is not None:
+            data["user"] = await self._load_user(from_user)
+        return await handler(event, data)
+
+    async def _load_user(self, from_user):
+        username = from_user.username or "Без username"
+        user = await self.db.get_bot_user(from_user.id)
+        # Заблокировавший бота снова пишет: upsert снимет пометку blocked
+        if user is not None and user.username == username and not user.blocked:
+            return user
+
+        for attempt in range(MAX_QK_RETRIES):
+            qk_code = self.qk_pool.take()
+            try:
+                user = await self.db.upsert_user(from_user.id, username, qk_code)
+            except aiosqlite.IntegrityError:
+                # Код успел занять другой процесс: берем следующий
+                if attempt == MAX_QK_RETRIES - 1:
+                    raise
+                continue
+            if not user.is_new:
+                self.qk_pool.release(qk_code)
+            return user
+
+
+def action_class(event, data):
+    """Класс действия для лимитов THROTTLE_LIMITS"""
+    if isinstance(event, CallbackQuery):
+        if event.data and event.data.startswith("activate_"):
+            return 'check'
+        if event.data and event.data.startswith("support_"):
+            return 'payment'
+    elif isinstance(event, Message):
+        if data.get("raw_state") in PAYMENT_STATES and event.text and event.text.isdigit():
+            return 'payment'
+        if event.text and event.text.startswith("/start "):
+            return 'check'
+    return 'default'
+
+
+class ThrottlingMiddleware(BaseMiddleware):
+    """Ограничивает частоту запросов одного пользователя по классам действий.
+
+    Для каждого пользователя и класса хранится одно число — время, когда
+    следующий запрос точно пройдет (GCRA, эквивалент ведра токенов).
+    Записи, уже не влияющие на лимит, раз в sweep_interval удаляются.
+    Отклоненный запрос получает короткий ответ, один на серию.
+    """
+
+    def __init__(self, limits=None, exempt=(), sweep_interval=60.0):
+        self.limits = {
+            name: (1 / rate, (burst - 1) / rate)
+            for name, (rate, burst) in (limits or THROTTLE_LIMITS).items()
+        }
+        self.exempt = set(exempt)
+        self.sweep_interval = sweep_interval
+        self.allowed = 0
+        self.throttled = dict.fromkeys(self.limits, 0)
+        self._arrivals = {name: {} for name in self.limits}
+        self._warned = {}
+        self._next_sweep = time.monotonic() + sweep_interval
+
+    async def __call__(
+        self,
+        handler: Callable[[TelegramObject, Dict[str, Any]], Awaitable[Any]],
+        event: TelegramObject,
+        data: Dict[str, Any]
+    ) -> Any:
+        from_user = data.get("event_from_user")
+        if from_user is None or from_user.id in self.exempt or \
+                (isinstance(event, Message) and event.successful_payment):
+            return await handler(event, data)
+
+        now = time.monotonic()
+        if now >= self._next_sweep:
+            self._sweep(now)
+
+        name = action_class(event, data)
+        interval, tolerance = self.limits[name]
+        arrivals = self._arrivals[name]
+        arrival = max(arrivals.get(from_user.id, now), now)
+        if arrival - now > tolerance:
+            self.throttled[name] += 1
+            await self._reject(event, from_user.id, arrival, now)
+            return None
+
+        arrivals[from_user.id] = arrival + interval
+        self.allowed += 1
+        return await handler(event, data)
+
+    @property
+    def stats(self):
+        return {
+            'allowed': self.allowed,
+            'throttled': dict(self.throttled),
+            'tracked': sum(len(arrivals) for arrivals in self._arrivals.values())
+        }
+
+    async def _reject(self, event, user_id, arrival, now):
+        if isinstance(event, CallbackQuery):
+            await event.answer("⏳ Слишком часто, попробуйте через пару секунд")
+            return
+        if self._warned.get(user_id, 0) > now:
+            return
+        self._warned[user_id] = arrival
+        await event.answer("⏳ Слишком много запросов, подождите немного")
+
+    def _sweep(self, now):
+        self._next_sweep = now + self.sweep_interval
+        for arrivals in self._arrivals.values():
+            stale = [user_id for user_id, arrival in arrivals.items() if arrival <= now]
+            for user_id in stale:
+                del arrivals[user_id]
+        self._warned = {user_id: until for user_id, until in self._warned.items() if until > now}
\ No newline at end of file
@@ -0,0 +1,253 @@
+"""Версионированные миграции схемы базы бота.
+
+Версия хранится в PRAGMA user_version. Каждая миграция применяется один
+раз и по возможности короткими транзакциями: индексы строятся по одному,
+чтобы запись в базу блокировалась только на время одного индекса, а
+читатели в режиме WAL не блокировались вовсе.
+"""
+import asyncio
+import logging
+
+logger = logging.getLogger(__name__)
+
+BASE_TABLES = (
+    '''CREATE TABLE IF NOT EXISTS users (
+        user_id INTEGER PRIMARY KEY,
+        username TEXT,
+        qk_code TEXT UNIQUE,
+        bananas INTEGER DEFAULT 0,
+        stars INTEGER DEFAULT 0,
+        cakes INTEGER DEFAULT 0,
+        startL INTEGER DEFAULT 0,
+        startB INTEGER DEFAULT 0,
+        registration_date TEXT
+    )''',
+    '''CREATE TABLE IF NOT EXISTS checks (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        code TEXT UNIQUE,
+        amount INTEGER,
+        currency TEXT,
+        activations INTEGER DEFAULT 0,
+        max_activations INTEGER,
+        creator_id INTEGER,
+        created_date TEXT,
+        is_active INTEGER DEFAULT 1
+    )''',
+    '''CREATE TABLE IF NOT EXISTS check_activations (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        check_code TEXT,
+        user_id INTEGER,
+        activation_date TEXT,
+        UNIQUE(check_code, user_id)
+    )''',
+    '''CREATE TABLE IF NOT EXISTS transactions (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        user_id INTEGER,
+        amount INTEGER,
+        transaction_id TEXT UNIQUE,
+        status TEXT,
+        payment_type TEXT,
+        created_date TEXT
+    )''',
+    '''CREATE TABLE IF NOT EXISTS withdrawals (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        user_id INTEGER,
+        amount INTEGER,
+        withdrawal_id TEXT UNIQUE,
+        status TEXT DEFAULT 'pending',
+        created_date TEXT
+    )''',
+    '''CREATE TABLE IF NOT EXISTS stats (
+        id INTEGER PRIMARY KEY CHECK (id = 1),
+        total_users INTEGER DEFAULT 0,
+        total_bananas INTEGER DEFAULT 0,
+        total_stars INTEGER DEFAULT 0,
+        total_cakes INTEGER DEFAULT 0,
+        total_startL INTEGER DEFAULT 0,
+        total_startB INTEGER DEFAULT 0,
+        total_checks INTEGER DEFAULT 0,
+        total_activations INTEGER DEFAULT 0,
+        total_withdrawals INTEGER DEFAULT 0
+    )''',
+)
+
+# Счетчики таблицы stats поддерживаются триггерами при любом изменении данных
+STATS_TRIGGERS = (
+    '''CREATE TRIGGER IF NOT EXISTS stats_users_insert AFTER INSERT ON users
+       BEGIN
+           UPDATE stats SET
+               total_users = total_users + 1,
+               total_bananas = total_bananas + IFNULL(NEW.bananas, 0),
+               total_stars = total_stars + IFNULL(NEW.stars, 0),
+               total_cakes = total_cakes + IFNULL(NEW.cakes, 0),
+               total_startL = total_startL + IFNULL(NEW.startL, 0),
+               total_startB = total_startB + IFNULL(NEW.startB, 0)
+           WHERE id = 1;
+       END''',
+    '''CREATE TRIGGER IF NOT EXISTS stats_users_update
+       AFTER UPDATE OF bananas, stars, cakes, startL, startB ON users
+       BEGIN
+           UPDATE stats SET
+               total_bananas = total_bananas + IFNULL(NEW.bananas, 0) - IFNULL(OLD.bananas, 0),
+               total_stars = total_stars + IFNULL(NEW.stars, 0) - IFNULL(OLD.stars, 0),
+               total_cakes = total_cakes + IFNULL(NEW.cakes, 0) - IFNULL(OLD.cakes, 0),
+               total_startL = total_startL + IFNULL(NEW.startL, 0) - IFNULL(OLD.startL, 0),
+               total_startB = total_startB + IFNULL(NEW.startB, 0) - IFNULL(OLD.startB, 0)
+           WHERE id = 1;
+       END''',
+    '''CREATE TRIGGER IF NOT EXISTS stats_users_delete AFTER DELETE ON users
+       BEGIN
+           UPDATE stats SET
+               total_users = total_users - 1,
+               total_bananas = total_bananas - IFNULL(OLD.bananas, 0),
+               total_stars = total_stars - IFNULL(OLD.stars, 0),
+               total_cakes = total_cakes - IFNULL(OLD.cakes, 0),
+               total_startL = total_startL - IFNULL(OLD.startL, 0),
+               total_startB = total_startB - IFNULL(OLD.startB, 0)
+           WHERE id = 1;
+       END''',
+    '''CREATE TRIGGER IF NOT EXISTS stats_checks_insert AFTER INSERT ON checks
+       BEGIN
+           UPDATE stats SET
+               total_checks = total_checks + 1,
+               total_activations = total_activations + IFNULL(NEW.activations, 0)
+           WHERE id = 1;
+       END''',
+    '''CREATE TRIGGER IF NOT EXISTS stats_checks_update AFTER UPDATE OF activations ON checks
+       BEGIN
+           UPDATE stats SET
+               total_activations = total_activations + IFNULL(NEW.activations, 0) - IFNULL(OLD.activations, 0)
+           WHERE id = 1;
+       END''',
+    '''CREATE TRIGGER IF NOT EXISTS stats_checks_delete AFTER DELETE ON checks
+       BEGIN
+           UPDATE stats SET
+               total_checks = total_checks - 1,
+               total_activations = total_activations - IFNULL(OLD.activations, 0)
+           WHERE id = 1;
+       END''',
+    '''CREATE TRIGGER IF NOT EXISTS stats_withdrawals_insert AFTER INSERT ON withdrawals
+       BEGIN
+           UPDATE stats SET total_withdrawals = total_withdrawals + 1 WHERE id = 1;
+       END''',
+    '''CREATE TRIGGER IF NOT EXISTS stats_withdrawals_delete AFTER DELETE ON withdrawals
+       BEGIN
+           UPDATE stats SET total_withdrawals = total_withdrawals - 1 WHERE id = 1;
+       END''',
+)
+
+BASE_INDEXES = (
+    "CREATE INDEX IF NOT EXISTS idx_users_username ON users (username COLLATE NOCASE, user_id)",
+    "CREATE INDEX IF NOT EXISTS idx_transactions_status_created ON transactions (status, created_date)",
+)
+
+# Поиск по status у transactions обслуживает idx_transactions_status_created
+HOT_PATH_INDEXES = (
+    "CREATE INDEX IF NOT EXISTS idx_transactions_user_id ON transactions (user_id)",
+    "CREATE INDEX IF NOT EXISTS idx_withdrawals_status_created ON withdrawals (status, created_date)",
+    "CREATE INDEX IF NOT EXISTS idx_withdrawals_user_id ON withdrawals (user_id)",
+    "CREATE INDEX IF NOT EXISTS idx_check_activations_user_id ON check_activations (user_id)",
+    "CREATE INDEX IF NOT EXISTS idx_checks_is_active ON checks (is_active)",
+)
+
+BROADCASTS_TABLE = '''CREATE TABLE IF NOT EXISTS broadcasts (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    text TEXT,
+    status TEXT DEFAULT 'running',
+    last_user_id INTEGER DEFAULT 0,
+    sent INTEGER DEFAULT 0,
+    blocked INTEGER DEFAULT 0,
+    failed INTEGER DEFAULT 0,
+    creator_id INTEGER,
+    created_date TEXT,
+    finished_date TEXT
+)'''
+
+FSM_SCHEMA = (
+    '''CREATE TABLE IF NOT EXISTS fsm (
+        key TEXT PRIMARY KEY,
+        state TEXT,
+        data TEXT,
+        expires_at REAL
+    )''',
+    "CREATE INDEX IF NOT EXISTS idx_fsm_expires_at ON fsm (expires_at)",
+)
+
+
+async def _base_schema(db):
+    """Таблицы, счетчики stats и индексы, созданные до появления миграций"""
+    async with db._connection() as conn:
+        for sql in BASE_TABLES + STATS_TRIGGERS + BASE_INDEXES:
+            await conn.execute(sql)
+        cursor = await conn.execute("INSERT OR IGNORE INTO stats (id) VALUES (1)")
+        stats_created = cursor.rowcount == 1
+        await conn.commit()
+
+    if stats_created:
+        await db.rebuild_stats()
+
+
+async def _hot_path_indexes(db):
+    await _execute_each(db, HOT_PATH_INDEXES)
+
+
+async def _broadcasts(db):
+    """Таблица рассылок и пометка пользователей, заблокировавших бота"""
+    async with db._connection() as conn:
+        cursor = await conn.execute("SELECT 1 FROM pragma_table_info('users') WHERE name = 'blocked'")
+        if await cursor.fetchone() is None:
+            # Столбец с константой по умолчанию добавляется без перезаписи таблицы
+            await conn.execute("ALTER TABLE users ADD COLUMN blocked INTEGER DEFAULT 0")
+        await conn.execute(BROADCASTS_TABLE)
+        await conn.commit()
+
+
+async def _broadcasts_status_index(db):
+    await _execute_each(db, ("CREATE INDEX IF NOT EXISTS idx_broadcasts_status ON broadcasts (status)",))
+
+
+async def _fsm_storage(db):
+    """Таблица SQLiteStorage; раньше ее создавал сам SQLiteStorage.start"""
+    await _execute_each(db, FSM_SCHEMA)
+
+
+MIGRATIONS = (
+    (1, "базовая схема", _base_schema),
+    (2, "индексы горячих запросов", _hot_path_indexes),
+    (3, "рассылки", _broadcasts),
+    (4, "индекс статуса рассылок", _broadcasts_status_index),
+    (5, "FSM-хранилище", _fsm_storage),
+)
+
+SCHEMA_VERSION = MIGRATIONS[-1][0]
+
+
+async def _execute_each(db, statements):
+    """Выполняет операторы по одному в отдельных транзакциях"""
+    for sql in statements:
+        async with db._connection() as conn:
+            await conn.execute(sql)
+            await conn.commit()
+        # Даем пройти запросам бота между тяжелыми операторами
+        await asyncio.sleep(0)
+
+
+async def get_version(db):
+    async with db._connection() as conn:
+        cursor = await conn.execute("PRAGMA user_version")
+        return (await cursor.fetchone())[0]
+
+
+async def migrate(db):
+    """Применяет недостающие миграции; возвращает (версия до, версия после)"""
+    before = current = await get_version(db)
+    for version, description, apply in MIGRATIONS:
+        if version <= current:
+            continue
+        logger.info("Миграция схемы %d: %s", version, description)
+        await apply(db)
+        async with db._connection() as conn:
+            await conn.execute(f"PRAGMA user_version = {version}")
+            await conn.commit()
+        current = version
+    return before, current
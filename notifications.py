@@ -0,0 +1,124 @@
+import asyncio
+import logging
+
+from aiogram.exceptions import TelegramAPIError, TelegramBadRequest, TelegramNetworkError, \
+    TelegramRetryAfter, TelegramServerError
+
+from outbound import PRIORITY_ADMIN, send_priority
+
+logger = logging.getLogger(__name__)
+
+# Заголовки сводок, когда за интервал набралось несколько событий одного вида
+DIGEST_TITLES = {
+    'check_activated': "🎫 **Чек `{key}`: +{count} активаций**",
+    'check_exhausted': "🔚 **Использовано чеков: {count}**",
+    'deposit': "💰 **Пополнений баланса: {count}**",
+    'support': "🤝 **Поддержек бота: {count}**",
+    'withdrawal': "💸 **Новых заявок на вывод: {count}**",
+}
+
+
+class AdminNotifier:
+    """Копит уведомления админу и отправляет их сводками раз в interval.
+
+    События группируются по виду и ключу (например, коду чека): одиночное
+    уходит полным текстом, несколько — одним сообщением со строкой на каждое.
+    Ошибки отправки повторяются с экспоненциальной задержкой.
+    """
+
+    def __init__(self, chat_id, interval=10.0, max_lines=20, max_attempts=5, retry_delay=1.0):
+        self.chat_id = chat_id
+        self.interval = interval
+        self.max_lines = max_lines
+        self.max_attempts = max_attempts
+        self.retry_delay = retry_delay
+        self.bot = None
+        self._groups = {}
+        self._stopping = asyncio.Event()
+        self._task = None
+
+    async def start(self, bot):
+        self.bot = bot
+        if self._task is None:
+            self._stopping.clear()
+            self._task = asyncio.create_task(self._flush_loop())
+
+    async def stop(self):
+        if self._task is not None:
+            self._stopping.set()
+            await self._task
+            self._task = None
+        await self.flush()
+
+    def notify(self, kind, text, line, key=None, amount=None):
+        """Ставит событие в очередь; text — полное уведомление, line — строка для сводки"""
+        group = self._groups.get((kind, key))
+        if group is None:
+            group = {'count': 0, 'text': text, 'lines': [], 'amount': 0}
+            self._groups[(kind, key)] = group
+        group['count'] += 1
+        if len(group['lines']) < self.max_lines:
+            group['lines'].append(line)
+        if amount:
+            group['amount'] += amount
+
+    async def flush(self):
+        """Отправляет накопленные события, по сообщению на группу"""
+        if not self._groups or self.bot is None:
+            return
+        groups, self._groups = self._groups, {}
+        for (kind, key), group in groups.items():
+            if group['count'] == 1:
+                await self._send(group['text'])
+            else:
+                await self._send(self._digest(kind, key, group))
+
+    def _digest(self, kind, key, group):
+        lines = [
+            DIGEST_TITLES[kind].format(key=key, count=group['count']) + f" за последние {self.interval:g} с"
+        ]
+        if group['amount']:
+            lines.append(f"💰 Сумма: {group['amount']} звезд")
+        lines.append("")
+        lines.extend(group['lines'])
+        hidden = group['count'] - len(group['lines'])
+        if hidden:
+            lines.append(f"… и еще {hidden}")
+        return "\n".join(lines)
+
+    async def _send(self, text):
+        parse_mode = "Markdown"
+        delay = self.retry_delay
+        for attempt in range(1, self.max_attempts + 1):
+            try:
+                with send_priority(PRIORITY_ADMIN):
+                    await self.bot.send_message(self.chat_id, text, parse_mode=parse_mode)
+                return True
+            except TelegramRetryAfter as e:
+                await asyncio.sleep(e.retry_after)
+                continue
+            except TelegramBadRequest:
+                if parse_mode is None:
+                    logger.exception("Telegram отклонил уведомление админу")
+                    return False
+                # Разметку ломают username с подчеркиваниями — отправляем без нее
+                parse_mode = None
+                continue
+            except (TelegramNetworkError, TelegramServerError) as e:
+                logger.warning("Не удалось отправить уведомление админу (попытка %d): %s", attempt, e)
+            except TelegramAPIError:
+                logger.exception("Не удалось отправить уведомление админу")
+                return False
+            await asyncio.sleep(delay)
+            delay *= 2
+
+        logger.error("Уведомление админу не отправлено после %d попыток", self.max_attempts)
+        return False
+
+    async def _flush_loop(self):
+        while not self._stopping.is_set():
+            try:
+                await asyncio.wait_for(self._stopping.wait(), self.interval)
+            except asyncio.TimeoutError:
+                pass
+            await self.flush()
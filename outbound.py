@@ -0,0 +1,198 @@
+import asyncio
+import heapq
+import itertools
+import logging
+import time
+from collections import OrderedDict
+from contextlib import contextmanager
+from contextvars import ContextVar
+
+from aiogram.client.session.middlewares.base import BaseRequestMiddleware
+from aiogram.exceptions import TelegramRetryAfter
+
+logger = logging.getLogger(__name__)
+
+# Классы приоритета исходящих запросов: меньше — раньше
+PRIORITY_REPLY = 0
+PRIORITY_ADMIN = 1
+PRIORITY_BROADCAST = 2
+
+_priority = ContextVar('send_priority', default=PRIORITY_REPLY)
+_background = set()
+
+
+@contextmanager
+def send_priority(level):
+    """Задает класс приоритета для запросов к Bot API внутри блока"""
+    token = _priority.set(level)
+    try:
+        yield
+    finally:
+        _priority.reset(token)
+
+
+def send_in_background(request, priority=PRIORITY_REPLY):
+    """Отправляет запрос, не дожидаясь ответа; ошибки пишутся в лог"""
+    async def run():
+        _priority.set(priority)
+        try:
+            await request
+        except Exception:
+            logger.exception("Не удалось выполнить фоновую отправку")
+
+    task = asyncio.create_task(run())
+    _background.add(task)
+    task.add_done_callback(_background.discard)
+    return task
+
+
+def fan_out(requests, concurrency=10, priority=PRIORITY_BROADCAST):
+    """Отправляет пачку запросов в фоне, не больше concurrency одновременно"""
+    semaphore = asyncio.Semaphore(concurrency)
+
+    async def send(request):
+        async with semaphore:
+            try:
+                await request
+            except Exception:
+                logger.exception("Не удалось выполнить фоновую отправку")
+
+    async def run():
+        _priority.set(priority)
+        await asyncio.gather(*(send(request) for request in requests))
+
+    task = asyncio.create_task(run())
+    _background.add(task)
+    task.add_done_callback(_background.discard)
+    return task
+
+
+async def wait_background():
+    """Дожидается фоновых отправок, например перед остановкой бота"""
+    while _background:
+        await asyncio.gather(*_background, return_exceptions=True)
+
+
+class TokenBucket:
+    """Токены пополняются со скоростью rate в секунду, но не больше capacity"""
+
+    __slots__ = ('rate', 'capacity', 'tokens', 'updated')
+
+    def __init__(self, rate, capacity):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated = time.monotonic()
+
+    def _refill(self):
+        now = time.monotonic()
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def try_take(self):
+        self._refill()
+        if self.tokens >= 1:
+            self.tokens -= 1
+            return True
+        return False
+
+    def reserve(self):
+        """Занимает токен, при необходимости в долг, и возвращает время ожидания"""
+        self._refill()
+        self.tokens -= 1
+        return 0.0 if self.tokens >= 0 else -self.tokens / self.rate
+
+    def wait_time(self):
+        self._refill()
+        return 0.0 if self.tokens >= 1 else (1 - self.tokens) / self.rate
+
+    def pause(self, seconds):
+        """Забирает токены на seconds секунд вперед (ответ 429 с retry_after)"""
+        self._refill()
+        self.tokens = min(self.tokens, 0) - seconds * self.rate
+
+
+class PriorityGate:
+    """Выдает токены общего ведра ожидающим в порядке приоритета"""
+
+    def __init__(self, bucket):
+        self.bucket = bucket
+        self._waiters = []
+        self._seq = itertools.count()
+        self._task = None
+
+    async def acquire(self, priority):
+        if not self._waiters and self.bucket.try_take():
+            return
+        future = asyncio.get_running_loop().create_future()
+        heapq.heappush(self._waiters, (priority, next(self._seq), future))
+        if self._task is None or self._task.done():
+            self._task = asyncio.create_task(self._release())
+        await future
+
+    async def _release(self):
+        while self._waiters:
+            delay = self.bucket.wait_time()
+            if delay:
+                await asyncio.sleep(delay)
+                continue
+            _, _, future = heapq.heappop(self._waiters)
+            # Отмененный запрос токен не тратит
+            if not future.done():
+                self.bucket.try_take()
+                future.set_result(None)
+
+
+class OutboundLimiter(BaseRequestMiddleware):
+    """Ограничивает отправку в чаты лимитами Telegram.
+
+    Общее ведро на rate запросов в секунду раздается по приоритету
+    (ответы пользователям, затем уведомления админу, затем рассылки),
+    у каждого чата свое ведро на chat_rate с запасом chat_burst.
+    На 429 чат ставится на паузу на retry_after и запрос повторяется.
+    on_wait(seconds, method_name), если задан, получает время ожидания лимитов.
+    """
+
+    def __init__(self, rate=30, chat_rate=1, chat_burst=3, max_retries=3, max_chats=100000):
+        self.gate = PriorityGate(TokenBucket(rate, max(rate, 1)))
+        self.chat_rate = chat_rate
+        self.chat_burst = chat_burst
+        self.max_retries = max_retries
+        self.max_chats = max_chats
+        self.on_wait = None
+        self._chats = OrderedDict()
+
+    async def __call__(self, make_request, bot, method):
+        chat_id = getattr(method, 'chat_id', None)
+        if chat_id is None:
+            return await make_request(bot, method)
+
+        priority = _priority.get()
+        for attempt in range(self.max_retries + 1):
+            started = time.perf_counter()
+            bucket = self._chat_bucket(chat_id)
+            delay = bucket.reserve()
+            if delay:
+                await asyncio.sleep(delay)
+            await self.gate.acquire(priority)
+            if self.on_wait is not None:
+                self.on_wait(time.perf_counter() - started, type(method).__name__)
+            try:
+                return await make_request(bot, method)
+            except TelegramRetryAfter as e:
+                if attempt == self.max_retries:
+                    raise
+                logger.warning("Bot API просит подождать %s с перед отправкой в чат %s", e.retry_after, chat_id)
+                bucket.pause(e.retry_after)
+
+    def _chat_bucket(self, chat_id):
+        bucket = self._chats.get(chat_id)
+        if bucket is None:
+            bucket = TokenBucket(self.chat_rate, self.chat_burst)
+            self._chats[chat_id] = bucket
+            # Давно не писавшие чаты вытесняются: их ведра и так полные
+            while len(self._chats) > self.max_chats:
+                self._chats.popitem(last=False)
+        else:
+            self._chats.move_to_end(chat_id)
+        return bucket
@@ -0,0 +1,48 @@
+import asyncio
+import logging
+from datetime import datetime, timedelta
+
+logger = logging.getLogger(__name__)
+
+
+class PendingPaymentSweeper:
+    """Фоновая уборка счетов, которые так и не оплатили.
+
+    Раз в interval помечает транзакции в статусе pending старше max_age
+    как expired. Обход идет по индексу (status, created_date) пачками.
+    """
+
+    def __init__(self, db, max_age=24 * 60 * 60, interval=10 * 60, batch_size=500):
+        self.db = db
+        self.max_age = max_age
+        self.interval = interval
+        self.batch_size = batch_size
+        self._task = None
+
+    async def start(self):
+        if self._task is None:
+            self._task = asyncio.create_task(self._sweep_loop())
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+    async def sweep(self):
+        created_before = (datetime.now() - timedelta(seconds=self.max_age)).isoformat()
+        return await self.db.expire_pending_transactions(created_before, self.batch_size)
+
+    async def _sweep_loop(self):
+        while True:
+            try:
+                expired = await self.sweep()
+            except Exception:
+                logger.exception("Не удалось просрочить неоплаченные транзакции")
+            else:
+                if expired:
+                    logger.info("Просрочено неоплаченных транзакций: %d", expired)
+            await asyncio.sleep(self.interval)
@@ -0,0 +1,212 @@
+import asyncio
+import logging
+import multiprocessing
+import queue as queue_module
+import secrets
+from functools import partial
+
+from aiohttp import web
+
+import cfg
+from database import Database
+from webhook import concurrency_limit, serve_webhook, webhook_secret
+
+logger = logging.getLogger(__name__)
+
+SHARD_QUEUE_SIZE = 10000
+
+
+def shard_key(update):
+    """id пользователя, от которого пришел апдейт (или чата, если пользователя нет)"""
+    for value in update.values():
+        if not isinstance(value, dict):
+            continue
+        sender = value.get('from') or value.get('user')
+        if sender:
+            return sender['id']
+        chat = value.get('chat')
+        if chat:
+            return chat['id']
+    return 0
+
+
+class UserSerializer:
+    """Апдейты одного пользователя выполняются строго по порядку, разных — параллельно.
+
+    Слот из limit занимается только когда предыдущий апдейт того же
+    пользователя завершен, поэтому очередь одного флудящего пользователя
+    держит не больше одного слота. max_pending ограничивает число принятых,
+    но еще не выполненных апдейтов, чтобы не читать очередь шарда бесконечно.
+    """
+
+    def __init__(self, limit, max_pending=SHARD_QUEUE_SIZE):
+        self._semaphore = asyncio.Semaphore(limit)
+        self._pending = asyncio.Semaphore(max_pending)
+        self._tails = {}
+        self._tasks = set()
+
+    async def submit(self, key, coro):
+        await self._pending.acquire()
+        task = asyncio.create_task(self._run(self._tails.get(key), coro))
+        self._tails[key] = task
+        self._tasks.add(task)
+        task.add_done_callback(partial(self._done, key))
+
+    async def join(self):
+        if self._tasks:
+            await asyncio.wait(self._tasks)
+
+    async def _run(self, previous, coro):
+        if previous is not None:
+            await asyncio.wait([previous])
+        async with self._semaphore:
+            try:
+                await coro
+            except Exception:
+                logger.exception("Ошибка обработки апдейта")
+
+    def _done(self, key, task):
+        self._pending.release()
+        self._tasks.discard(task)
+        if self._tails.get(key) is task:
+            del self._tails[key]
+
+
+def worker_main(index, updates, ready, settings):
+    """Точка входа процесса-обработчика"""
+    # Дочерний процесс запускается через spawn: переносим настройки родителя
+    for name, value in settings.items():
+        setattr(cfg, name, value)
+    if cfg.metrics_port:
+        cfg.metrics_port += index
+    asyncio.run(_run_worker(index, updates, ready))
+
+
+async def _run_worker(index, updates, ready):
+    # handlers создает Database при импорте, поэтому импорт после настройки cfg
+    import bot as app
+    from aiogram import Dispatcher
+    from handlers import router, db, check_cache, qk_pool, broadcaster
+
+    # Чеки и qK-коды общие для всех процессов: кэш чеков отключаем,
+    # а совпадения кодов ловит уникальный индекс при регистрации
+    check_cache.enabled = False
+    qk_pool.preload = False
+    # Баланс пользователя меняют и другие процессы (админ, возвраты, поддержка),
+    # а инвалидация кэша локальна: кэш пользователей в обработчиках отключен
+    db.user_cache.maxsize = 0
+    # Прерванные рассылки продолжает один процесс, остановка видна всем через базу
+    broadcaster.resume = index == 0
+    bot = app.create_bot()
+    await app.on_startup(bot)
+
+    dp = Dispatcher(storage=app.storage)
+    dp.include_router(router)
+    serializer = UserSerializer(cfg.worker_concurrency)
+    loop = asyncio.get_running_loop()
+    ready.set()
+    logger.info("Обработчик %d запущен", index)
+
+    try:
+        while True:
+            item = await loop.run_in_executor(None, updates.get)
+            if item is None:
+                break
+            user_id, update = item
+            await serializer.submit(user_id, dp.feed_raw_update(bot, update))
+        await serializer.join()
+    finally:
+        await app.on_shutdown()
+        await bot.session.close()
+
+
+class ShardRouter:
+    """Раскладывает апдейты по очередям процессов по хэшу user_id"""
+
+    def __init__(self, queues):
+        self.queues = queues
+
+    async def dispatch(self, update):
+        user_id = shard_key(update)
+        shard = self.queues[hash(user_id) % len(self.queues)]
+        item = (user_id, update)
+        try:
+            shard.put_nowait(item)
+        except queue_module.Full:
+            await asyncio.get_running_loop().run_in_executor(None, shard.put, item)
+
+
+async def run_sharded(bot, allowed_updates, stop=None):
+    """Принимает апдейты в этом процессе и обрабатывает их в cfg.workers процессах"""
+    db = Database(cfg.db_path)
+    await db.connect()
+    await db.create_tables()
+    await db.close()
+
+    context = multiprocessing.get_context("spawn")
+    settings = {name: value for name, value in vars(cfg).items() if not name.startswith('_')}
+    queues = [context.Queue(SHARD_QUEUE_SIZE) for _ in range(cfg.workers)]
+    events = [context.Event() for _ in range(cfg.workers)]
+    processes = [
+        context.Process(target=worker_main, args=(index, queues[index], events[index], settings), daemon=True)
+        for index in range(cfg.workers)
+    ]
+    for process in processes:
+        process.start()
+
+    loop = asyncio.get_running_loop()
+    for event in events:
+        await loop.run_in_executor(None, event.wait)
+    logger.info("Запущено обработчиков: %d", cfg.workers)
+
+    router = ShardRouter(queues)
+    if cfg.mode == "webhook":
+        receiver = asyncio.create_task(_receive_webhook(bot, router, allowed_updates))
+    else:
+        receiver = asyncio.create_task(_receive_polling(bot, router, allowed_updates))
+
+    try:
+        if stop is None:
+            await receiver
+        else:
+            await stop.wait()
+    finally:
+        receiver.cancel()
+        try:
+            await receiver
+        except asyncio.CancelledError:
+            pass
+        for shard in queues:
+            await loop.run_in_executor(None, shard.put, None)
+        for process in processes:
+            await loop.run_in_executor(None, process.join)
+
+
+async def _receive_polling(bot, router, allowed_updates):
+    await bot.delete_webhook(drop_pending_updates=True)
+    offset = None
+    while True:
+        try:
+            updates = await bot.get_updates(offset=offset, timeout=10, allowed_updates=allowed_updates)
+        except Exception:
+            logger.exception("Ошибка получения апдейтов")
+            await asyncio.sleep(1)
+            continue
+        for update in updates:
+            offset = update.update_id + 1
+            await router.dispatch(update.model_dump(mode="json", by_alias=True, exclude_none=True))
+
+
+async def _receive_webhook(bot, router, allowed_updates):
+    secret = webhook_secret()
+
+    async def handle(request):
+        token = request.headers.get("X-Telegram-Bot-Api-Secret-Token", "")
+        if not secrets.compare_digest(token, secret):
+            return web.Response(body="Unauthorized", status=401)
+        await router.dispatch(await request.json())
+        return web.json_response({})
+
+    app = web.Application(middlewares=[concurrency_limit(cfg.webhook_concurrency)])
+    app.router.add_route("POST", cfg.webhook_path, handle)
+    await serve_webhook(app, bot, allowed_updates)
@@ -0,0 +1,155 @@
+import asyncio
+import json
+import logging
+import time
+
+import aiosqlite
+from aiogram.fsm.state import State
+from aiogram.fsm.storage.base import BaseStorage, DefaultKeyBuilder
+
+from cache import LRUCache
+
+logger = logging.getLogger(__name__)
+
+
+class SQLiteStorage(BaseStorage):
+    """FSM-хранилище в SQLite с TTL, кэшем в памяти и пакетной записью.
+
+    Состояния читаются из ограниченного LRU-кэша, изменения копятся и
+    записываются одной транзакцией раз в flush_interval. Сессии, которые
+    не менялись дольше ttl, считаются пустыми и удаляются фоновой чисткой.
+    Таблицу fsm создает миграция схемы, поэтому start вызывается после
+    Database.create_tables.
+    """
+
+    def __init__(self, db_path, ttl=24 * 60 * 60, cache_size=10000, flush_interval=1.0, sweep_interval=10 * 60):
+        self.db_path = db_path
+        self.ttl = ttl
+        self.flush_interval = flush_interval
+        self.sweep_interval = sweep_interval
+        self.cache = LRUCache(cache_size, ttl)
+        self.key_builder = DefaultKeyBuilder(with_bot_id=True, with_destiny=True)
+        self._dirty = {}
+        self._flushing = {}
+        self._conn = None
+        self._stopping = asyncio.Event()
+        self._task = None
+
+    async def start(self):
+        self._conn = await aiosqlite.connect(self.db_path)
+        await self._conn.execute("PRAGMA journal_mode = WAL")
+        await self._conn.execute("PRAGMA synchronous = NORMAL")
+        self._stopping.clear()
+        self._task = asyncio.create_task(self._background())
+
+    async def close(self):
+        # Фоновый цикл не отменяется: отмена посреди записи потеряла бы вынутые сессии
+        if self._task is not None:
+            self._stopping.set()
+            await self._task
+            self._task = None
+        if self._conn is not None:
+            await self.flush()
+            await self._conn.close()
+            self._conn = None
+
+    async def set_state(self, key, state=None):
+        entry = await self._entry(key)
+        entry['state'] = state.state if isinstance(state, State) else state
+        self._touch(key, entry)
+
+    async def get_state(self, key):
+        return (await self._entry(key))['state']
+
+    async def set_data(self, key, data):
+        entry = await self._entry(key)
+        entry['data'] = dict(data)
+        self._touch(key, entry)
+
+    async def get_data(self, key):
+        return dict((await self._entry(key))['data'])
+
+    async def flush(self):
+        """Записывает накопленные изменения одной транзакцией"""
+        if not self._dirty:
+            return
+        dirty, self._dirty = self._dirty, {}
+        # Пока запись не закоммичена, промах кэша читает сессию отсюда, а не старую строку из базы
+        self._flushing = dirty
+        upserts = []
+        deletes = []
+        for name, (state, data, expires_at) in dirty.items():
+            if state is None and not data:
+                deletes.append((name,))
+            else:
+                upserts.append((name, state, json.dumps(data, ensure_ascii=False), expires_at))
+        try:
+            await self._conn.executemany(
+                '''INSERT INTO fsm (key, state, data, expires_at) VALUES (?, ?, ?, ?)
+                   ON CONFLICT (key) DO UPDATE SET
+                       state = excluded.state, data = excluded.data, expires_at = excluded.expires_at''',
+                upserts
+            )
+            await self._conn.executemany("DELETE FROM fsm WHERE key = ?", deletes)
+            await self._conn.commit()
+        except BaseException as e:
+            # Не затираем более свежие изменения, сделанные во время записи
+            for name, value in dirty.items():
+                self._dirty.setdefault(name, value)
+            if not isinstance(e, Exception):
+                raise
+            logger.exception("Не удалось записать %d FSM-сессий", len(dirty))
+            await self._conn.rollback()
+        finally:
+            self._flushing = {}
+
+    async def sweep(self):
+        """Удаляет просроченные сессии из базы"""
+        cursor = await self._conn.execute("DELETE FROM fsm WHERE expires_at < ?", (time.time(),))
+        await self._conn.commit()
+        return cursor.rowcount
+
+    async def _entry(self, key):
+        name = self.key_builder.build(key)
+        entry = self.cache.get(name)
+        if entry is not None:
+            return entry
+
+        pending = self._dirty.get(name)
+        if pending is None:
+            pending = self._flushing.get(name)
+        if pending is not None:
+            entry = {'state': pending[0], 'data': dict(pending[1])}
+        else:
+            entry = await self._load(name)
+        self.cache.put(name, entry)
+        return entry
+
+    async def _load(self, name):
+        cursor = await self._conn.execute(
+            "SELECT state, data FROM fsm WHERE key = ? AND expires_at >= ?",
+            (name, time.time())
+        )
+        row = await cursor.fetchone()
+        if row is None:
+            return {'state': None, 'data': {}}
+        return {'state': row[0], 'data': json.loads(row[1]) if row[1] else {}}
+
+    def _touch(self, key, entry):
+        name = self.key_builder.build(key)
+        self.cache.put(name, entry)
+        self._dirty[name] = (entry['state'], dict(entry['data']), time.time() + self.ttl)
+
+    async def _background(self):
+        last_sweep = time.monotonic()
+        while not self._stopping.is_set():
+            try:
+                await asyncio.wait_for(self._stopping.wait(), self.flush_interval)
+            except asyncio.TimeoutError:
+                pass
+            await self.flush()
+            if time.monotonic() - last_sweep >= self.sweep_interval:
+                last_sweep = time.monotonic()
+                removed = await self.sweep()
+                if removed:
+                    logger.info("Удалено просроченных FSM-сессий: %d", removed)
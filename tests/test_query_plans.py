@@ -0,0 +1,12 @@
+import asyncio
+
+from benchmarks.datagen import generate
+from benchmarks.query_plans import check
+
+
+def test_query_plans(tmp_path):
+    """Каждый публичный метод Database проверен, полных сканирований вне методов обхода нет"""
+    db_path = str(tmp_path / "plans.db")
+    asyncio.run(generate(db_path, 300))
+    failures = check(db_path)
+    assert failures == [], "\n".join(failures)
@@ -1,34 +1,127 @@
+import asyncio
+import logging
 import random
+import secrets
 import string
+from collections import deque
 
+logger = logging.getLogger(__name__)
 
-async def generate_qk_code(db):
-    """Генерирует уникальный qK-код"""
-    while True:
-        letters = ''.join(random.choices(string.ascii_uppercase, k=2))
-        numbers = ''.join(random.choices(string.digits, k=7))
-
-        code_parts = []
-        num_index = 0
-
-        for i in range(len(letters) + len(numbers)):
-            if random.random() < 0.3 and len(code_parts) < len(letters) + len(numbers):
-                if any(c.isalpha() for c in code_parts):
-                    if num_index < len(numbers):
-                        code_parts.append(numbers[num_index])
-                        num_index += 1
-                else:
-                    code_parts.append(letters[0])
-                    letters = letters[1:]
-            else:
+CHECK_CODE_ALPHABET = string.ascii_uppercase + string.digits
+
+
+def random_qk_code():
+    """Собирает случайный qK-код без проверки уникальности"""
+    letters = ''.join(random.choices(string.ascii_uppercase, k=2))
+    numbers = ''.join(random.choices(string.digits, k=7))
+
+    code_parts = []
+    num_index = 0
+
+    for i in range(len(letters) + len(numbers)):
+        if random.random() < 0.3 and len(code_parts) < len(letters) + len(numbers):
+            if any(c.isalpha() for c in code_parts):
                 if num_index < len(numbers):
                     code_parts.append(numbers[num_index])
                     num_index += 1
-                elif letters:
-                    code_parts.append(letters[0])
-                    letters = letters[1:]
+            else:
+                code_parts.append(letters[0])
+                letters = letters[1:]
+        else:
+            if num_index < len(numbers):
+                code_parts.append(numbers[num_index])
+                num_index += 1
+            elif letters:
+                code_parts.append(letters[0])
+                letters = letters[1:]
+
+    return f"qK-{''.join(code_parts)}"
+
+
+def generate_check_codes(count, length=12):
+    """Генерирует count разных случайных кодов чеков.
+
+    Код — единственное, что нужно для активации, поэтому берется из secrets.
+    """
+    codes = set()
+    while len(codes) < count:
+        codes.add(''.join(secrets.choice(CHECK_CODE_ALPHABET) for _ in range(length)))
+    return list(codes)
+
+
+def check_link(bot_username, check_code):
+    return f"https://t.me/{bot_username}?start={check_code}"
 
-        qk_code = f"qK-{''.join(code_parts)}"
+
+async def generate_qk_code(db):
+    """Генерирует уникальный qK-код"""
+    while True:
+        qk_code = random_qk_code()
 
         if not await db.qk_exists(qk_code):
-            return qk_code
\ No newline at end of file
+            return qk_code
+
+
+class QkCodePool:
+    """Пул заранее проверенных уникальных qK-кодов.
+
+    При старте загружает все занятые коды в память, после чего выдача
+    кода не требует обращения к базе. Пул пополняется в фоне.
+    С preload=False индекс не загружается: редкие совпадения с уже
+    занятыми кодами ловит уникальный индекс базы при регистрации.
+    """
+
+    def __init__(self, db, size=1000, low_watermark=250, preload=True):
+        self.db = db
+        self.size = size
+        self.low_watermark = low_watermark
+        self.preload = preload
+        self._known = set()
+        self._codes = deque()
+        self._refill = asyncio.Event()
+        self._task = None
+
+    async def start(self):
+        if self.preload:
+            self._known = await self.db.get_all_qk_codes()
+            logger.info("Загружено %d qK-кодов", len(self._known))
+        self._fill()
+        self._task = asyncio.create_task(self._refill_loop())
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+    def take(self):
+        """Выдает свободный qK-код за O(1)"""
+        if len(self._codes) <= self.low_watermark:
+            self._refill.set()
+        if self._codes:
+            return self._codes.popleft()
+        return self._new_code()
+
+    def release(self, qk_code):
+        """Возвращает неиспользованный код в пул"""
+        self._codes.append(qk_code)
+
+    def _new_code(self):
+        while True:
+            qk_code = random_qk_code()
+            if qk_code not in self._known:
+                self._known.add(qk_code)
+                return qk_code
+
+    def _fill(self):
+        while len(self._codes) < self.size:
+            self._codes.append(self._new_code())
+
+    async def _refill_loop(self):
+        while True:
+            await self._refill.wait()
+            self._refill.clear()
+            self._fill()
@@ -0,0 +1,76 @@
+import asyncio
+import logging
+import secrets
+
+from aiohttp import web
+from aiogram.webhook.aiohttp_server import SimpleRequestHandler
+
+import cfg
+
+logger = logging.getLogger(__name__)
+
+
+def concurrency_limit(limit):
+    """aiohttp middleware: не больше limit одновременно обрабатываемых апдейтов"""
+    semaphore = asyncio.Semaphore(limit)
+
+    @web.middleware
+    async def middleware(request, handler):
+        async with semaphore:
+            return await handler(request)
+
+    return middleware
+
+
+def webhook_secret():
+    """Секрет вебхука; если в cfg он пуст, генерируется случайный на время работы процесса.
+
+    Без секрета любой, кто достучится до эндпоинта, может прислать апдейт
+    от имени админа, поэтому проверка включена всегда.
+    """
+    if not cfg.webhook_secret:
+        cfg.webhook_secret = secrets.token_urlsafe(32)
+        logger.info("webhook_secret не задан: сгенерирован случайный")
+    return cfg.webhook_secret
+
+
+def build_app(dp, bot):
+    """Создает aiohttp приложение, принимающее апдейты на cfg.webhook_path"""
+    app = web.Application(middlewares=[concurrency_limit(cfg.webhook_concurrency)])
+    # Апдейт обрабатывается внутри запроса: лимит выше действительно ограничивает нагрузку
+    handler = SimpleRequestHandler(
+        dispatcher=dp,
+        bot=bot,
+        secret_token=webhook_secret(),
+        handle_in_background=False
+    )
+    # Только маршрут, без register: тот закрыл бы сессию бота при остановке сервера,
+    # раньше чем on_shutdown отправит последние уведомления
+    app.router.add_route("POST", cfg.webhook_path, handler.handle)
+    return app
+
+
+async def run_webhook(dp, bot):
+    await serve_webhook(build_app(dp, bot), bot, dp.resolve_used_update_types())
+
+
+async def serve_webhook(app, bot, allowed_updates):
+    """Запускает приложение на cfg.webhook_port и регистрирует вебхук в Telegram"""
+    runner = web.AppRunner(app, keepalive_timeout=cfg.webhook_keepalive, access_log=None)
+    await runner.setup()
+    site = web.TCPSite(runner, cfg.webhook_host, cfg.webhook_port)
+    await site.start()
+
+    await bot.set_webhook(
+        url=cfg.webhook_url + cfg.webhook_path,
+        secret_token=webhook_secret(),
+        max_connections=cfg.webhook_max_connections,
+        allowed_updates=allowed_updates,
+        drop_pending_updates=True
+    )
+    logger.info("Вебхук слушает %s:%s%s", cfg.webhook_host, cfg.webhook_port, cfg.webhook_path)
+
+    try:
+        await asyncio.Event().wait()
+    finally:
+        await runner.cleanup()